@@ -1,8 +1,9 @@
 import time
+import numpy as np
 import tensorflow as tf
 import tf_extend as tfe
 from nets import ssd_vgg_300
-from datasets import pascalvoc_2007
+from datasets import pascalvoc_2007, pascalvoc_common
 import tensorflow.contrib.slim as slim
 from preprocessing import ssd_vgg_preprocessing
 
@@ -12,7 +13,8 @@ class RunnerEval(object):
     def __init__(self, batch_size=2, num_class=21, net_model=ssd_vgg_300, image_shape=(300, 300),
                  dataset_name=pascalvoc_2007, dataset_dir="./data/test", dataset_split_name="test",
                  eval_resize=4, data_format="NHWC", ckpt_path="./checkpoints/ssd_300_vgg.ckpt",
-                 matching_threshold=0.5, select_threshold=0.01, select_top_k=400, keep_top_k=200, nms_threshold=0.45):
+                 matching_threshold=0.5, select_threshold=0.01, select_top_k=400, keep_top_k=200, nms_threshold=0.45,
+                 num_shards=1, shard_index=0, num_epochs=None, net_kwargs=None, num_samples=None):
 
         # 参数
         with tf.name_scope("param"):
@@ -23,6 +25,17 @@ class RunnerEval(object):
             self.dataset_name = dataset_name
             self.dataset_split_name = dataset_split_name
             self.dataset = dataset_name.get_split(dataset_split_name, dataset_dir, None, None)
+            # 分片验证：只读取第shard_index份TFRecord文件
+            self.num_shards = num_shards
+            self.shard_index = shard_index
+            if self.num_shards > 1:
+                self.dataset = pascalvoc_common.get_shard(self.dataset, self.num_shards, self.shard_index)
+            # 样本数：默认是划分的大小，只验证部分图片（比如抽样验证）时为实际的图片数
+            if num_samples is not None:
+                self.dataset = slim.dataset.Dataset(
+                    data_sources=self.dataset.data_sources, reader=self.dataset.reader, decoder=self.dataset.decoder,
+                    num_samples=num_samples, items_to_descriptions=self.dataset.items_to_descriptions,
+                    num_classes=self.dataset.num_classes, labels_to_names=self.dataset.labels_to_names)
 
             # 模型相关参数
             self.net_model = net_model
@@ -36,7 +49,12 @@ class RunnerEval(object):
             # 验证相关参数
             self.batch_size = batch_size
             self.eval_resize = eval_resize
-            self.max_batches = self.dataset.num_samples // self.batch_size
+            # num_epochs=1：每张图片只验证一次，最后一个批次可以不满
+            self.num_epochs = num_epochs
+            if self.num_epochs is None:
+                self.max_batches = self.dataset.num_samples // self.batch_size
+            else:
+                self.max_batches = -(-self.dataset.num_samples * self.num_epochs // self.batch_size)
 
             # 选择边界框相关参数
             self.matching_threshold = matching_threshold
@@ -47,14 +65,16 @@ class RunnerEval(object):
             pass
 
         # 网络和default boxes
-        self.ssd_net = net_model.SSDNet(self.net_params)
+        # net_kwargs：SSDNet的其他参数，比如剪枝后的depths、fused_heads
+        self.ssd_net = net_model.SSDNet(self.net_params, **(net_kwargs or {}))
         # anchors[0]和anchors[1]按顺序记录每个点的坐标。anchors[2]和anchors[3]记录了k个默认框的高度和宽度
         self.ssd_anchors = self.ssd_net.anchors(self.image_shape)
 
         # 数据：预处理，encode，批次
         # g_scores是（当前默认框与真实框的交）占（真实框）的比例
         image, g_labels, g_bboxes, g_diff, g_bbox_img, g_classes, g_localisations, g_scores = self._get_data_tensor(
-            self.dataset, batch_size=self.batch_size, data_format=self.data_format, eval_resize=self.eval_resize)
+            self.dataset, batch_size=self.batch_size, data_format=self.data_format, eval_resize=self.eval_resize,
+            num_epochs=self.num_epochs)
 
         # 网络：net,loss
         r_predictions, r_localisations, r_logits, r_end_points, r_total_loss = self._get_net_tensor(
@@ -66,9 +86,11 @@ class RunnerEval(object):
             r_localisations = self.ssd_net.bboxes_decode(r_localisations, self.ssd_anchors)
             r_scores, r_bboxes = self.ssd_net.detected_bboxes(r_predictions, r_localisations, self.select_threshold,
                                                               self.nms_threshold, None, self.select_top_k, self.keep_top_k)
+            # 每张图片的匹配结果：num_g_bboxes, tp, fp, r_scores
+            self.matching = self._get_matching_tensor(r_scores, r_bboxes, g_labels, g_bboxes,
+                                                      g_diff, self.matching_threshold)
             # Metrics
-            self.metrics = self._get_metrics_tensor(r_scores, r_bboxes, g_labels, g_bboxes,
-                                                    g_diff, self.matching_threshold)
+            self.metrics = self._get_metrics_tensor(*self.matching)
             pass
 
         self.sess = tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True)))
@@ -120,13 +142,17 @@ class RunnerEval(object):
         threads = tf.train.start_queue_runners(sess=self.sess, coord=coord)
 
         results = []
-        for batch_index in range(num_batches if num_batches else self.max_batches):
-            start_time = time.time()
-            results = self.sess.run(run_list)
-            run_time = time.time() - start_time
-            if func_print is not None:  # 打印
-                func_print(results, batch_index, run_time)
-            pass
+        try:
+            for batch_index in range(num_batches if num_batches else self.max_batches):
+                start_time = time.time()
+                results = self.sess.run(run_list)
+                run_time = time.time() - start_time
+                if func_print is not None and func_print(results, batch_index, run_time):  # 打印，返回True时提前结束
+                    break
+                pass
+        except tf.errors.OutOfRangeError:
+            # num_epochs不为None时，数据读完就结束
+            print("Done {} epoch(s) of {} samples".format(self.num_epochs, self.dataset.num_samples))
 
         # 最终结果
         if func_final_print is not None:
@@ -139,12 +165,48 @@ class RunnerEval(object):
         coord.join(threads)
         pass
 
-    # 获取度量
+    def eval_shard(self, result_name, print_1_freq=20):
+        """
+        eval the shard and save the accumulated TP/FP/score arrays of every class
+
+        :param result_name: 保存结果的.npz文件，用RunnerEvalShard.merge合并
+        :param print_1_freq:
+        :return: result_name
+        """
+        tp_fp_values = self.metrics[3][0]
+
+        def func_print(run_result, batch_index, run_time):
+            if batch_index % print_1_freq == 0:
+                print("shard {}/{} {} time={}".format(self.shard_index, self.num_shards, batch_index, run_time))
+            pass
+
+        def func_final_print(run_result):
+            # 每一类：(num_gbboxes, num_detections, tp, fp, scores)
+            values = self.sess.run(tp_fp_values)
+            arrays = {}
+            for c, (num_gbboxes, num_detections, tp, fp, scores) in values.items():
+                arrays["num_gbboxes_%d" % c] = num_gbboxes
+                arrays["tp_%d" % c] = tp
+                arrays["fp_%d" % c] = fp
+                arrays["scores_%d" % c] = scores
+            np.savez(result_name, **arrays)
+            print("shard {}/{} saved in {}".format(self.shard_index, self.num_shards, result_name))
+            pass
+
+        self.run(self.run_list, func_print=func_print, func_final_print=func_final_print)
+        return result_name
+
+    # 匹配检测框和真实框
     @staticmethod
-    def _get_metrics_tensor(r_scores, r_bboxes, g_labels, g_bboxes, g_diff, matching_threshold):
+    def _get_matching_tensor(r_scores, r_bboxes, g_labels, g_bboxes, g_diff, matching_threshold):
         # Compute TP and FP statistics.
         num_g_bboxes, tp, fp, r_scores = tfe.bboxes_matching_batch(
             r_scores.keys(), r_scores, r_bboxes, g_labels, g_bboxes, g_diff, matching_threshold)
+        return [num_g_bboxes, tp, fp, r_scores]
+
+    # 获取度量
+    @staticmethod
+    def _get_metrics_tensor(num_g_bboxes, tp, fp, r_scores):
         # 字典
         dict_metrics, aps_voc07, aps_voc12 = {}, {}, {}
         # FP and TP metrics.
@@ -177,10 +239,11 @@ class RunnerEval(object):
         pass
 
     # 获取数据
-    def _get_data_tensor(self, dataset, batch_size, data_format, eval_resize):
+    def _get_data_tensor(self, dataset, batch_size, data_format, eval_resize, num_epochs=None):
         # 数据
         provider = slim.dataset_data_provider.DatasetDataProvider(
-            dataset, common_queue_capacity=2 * batch_size, common_queue_min=batch_size, shuffle=False)
+            dataset, common_queue_capacity=2 * batch_size, common_queue_min=batch_size, shuffle=False,
+            num_epochs=num_epochs)
         # 提取数据
         [image, labels, bboxes, diff] = provider.get(['image', 'object/label', 'object/bbox', 'object/difficult'])
 
@@ -193,7 +256,8 @@ class RunnerEval(object):
 
         # reshape_list：拉直
         batch_tensors = self._reshape_list([image, labels, bboxes, diff, bbox_img, classes, localisations, scores])
-        r = tf.train.batch(batch_tensors, batch_size=batch_size, capacity=5 * batch_size, dynamic_pad=True)
+        r = tf.train.batch(batch_tensors, batch_size=batch_size, capacity=5 * batch_size, dynamic_pad=True,
+                           allow_smaller_final_batch=num_epochs is not None)
 
         # reshape_list：变成原来的形状
         return self._reshape_list(r, shape=[1] * 5 + [len(self.ssd_anchors)] * 3)
@@ -0,0 +1,142 @@
+import time
+import numpy as np
+
+from nets import np_methods
+from RunnerSSDEvalRaw import RunnerEvalRaw
+
+
+"""
+按特征层和默认框形状统计验证结果：候选框数、NMS后保留数、TP、召回率，以及去掉该层（或该形状）后mAP的下降
+"""
+
+
+class RunnerEvalDiagnose(object):
+
+    def __init__(self, select_threshold=0.01, select_top_k=400, keep_top_k=200, nms_threshold=0.45,
+                 matching_threshold=0.5, ablation="layer", **raw_kwargs):
+        """
+        :param ablation: "layer"：去掉每一层计算mAP的下降；"anchor"：另外去掉每一种默认框形状；None：不计算
+        :param raw_kwargs: 传给RunnerEvalRaw的参数
+        """
+        self.select_threshold = select_threshold
+        self.select_top_k = select_top_k
+        self.keep_top_k = keep_top_k
+        self.nms_threshold = nms_threshold
+        self.matching_threshold = matching_threshold
+        self.ablation = ablation
+
+        self.raw = RunnerEvalRaw(**raw_kwargs)
+        self.num_class = self.raw.num_class
+
+        # 每个默认框所属的层和形状，形状编号为：层的偏移 + 层内的默认框下标
+        params = self.raw.ssd_net.params
+        self.anchor_layers, anchor_shapes = np_methods.ssd_anchors_index(self.raw.ssd_anchors)
+        num_shapes = [y_x_h_w[2].size for y_x_h_w in self.raw.ssd_anchors]
+        shape_offsets = np.concatenate([[0], np.cumsum(num_shapes)[:-1]])
+        self.anchor_groups = shape_offsets[self.anchor_layers] + anchor_shapes
+        self.layer_names = list(params.feat_layers)
+        self.group_layers = np.repeat(np.arange(len(num_shapes)), num_shapes)
+        self.group_names = []
+        for i, layer in enumerate(self.layer_names):
+            self.group_names.extend(["{} {}".format(layer, name) for name in
+                                     self.anchor_shape_names(params.anchor_sizes[i], params.anchor_ratios[i])])
+        pass
+
+    @staticmethod
+    def anchor_shape_names(sizes, ratios):
+        # 和ssd_anchor_one_layer中默认框的顺序一致
+        names = ["{:g}px 1:1".format(sizes[0])]
+        if len(sizes) > 1:
+            names.append("{:g}px 1:1".format(np.sqrt(sizes[0] * sizes[1])))
+        names.extend(["{:g}px {:.2g}:1".format(sizes[0], r) for r in ratios])
+        return names
+
+    def _match(self, detections, glabels, gbboxes, gdifficults):
+        classes, scores, bboxes, anchors = detections
+        return np_methods.bboxes_matching_image(classes, scores, bboxes, glabels, gbboxes, gdifficults,
+                                                self.num_class, self.matching_threshold)
+
+    def _detect(self, predictions, localisations, anchors_mask=None):
+        return np_methods.ssd_bboxes_select_per_class(
+            predictions, localisations, self.select_threshold, self.nms_threshold, self.select_top_k,
+            self.keep_top_k, self.num_class, anchors_mask)
+
+    def _m_ap(self, records):
+        # records: 每张图片的(num_gbboxes, classes, tp, fp, scores)
+        return np_methods.mean_average_precision(records, self.num_class)[0]
+
+    def run(self, num_images=None, print_freq=100):
+        num_groups = len(self.group_names)
+        candidates = np.zeros(num_groups, dtype=np.int64)
+        kept = np.zeros(num_groups, dtype=np.int64)
+        true_positives = np.zeros(num_groups, dtype=np.int64)
+        num_objects = 0
+
+        # 消融：每一组去掉的默认框
+        ablations = {}
+        if self.ablation in ("layer", "anchor"):
+            for i, name in enumerate(self.layer_names):
+                ablations[name] = self.anchor_layers != i
+        if self.ablation == "anchor":
+            for g, name in enumerate(self.group_names):
+                ablations[name] = self.anchor_groups != g
+        records = []
+        ablation_records = {name: [] for name in ablations}
+
+        start_time = time.time()
+        for image_index, raw in enumerate(self.raw.outputs(num_images)):
+            predictions, localisations, glabels, gbboxes, gdifficults, bbox_img = raw
+
+            # 筛选前的候选框：(默认框, 类别)的得分大于select_threshold
+            scores = np.concatenate([np.reshape(p, (-1, p.shape[-1])) for p in predictions], 0)[:, 1:]
+            candidates += np.bincount(self.anchor_groups, weights=np.sum(scores >= self.select_threshold, axis=1),
+                                      minlength=num_groups).astype(np.int64)
+
+            detections = self._detect(predictions, localisations)
+            num_gbboxes, tp, fp = self._match(detections, glabels, gbboxes, gdifficults)
+            groups = self.anchor_groups[detections[3]]
+            kept += np.bincount(groups, minlength=num_groups)
+            true_positives += np.bincount(groups[tp], minlength=num_groups)
+            num_objects += sum(num_gbboxes.values())
+            records.append((num_gbboxes, detections[0], tp, fp, detections[1]))
+
+            for name, anchors_mask in ablations.items():
+                a_detections = self._detect(predictions, localisations, anchors_mask)
+                a_num_gbboxes, a_tp, a_fp = self._match(a_detections, glabels, gbboxes, gdifficults)
+                ablation_records[name].append((a_num_gbboxes, a_detections[0], a_tp, a_fp, a_detections[1]))
+
+            if image_index % print_freq == 0:
+                print("{} time={}".format(image_index, time.time() - start_time))
+            pass
+
+        m_ap = self._m_ap(records)
+        m_ap_drops = {name: m_ap - self._m_ap(r) for name, r in ablation_records.items()}
+        report = self.report(candidates, kept, true_positives, num_objects, m_ap, m_ap_drops)
+        return m_ap, report
+
+    def report(self, candidates, kept, true_positives, num_objects, m_ap, m_ap_drops):
+        """
+        打印并返回每一层和每一种默认框形状的：candidates, kept, tp, recall, mAP_drop
+        """
+        report = {}
+        for i, name in enumerate(self.layer_names):
+            mask = self.group_layers == i
+            report[name] = (int(candidates[mask].sum()), int(kept[mask].sum()), int(true_positives[mask].sum()),
+                            true_positives[mask].sum() / max(num_objects, 1), m_ap_drops.get(name))
+        for g, name in enumerate(self.group_names):
+            report[name] = (int(candidates[g]), int(kept[g]), int(true_positives[g]),
+                            true_positives[g] / max(num_objects, 1), m_ap_drops.get(name))
+
+        print("mAP_voc_07={} objects={}".format(m_ap, num_objects))
+        print("{:<24}{:>12}{:>10}{:>8}{:>10}{:>10}".format("group", "candidates", "kept", "tp", "recall", "mAP_drop"))
+        for name in self.layer_names + self.group_names:
+            c, k, tp, recall, drop = report[name]
+            print("{:<24}{:>12}{:>10}{:>8}{:>10.4f}{:>10}".format(
+                name, c, k, tp, recall, "-" if drop is None else "{:.4f}".format(drop)))
+        return report
+
+    pass
+
+if __name__ == '__main__':
+    runner = RunnerEvalDiagnose(ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt", ablation="layer")
+    runner.run(num_images=500)
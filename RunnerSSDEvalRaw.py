@@ -0,0 +1,76 @@
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from nets import ssd_vgg_300
+from datasets import pascalvoc_2007
+from preprocessing import ssd_vgg_preprocessing
+
+
+"""
+逐张图片运行网络，返回解码后的原始输出和真实框，后处理（筛选、NMS、匹配）交给numpy
+"""
+
+
+class RunnerEvalRaw(object):
+
+    def __init__(self, num_class=21, net_model=ssd_vgg_300, image_shape=(300, 300),
+                 dataset_name=pascalvoc_2007, dataset_dir="./data/test", dataset_split_name="test",
+                 eval_resize=ssd_vgg_preprocessing.Resize.WARP_RESIZE, data_format="NHWC",
+                 ckpt_path="./checkpoints/ssd_300_vgg.ckpt", decode=True):
+        """
+        :param decode: False时返回网络输出的编码后的localisations（相对于默认框的偏移），不解码
+        """
+        # 数据相关参数
+        self.num_class = num_class
+        self.data_format = data_format
+        self.dataset = dataset_name.get_split(dataset_split_name, dataset_dir, None, None)
+
+        # 模型相关参数
+        self.image_shape = image_shape
+        self.ckpt_path = tf.train.latest_checkpoint(ckpt_path) if tf.gfile.IsDirectory(ckpt_path) else ckpt_path
+        self.ssd_net = net_model.SSDNet(net_model.SSDNet.default_params._replace(num_classes=self.num_class))
+        self.ssd_anchors = self.ssd_net.anchors(self.image_shape)
+
+        # 数据：每张图片只读一次
+        provider = slim.dataset_data_provider.DatasetDataProvider(
+            self.dataset, common_queue_capacity=2, common_queue_min=1, shuffle=False, num_epochs=1)
+        [image, labels, bboxes, diff] = provider.get(['image', 'object/label', 'object/bbox', 'object/difficult'])
+        image, labels, bboxes, bbox_img = ssd_vgg_preprocessing.preprocess_for_eval(
+            image, labels, bboxes, self.image_shape, data_format, resize=eval_resize, difficults=None)
+
+        # 网络：只解码，不筛选
+        with slim.arg_scope(self.ssd_net.arg_scope(data_format=data_format)):
+            predictions, localisations, _, _ = self.ssd_net.net(tf.expand_dims(image, 0), is_training=False)
+        if decode:
+            localisations = self.ssd_net.bboxes_decode(localisations, self.ssd_anchors)
+
+        self.run_list = [predictions, localisations, labels, bboxes, diff, bbox_img]
+        self.sess = tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True)))
+        pass
+
+    def outputs(self, num_images=None):
+        """
+        Generator of the raw outputs of every image of the split.
+
+        :param num_images: None表示所有图片
+        :return: predictions, localisations, glabels, gbboxes, gdifficults, bbox_img
+        """
+        self.sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        print("Evaluating {}".format(self.ckpt_path))
+        tf.train.Saver(var_list=slim.get_variables_to_restore()).restore(sess=self.sess, save_path=self.ckpt_path)
+
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=self.sess, coord=coord)
+        try:
+            image_index = 0
+            while num_images is None or image_index < num_images:
+                yield self.sess.run(self.run_list)
+                image_index += 1
+        except tf.errors.OutOfRangeError:
+            pass
+        finally:
+            coord.request_stop()
+            coord.join(threads)
+        pass
+
+    pass
@@ -0,0 +1,182 @@
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from nets import ssd_vgg_300, np_methods
+from datasets import pascalvoc_2007, pascalvoc_common, dataset_utils
+from RunnerSSDEval import RunnerEval
+
+
+"""
+分层抽样验证：按照每一类的图片数抽取有代表性的子集，用bootstrap估计mAP的置信区间，区间足够窄时提前结束
+"""
+
+
+class RunnerEvalSample(object):
+
+    def __init__(self, sample_size=1000, sample_dir="./data/eval_sample", seed=4242, num_class=21,
+                 net_model=ssd_vgg_300, dataset_name=pascalvoc_2007, dataset_dir="./data/test",
+                 dataset_split_name="test", batch_size=2, **runner_kwargs):
+        """
+        :param sample_size: 最多验证的图片数
+        :param sample_dir: 保存抽样后的TFRecord的目录
+        :param seed: 抽样和bootstrap的随机种子
+        :param runner_kwargs: 传给RunnerEval的其他参数
+        """
+        self.sample_size = sample_size
+        self.sample_dir = sample_dir
+        self.seed = seed
+        self.num_class = num_class
+
+        # 抽样：每张图片的类别 -> 分层的顺序 -> 写入新的TFRecord
+        dataset = dataset_name.get_split(dataset_split_name, dataset_dir, None, None)
+        filenames = sorted(tf.gfile.Glob(dataset.data_sources))
+        labels = pascalvoc_common.read_labels(filenames)
+        self.sample_indexes = self.stratified_order(labels, self.num_class, self.seed)[:self.sample_size]
+
+        if not tf.gfile.Exists(self.sample_dir):
+            tf.gfile.MakeDirs(self.sample_dir)
+        sample_name = (dataset_name.FILE_PATTERN % dataset_split_name).replace("*", "000")
+        dataset_utils.write_tfrecords_subset(filenames, self.sample_indexes, os.path.join(self.sample_dir, sample_name))
+        print("Sampled {} of {} images in {}".format(len(self.sample_indexes), len(labels), self.sample_dir))
+
+        # num_epochs=1：按照抽样的顺序每张图片只验证一次，样本数是抽样的图片数
+        self.runner = RunnerEval(batch_size=batch_size, num_class=num_class, net_model=net_model,
+                                 dataset_name=dataset_name, dataset_dir=self.sample_dir,
+                                 dataset_split_name=dataset_split_name, num_epochs=1,
+                                 num_samples=len(self.sample_indexes), **runner_kwargs)
+        pass
+
+    @staticmethod
+    def stratified_order(labels, num_classes, seed=4242):
+        """
+        Order images so that every prefix is a stratified sample: at each step, take an unused image
+        of the class whose fraction of already taken images is the smallest.
+
+        :param labels: 每张图片的类别
+        :return: 图片的下标
+        """
+        rng = np.random.RandomState(seed)
+        class_images = [[] for _ in range(num_classes)]
+        for i, label in enumerate(labels):
+            for c in set(label.tolist()):
+                if 0 < c < num_classes:
+                    class_images[c].append(i)
+            pass
+        classes = [c for c in range(1, num_classes) if class_images[c]]
+        for c in classes:
+            rng.shuffle(class_images[c])
+
+        used = np.zeros(len(labels), dtype=bool)
+        taken = np.zeros(num_classes, dtype=np.float64)
+        pointers = np.zeros(num_classes, dtype=np.int64)
+        order = []
+        while classes:
+            # 被选中比例最小的类
+            c = min(classes, key=lambda k: taken[k] / len(class_images[k]))
+            while pointers[c] < len(class_images[c]) and used[class_images[c][pointers[c]]]:
+                pointers[c] += 1
+            if pointers[c] == len(class_images[c]):
+                classes.remove(c)
+                continue
+            i = class_images[c][pointers[c]]
+            used[i] = True
+            order.append(i)
+            for k in set(labels[i].tolist()):
+                if 0 < k < num_classes:
+                    taken[k] += 1
+            pass
+
+        # 没有物体的图片放在最后
+        rest = np.where(np.logical_not(used))[0]
+        rng.shuffle(rest)
+        return order + rest.tolist()
+
+    @staticmethod
+    def bootstrap(images, num_classes, num_bootstrap=200, confidence=0.95, rng=None):
+        """
+        Bootstrap the mAP over the evaluated images.
+
+        :param images: 每张图片每一类的(num_gbboxes, tp, fp, scores)
+        :return: mAP_voc_07, mAP_voc_12, (low, high)：mAP_voc_07的置信区间
+        """
+        rng = np.random.RandomState() if rng is None else rng
+        num_images = len(images)
+
+        # 每一类：所有检测框所属的图片，tp，fp，score
+        per_class = {}
+        for c in range(1, num_classes):
+            num_gbboxes = np.array([image[c][0] for image in images], dtype=np.int64)
+            image_ids = np.concatenate([np.full(image[c][1].size, i, dtype=np.int64) for i, image in enumerate(images)])
+            tp = np.concatenate([image[c][1] for image in images])
+            fp = np.concatenate([image[c][2] for image in images])
+            scores = np.concatenate([image[c][3] for image in images])
+            per_class[c] = (num_gbboxes, image_ids, tp, fp, scores)
+            pass
+
+        def m_ap(counts):
+            aps_07, aps_12 = [], []
+            for c, (num_gbboxes, image_ids, tp, fp, scores) in per_class.items():
+                repeats = counts[image_ids]
+                ap_07, ap_12 = np_methods.average_precision(np.sum(counts * num_gbboxes), np.repeat(tp, repeats),
+                                                            np.repeat(fp, repeats), np.repeat(scores, repeats))
+                aps_07.append(ap_07)
+                aps_12.append(ap_12)
+            return np.mean(aps_07), np.mean(aps_12)
+
+        mAP_voc_07, mAP_voc_12 = m_ap(np.ones(num_images, dtype=np.int64))
+        samples = [m_ap(np.bincount(rng.randint(0, num_images, num_images), minlength=num_images))[0]
+                   for _ in range(num_bootstrap)]
+        alpha = (1. - confidence) / 2. * 100.
+        interval = (np.percentile(samples, alpha), np.percentile(samples, 100. - alpha))
+        return mAP_voc_07, mAP_voc_12, interval
+
+    def run(self, target_width=0.02, confidence=0.95, num_bootstrap=200, check_freq=25, min_batches=25):
+        """
+        :param target_width: mAP_voc_07置信区间的宽度小于target_width时提前结束
+        :param check_freq: 每check_freq个批次计算一次置信区间
+        :param min_batches: 至少验证的批次数
+        :return: mAP_voc_07, mAP_voc_12, (low, high), 验证的图片数
+        """
+        rng = np.random.RandomState(self.seed)
+        images = []
+        estimate = {}
+        start_time = time.time()
+
+        def func_estimate():
+            estimate["num_images"] = len(images)
+            estimate["value"] = self.bootstrap(images, self.num_class, num_bootstrap, confidence, rng)
+            mAP_voc_07, mAP_voc_12, (low, high) = estimate["value"]
+            print("{} images time={} : mAP_voc_07={} [{}, {}] mAP_voc_12={}".format(
+                len(images), time.time() - start_time, mAP_voc_07, low, high, mAP_voc_12))
+            return high - low
+
+        def func_print(run_result, batch_index, run_time):
+            # 每张图片每一类：(num_gbboxes, tp, fp, scores)，和streaming_tp_fp_arrays一样去掉无效的框
+            num_g_bboxes, tp, fp, scores = run_result
+            for b in range(len(num_g_bboxes[1])):
+                image = {}
+                for c in num_g_bboxes.keys():
+                    mask = np.logical_and(np.logical_or(tp[c][b], fp[c][b]), scores[c][b] > 1e-4)
+                    image[c] = (num_g_bboxes[c][b], tp[c][b][mask], fp[c][b][mask], scores[c][b][mask])
+                images.append(image)
+                pass
+            if batch_index + 1 >= min_batches and (batch_index + 1) % check_freq == 0:
+                return func_estimate() < target_width
+            return False
+
+        def func_final_print(run_result):
+            if estimate.get("num_images") != len(images):
+                func_estimate()
+            pass
+
+        self.runner.run(self.runner.matching, func_print=func_print, func_final_print=func_final_print)
+        mAP_voc_07, mAP_voc_12, interval = estimate["value"]
+        return mAP_voc_07, mAP_voc_12, interval, len(images)
+
+    pass
+
+if __name__ == '__main__':
+    runner = RunnerEvalSample(sample_size=1000, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt", batch_size=8)
+    runner.run(target_width=0.02)
@@ -0,0 +1,99 @@
+import os
+import time
+import importlib
+import multiprocessing
+import numpy as np
+
+from nets import ssd_vgg_300, np_methods
+from datasets import pascalvoc_2007
+
+
+"""
+多进程分片验证：每个进程验证一部分TFRecord文件，最后合并TP/FP/score计算全局的AP
+"""
+
+
+# 子进程入口：模块不能pickle，所以传模块名
+def _eval_shard(shard_index, num_shards, result_name, device, net_model_name, dataset_name_name, runner_kwargs):
+    if device is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+    # 在子进程中才导入TensorFlow
+    from RunnerSSDEval import RunnerEval
+    runner = RunnerEval(net_model=importlib.import_module(net_model_name),
+                        dataset_name=importlib.import_module(dataset_name_name),
+                        num_shards=num_shards, shard_index=shard_index, num_epochs=1, **runner_kwargs)
+    return runner.eval_shard(result_name)
+
+
+class RunnerEvalShard(object):
+
+    def __init__(self, num_shards=4, result_dir="./eval_shards", devices=None,
+                 net_model=ssd_vgg_300, dataset_name=pascalvoc_2007, **runner_kwargs):
+        """
+        :param num_shards: 进程数，每个进程一份TFRecord文件
+        :param result_dir: 保存每个分片结果的目录
+        :param devices: CUDA_VISIBLE_DEVICES的列表，例如["0", "1"]，分片轮流使用；None表示不设置，""表示只用CPU
+        :param runner_kwargs: 传给RunnerEval的其他参数
+        """
+        self.num_shards = num_shards
+        self.result_dir = result_dir
+        self.devices = devices
+        self.net_model = net_model
+        self.dataset_name = dataset_name
+        self.runner_kwargs = runner_kwargs
+
+        if not os.path.exists(self.result_dir):
+            os.makedirs(self.result_dir)
+        pass
+
+    def run(self):
+        start_time = time.time()
+
+        shard_args = []
+        for shard_index in range(self.num_shards):
+            result_name = os.path.join(self.result_dir, "shard_{:03d}.npz".format(shard_index))
+            device = self.devices[shard_index % len(self.devices)] if self.devices else None
+            shard_args.append((shard_index, self.num_shards, result_name, device, self.net_model.__name__,
+                               self.dataset_name.__name__, self.runner_kwargs))
+            pass
+
+        # spawn：每个子进程有自己干净的TensorFlow运行时
+        pool = multiprocessing.get_context("spawn").Pool(processes=self.num_shards)
+        try:
+            result_names = pool.starmap(_eval_shard, shard_args)
+        finally:
+            pool.close()
+            pool.join()
+
+        print("all shards time is {}".format(time.time() - start_time))
+        return self.merge(result_names)
+
+    @staticmethod
+    def merge(result_names):
+        """
+        合并每个分片的TP/FP/score，计算每一类的AP和mAP
+        """
+        shards = [np.load(result_name) for result_name in result_names]
+        classes = sorted(int(key[len("tp_"):]) for key in shards[0].keys() if key.startswith("tp_"))
+
+        aps_voc07, aps_voc12 = {}, {}
+        for c in classes:
+            num_gbboxes = sum(int(shard["num_gbboxes_%d" % c]) for shard in shards)
+            tp = np.concatenate([shard["tp_%d" % c] for shard in shards])
+            fp = np.concatenate([shard["fp_%d" % c] for shard in shards])
+            scores = np.concatenate([shard["scores_%d" % c] for shard in shards])
+            aps_voc07[c], aps_voc12[c] = np_methods.average_precision(num_gbboxes, tp, fp, scores)
+            pass
+
+        mAP_voc_07 = np.mean(list(aps_voc07.values()))
+        mAP_voc_12 = np.mean(list(aps_voc12.values()))
+        print("aps_voc07={}".format(aps_voc07))
+        print("aps_voc12={}".format(aps_voc12))
+        print("mAP_voc_07={} mAP_voc_12={}".format(mAP_voc_07, mAP_voc_12))
+        return aps_voc07, aps_voc12, mAP_voc_07, mAP_voc_12
+
+    pass
+
+if __name__ == '__main__':
+    runner = RunnerEvalShard(num_shards=4, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt", batch_size=16)
+    runner.run()
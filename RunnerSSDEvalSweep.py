@@ -0,0 +1,279 @@
+import os
+import time
+import itertools
+import numpy as np
+import tensorflow as tf
+
+from nets import np_methods, ssd_vgg_300
+
+
+"""
+后处理参数扫描：网络对每张图片只运行一次并缓存输出，然后对每一组select_threshold、top_k、keep_top_k、nms_threshold
+计算mAP和后处理耗时，输出Pareto前沿，用来选择RunnerEval和RunnerOneOrRealTime的阈值
+
+1. eval：RunnerEval的后处理，即TF图中的bboxes_decode + detected_bboxes（bboxes_sort、bboxes_nms_batch），
+   缓存的网络输出通过placeholder输入，耗时是这个图每张图片sess.run的时间（包括输入的拷贝）
+2. realtime：RunnerOneOrRealTime的后处理，即np_methods中的numpy筛选、排序和NMS
+
+缓存中记录了模型、图片数和min_select_threshold，和当前参数不同时重新运行网络
+"""
+
+
+class RunnerEvalSweep(object):
+
+    def __init__(self, cache_name="./eval_sweep/raw_outputs.npz", min_select_threshold=0.01, num_images=None,
+                 net_model=ssd_vgg_300, image_shape=(300, 300), ckpt_path="./checkpoints/ssd_300_vgg.ckpt",
+                 **raw_kwargs):
+        """
+        :param cache_name: 缓存网络输出的文件，存在且来源（ckpt_path、num_images、min_select_threshold等）相同时直接读取
+        :param min_select_threshold: 只缓存最大非背景得分不小于该值的默认框，扫描的select_threshold不能比它小
+        :param num_images: None表示所有图片
+        :param raw_kwargs: 传给RunnerEvalRaw的其他参数
+        """
+        self.cache_name = cache_name
+        self.min_select_threshold = min_select_threshold
+        self.net_model = net_model
+        self.image_shape = image_shape
+        ckpt_path = tf.train.latest_checkpoint(ckpt_path) if tf.gfile.IsDirectory(ckpt_path) else ckpt_path
+        sources = self.cache_sources(ckpt_path, num_images, min_select_threshold, net_model, image_shape)
+        if not self.is_cache_valid(self.cache_name, sources):
+            self.cache(self.cache_name, sources, min_select_threshold, num_images, net_model=net_model,
+                       image_shape=image_shape, ckpt_path=ckpt_path, **raw_kwargs)
+        self.images = self.load(self.cache_name)
+        self.num_class = self.images[0][0].shape[-1]
+
+        # TF后处理的输入：每一层的形状和默认框
+        self.ssd_net = net_model.SSDNet(net_model.SSDNet.default_params._replace(num_classes=self.num_class))
+        self.ssd_anchors = self.ssd_net.anchors(self.image_shape)
+        self.layer_shapes = [tuple(y.shape[:2]) + (h.size,) for y, _, h, _ in self.ssd_anchors]
+        self.layer_offsets = np.cumsum([0] + [int(np.prod(shape)) for shape in self.layer_shapes])
+        self.tf_graphs = {}
+        pass
+
+    @staticmethod
+    def cache_sources(ckpt_path, num_images, min_select_threshold, net_model, image_shape):
+        """
+        缓存的来源，保存在缓存中，读取时比较
+        """
+        return {"ckpt_path": str(ckpt_path), "num_images": -1 if num_images is None else int(num_images),
+                "min_select_threshold": float(min_select_threshold), "net_model": net_model.__name__,
+                "image_shape": list(image_shape)}
+
+    @staticmethod
+    def is_cache_valid(cache_name, sources):
+        if not os.path.exists(cache_name):
+            return False
+        cache = np.load(cache_name)
+        # 旧版本的缓存没有记录来源和编码后的localisations，当作过期
+        if any("source_" + key not in cache.files for key in sources) or "localisations" not in cache.files:
+            print("The cache {} has no sources, rebuilding it".format(cache_name))
+            return False
+        for key, value in sources.items():
+            cached = cache["source_" + key].tolist()
+            if cached != value:
+                print("The cache {} was built with {}={}, not {}, rebuilding it".format(cache_name, key, cached, value))
+                return False
+        return True
+
+    @staticmethod
+    def cache(cache_name, sources, min_select_threshold, num_images=None, **raw_kwargs):
+        """
+        运行网络并缓存每张图片的候选框（预测得分、编码后的localisations、解码后的框和默认框的编号）和真实框
+        """
+        from RunnerSSDEvalRaw import RunnerEvalRaw
+        raw = RunnerEvalRaw(decode=False, **raw_kwargs)
+
+        arrays = {"predictions": [], "localisations": [], "bboxes": [], "anchors": [],
+                  "glabels": [], "gbboxes": [], "gdifficults": []}
+        num_candidates, num_gbboxes = [], []
+        for predictions, localisations, glabels, gbboxes, gdifficults, bbox_img in raw.outputs(num_images):
+            bboxes = [np_methods.ssd_bboxes_decode(l, a, prior_scaling=raw.ssd_net.params.prior_scaling)
+                      for l, a in zip(localisations, raw.ssd_anchors)]
+            predictions = np.concatenate([np.reshape(p, (-1, p.shape[-1])) for p in predictions], 0)
+            localisations = np.concatenate([np.reshape(l, (-1, l.shape[-1])) for l in localisations], 0)
+            bboxes = np.concatenate([np.reshape(b, (-1, b.shape[-1])) for b in bboxes], 0)
+            mask = np.max(predictions[:, 1:], axis=1) >= min_select_threshold
+            arrays["predictions"].append(predictions[mask])
+            arrays["localisations"].append(localisations[mask])
+            arrays["bboxes"].append(bboxes[mask])
+            arrays["anchors"].append(np.where(mask)[0])
+            arrays["glabels"].append(glabels)
+            arrays["gbboxes"].append(np.reshape(gbboxes, (-1, 4)))
+            arrays["gdifficults"].append(gdifficults)
+            num_candidates.append(np.count_nonzero(mask))
+            num_gbboxes.append(glabels.size)
+            pass
+
+        if not os.path.exists(os.path.dirname(cache_name)):
+            os.makedirs(os.path.dirname(cache_name))
+        arrays = {key: np.concatenate(value, 0) for key, value in arrays.items()}
+        arrays.update({"source_" + key: np.array(value) for key, value in sources.items()})
+        np.savez(cache_name, num_candidates=np.array(num_candidates), num_gbboxes=np.array(num_gbboxes), **arrays)
+        print("Cached {} images in {}".format(len(num_candidates), cache_name))
+        pass
+
+    @staticmethod
+    def load(cache_name):
+        """
+        :return: 每张图片的(predictions, bboxes, localisations, anchors, glabels, gbboxes, gdifficults)
+        """
+        cache = np.load(cache_name)
+        candidates_offsets = np.concatenate([[0], np.cumsum(cache["num_candidates"])])
+        gbboxes_offsets = np.concatenate([[0], np.cumsum(cache["num_gbboxes"])])
+        predictions, bboxes = cache["predictions"], cache["bboxes"]
+        localisations, anchors = cache["localisations"], cache["anchors"]
+        glabels, gbboxes, gdifficults = cache["glabels"], cache["gbboxes"], cache["gdifficults"]
+
+        images = []
+        for i in range(len(cache["num_candidates"])):
+            c0, c1 = candidates_offsets[i], candidates_offsets[i + 1]
+            g0, g1 = gbboxes_offsets[i], gbboxes_offsets[i + 1]
+            images.append((predictions[c0:c1], bboxes[c0:c1], localisations[c0:c1], anchors[c0:c1],
+                           glabels[g0:g1], gbboxes[g0:g1], gdifficults[g0:g1]))
+        return images
+
+    def _tf_graph(self, top_k, keep_top_k):
+        """
+        RunnerEval的后处理图，每一组(top_k, keep_top_k)建立一次，select_threshold和nms_threshold通过placeholder输入
+        """
+        key = (top_k, keep_top_k)
+        if key not in self.tf_graphs:
+            graph = tf.Graph()
+            with graph.as_default():
+                predictions = [tf.placeholder(tf.float32, (1,) + shape + (self.num_class,))
+                               for shape in self.layer_shapes]
+                localisations = [tf.placeholder(tf.float32, (1,) + shape + (4,)) for shape in self.layer_shapes]
+                select_threshold = tf.placeholder(tf.float32, [])
+                nms_threshold = tf.placeholder(tf.float32, [])
+                r_localisations = self.ssd_net.bboxes_decode(localisations, self.ssd_anchors)
+                r_scores, r_bboxes = self.ssd_net.detected_bboxes(predictions, r_localisations, select_threshold,
+                                                                  nms_threshold, None, top_k, keep_top_k)
+            sess = tf.Session(graph=graph, config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True)))
+            self.tf_graphs[key] = (sess, predictions, localisations, select_threshold, nms_threshold,
+                                   [r_scores, r_bboxes])
+            pass
+        return self.tf_graphs[key]
+
+    def _dense_outputs(self, predictions, localisations, anchors):
+        """
+        还原网络的完整输出：没有缓存的默认框都是背景（非背景得分为0，比任何select_threshold都小）
+        """
+        dense_predictions = np.zeros((self.layer_offsets[-1], self.num_class), dtype=np.float32)
+        dense_predictions[:, 0] = 1.
+        dense_predictions[anchors] = predictions
+        dense_localisations = np.zeros((self.layer_offsets[-1], 4), dtype=np.float32)
+        dense_localisations[anchors] = localisations
+        layers = list(zip(self.layer_offsets[:-1], self.layer_offsets[1:], self.layer_shapes))
+        return ([np.reshape(dense_predictions[o0:o1], (1,) + shape + (self.num_class,)) for o0, o1, shape in layers],
+                [np.reshape(dense_localisations[o0:o1], (1,) + shape + (4,)) for o0, o1, shape in layers])
+
+    def _detect_tf(self, image, select_threshold, top_k, keep_top_k, nms_threshold):
+        predictions, _, localisations, anchors = image[:4]
+        sess, p_predictions, p_localisations, p_select_threshold, p_nms_threshold, fetches = self._tf_graph(
+            top_k, keep_top_k)
+        dense_predictions, dense_localisations = self._dense_outputs(predictions, localisations, anchors)
+        feed_dict = {p_select_threshold: select_threshold, p_nms_threshold: nms_threshold}
+        feed_dict.update(zip(p_predictions, dense_predictions))
+        feed_dict.update(zip(p_localisations, dense_localisations))
+
+        start_time = time.perf_counter()
+        r_scores, r_bboxes = sess.run(fetches, feed_dict=feed_dict)
+        run_time = time.perf_counter() - start_time
+
+        # 每一类补零到keep_top_k，得分为0的是补的
+        l_classes, l_scores, l_bboxes = [], [], []
+        for c in sorted(r_scores.keys()):
+            keep = r_scores[c][0] > 0.
+            l_classes.append(np.full(np.count_nonzero(keep), c, dtype=np.int64))
+            l_scores.append(r_scores[c][0][keep])
+            l_bboxes.append(r_bboxes[c][0][keep])
+        return (np.concatenate(l_classes, 0), np.concatenate(l_scores, 0),
+                np.reshape(np.concatenate(l_bboxes, 0), (-1, 4))), run_time
+
+    def _detect_numpy(self, image, select_threshold, top_k, keep_top_k, nms_threshold):
+        predictions, bboxes = image[:2]
+        start_time = time.perf_counter()
+        # 和RunnerOneOrRealTime.run_net一样：所有类一起排序，NMS
+        classes, scores, bboxes = np_methods.ssd_bboxes_select_layer(
+            predictions, bboxes, None, select_threshold=select_threshold, num_classes=self.num_class, decode=False)
+        bboxes = np_methods.bboxes_clip(np.array([0., 0., 1., 1.]), bboxes)
+        classes, scores, bboxes = np_methods.bboxes_sort(classes, scores, bboxes, top_k=top_k)
+        classes, scores, bboxes = np_methods.bboxes_nms(classes, scores, bboxes, nms_threshold)
+        classes, scores, bboxes = classes[:keep_top_k], scores[:keep_top_k], bboxes[:keep_top_k]
+        return (classes, scores, bboxes), time.perf_counter() - start_time
+
+    def evaluate(self, select_threshold=0.01, top_k=400, keep_top_k=200, nms_threshold=0.45, pipeline="eval",
+                 matching_threshold=0.5):
+        """
+        :param pipeline: "eval"：RunnerEval的后处理（TF图）；"realtime"：RunnerOneOrRealTime的后处理（numpy）
+        :return: mAP_voc_07, mAP_voc_12, 每张图片的平均后处理时间（毫秒）
+        """
+        if select_threshold < self.min_select_threshold:
+            raise ValueError("select_threshold {} is lower than the cached threshold {}".format(
+                select_threshold, self.min_select_threshold))
+        detect = self._detect_tf if pipeline == "eval" else self._detect_numpy
+        if pipeline == "eval" and self.images:
+            # 预热：第一次运行图较慢
+            detect(self.images[0], select_threshold, top_k, keep_top_k, nms_threshold)
+
+        records = []
+        post_time = 0.
+        for image in self.images:
+            (classes, scores, r_bboxes), run_time = detect(image, select_threshold, top_k, keep_top_k, nms_threshold)
+            post_time += run_time
+            glabels, gbboxes, gdifficults = image[4:]
+            num_gbboxes, tp, fp = np_methods.bboxes_matching_image(
+                classes, scores, r_bboxes, glabels, gbboxes, gdifficults, self.num_class, matching_threshold)
+            records.append((num_gbboxes, classes, tp, fp, scores))
+            pass
+
+        mAP_voc_07, mAP_voc_12 = np_methods.mean_average_precision(records, self.num_class)
+        return mAP_voc_07, mAP_voc_12, post_time / max(len(self.images), 1) * 1000.
+
+    def run(self, select_thresholds=(0.01, 0.05, 0.1, 0.3, 0.5), top_ks=(100, 200, 400), keep_top_ks=(50, 100, 200),
+            nms_thresholds=(0.35, 0.45, 0.55), pipeline="eval"):
+        """
+        :return: 所有的点和Pareto前沿，每个点为(select_threshold, top_k, keep_top_k, nms_threshold,
+                 mAP_voc_07, mAP_voc_12, latency_ms)
+        """
+        points = []
+        for select_threshold, top_k, keep_top_k, nms_threshold in itertools.product(
+                select_thresholds, top_ks, keep_top_ks, nms_thresholds):
+            if keep_top_k > top_k:
+                continue
+            mAP_voc_07, mAP_voc_12, latency = self.evaluate(select_threshold, top_k, keep_top_k, nms_threshold,
+                                                            pipeline)
+            points.append((select_threshold, top_k, keep_top_k, nms_threshold, mAP_voc_07, mAP_voc_12, latency))
+            print("select_threshold={} top_k={} keep_top_k={} nms_threshold={} : mAP_voc_07={:.4f} "
+                  "mAP_voc_12={:.4f} latency={:.3f}ms".format(*points[-1]))
+            pass
+
+        pareto = self.pareto_front(points)
+        print("Pareto front ({} pipeline):".format(pipeline))
+        for point in pareto:
+            print("select_threshold={} top_k={} keep_top_k={} nms_threshold={} : mAP_voc_07={:.4f} "
+                  "mAP_voc_12={:.4f} latency={:.3f}ms".format(*point))
+        return points, pareto
+
+    @staticmethod
+    def pareto_front(points):
+        # 按耗时从小到大，只保留mAP_voc_07比所有更快的点都高的点
+        pareto = []
+        for point in sorted(points, key=lambda p: (p[6], -p[4])):
+            if not pareto or point[4] > pareto[-1][4]:
+                pareto.append(point)
+        return pareto
+
+    def close(self):
+        for graph in self.tf_graphs.values():
+            graph[0].close()
+        self.tf_graphs = {}
+        pass
+
+    pass
+
+if __name__ == '__main__':
+    runner = RunnerEvalSweep(ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt", num_images=500)
+    runner.run(pipeline="eval")
+    runner.run(select_thresholds=(0.3, 0.4, 0.5, 0.6), pipeline="realtime")
+    runner.close()
@@ -0,0 +1,111 @@
+import os
+import time
+import collections
+import numpy as np
+import tensorflow as tf
+
+from nets import ssd_vgg_300, ssd_vgg_512, ssd_mobilenet_300
+from changemodels import graph_fusion
+from RunnerSSDOneOrRealTime import RunnerOneOrRealTime
+
+
+"""
+导出推理图：冻结为 <ckpt>.pb，再做推理时的融合（changemodels/graph_fusion.py）得到 <ckpt>_optimized.pb，
+比较两者的节点、输出和推理时间
+"""
+
+
+class RunnerExportGraph(object):
+
+    def __init__(self, net_model=ssd_vgg_300, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt", num_class=21,
+                 net_kwargs=None, fuse_activations=True, num_warmup=10, num_iter=100):
+        """
+        :param net_kwargs: SSDNet的其他参数，比如剪枝后的depths、fused_heads
+        :param fuse_activations: 是否把Conv2D + BiasAdd + Relu融合为_FusedConv2D
+        :param num_warmup: 推理计时前运行的次数
+        :param num_iter: 推理计时的次数
+        """
+        self.net_model = net_model
+        self.ckpt_path = tf.train.latest_checkpoint(ckpt_path) if tf.gfile.IsDirectory(ckpt_path) else ckpt_path
+        self.pb_name = self.ckpt_path + '.pb'
+        self.optimized_pb_name = self.ckpt_path + '_optimized.pb'
+        self.num_class = num_class
+        self.net_shape = self.net_model.SSDNet.default_params.img_shape
+        self.net_kwargs = net_kwargs
+        self.fuse_activations = fuse_activations
+        self.num_warmup = num_warmup
+        self.num_iter = num_iter
+        self.output_names = None
+        pass
+
+    def export(self):
+        """
+        :return: 冻结的图和融合后的图
+        """
+        with tf.Graph().as_default() as graph:
+            ssd_net = self.net_model.SSDNet(self.net_model.SSDNet.default_params._replace(
+                num_classes=self.num_class), **(self.net_kwargs or {}))
+            img_input = tf.placeholder(tf.uint8, shape=(None, None, 3), name="image")
+            _, predictions, localisations, bbox_img, _ = RunnerOneOrRealTime.net(
+                ssd_net, img_input, self.net_shape, "NHWC")
+            self.output_names = [output.op.name for output in predictions + localisations + [bbox_img]]
+            with tf.Session() as sess:
+                tf.train.Saver().restore(sess, self.ckpt_path)
+                graph_def = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), self.output_names)
+            pass
+
+        optimized_graph_def = graph_fusion.optimize_for_inference(graph_def, self.output_names,
+                                                                  fuse_activations=self.fuse_activations)
+        for name, value in [(self.pb_name, graph_def), (self.optimized_pb_name, optimized_graph_def)]:
+            tf.train.write_graph(value, os.path.dirname(name), os.path.basename(name), as_text=False)
+            print("Exported {}: {} nodes".format(name, len(value.node)))
+        return graph_def, optimized_graph_def
+
+    def run_graph(self, graph_def, image):
+        """
+        :return: 输出，推理时间(ms)的平均值和中位数
+        """
+        with tf.Graph().as_default():
+            outputs = tf.import_graph_def(graph_def, return_elements=[name + ":0" for name in self.output_names],
+                                          name="")
+            img_input = tf.get_default_graph().get_tensor_by_name("image:0")
+            config = tf.ConfigProto(allow_soft_placement=True, gpu_options=tf.GPUOptions(allow_growth=True))
+            with tf.Session(config=config) as sess:
+                results = sess.run(outputs, feed_dict={img_input: image})
+                for _ in range(self.num_warmup):
+                    sess.run(outputs, feed_dict={img_input: image})
+                run_times = []
+                for _ in range(self.num_iter):
+                    start_time = time.time()
+                    sess.run(outputs, feed_dict={img_input: image})
+                    run_times.append(time.time() - start_time)
+                pass
+            pass
+        run_times = np.asarray(run_times) * 1000
+        return results, np.mean(run_times), np.median(run_times)
+
+    def run(self, image_shape=(375, 500, 3)):
+        graph_def, optimized_graph_def = self.export()
+        image = np.random.randint(0, 256, size=image_shape).astype(np.uint8)
+        results, mean_time, median_time = self.run_graph(graph_def, image)
+        optimized_results, optimized_mean_time, optimized_median_time = self.run_graph(optimized_graph_def, image)
+
+        ops = collections.Counter(node.op for node in graph_def.node)
+        optimized_ops = collections.Counter(node.op for node in optimized_graph_def.node)
+        for op in sorted(set(ops) | set(optimized_ops)):
+            if ops[op] != optimized_ops[op]:
+                print("{}: {} ==> {}".format(op, ops[op], optimized_ops[op]))
+        max_diff = max(np.max(np.abs(a - b)) for a, b in zip(results, optimized_results))
+        print("nodes: {} ==> {}, max |frozen - optimized|={}".format(
+            len(graph_def.node), len(optimized_graph_def.node), max_diff))
+        print("latency: mean={:.2f}ms median={:.2f}ms ==> mean={:.2f}ms median={:.2f}ms".format(
+            mean_time, median_time, optimized_mean_time, optimized_median_time))
+        return max_diff
+
+    pass
+
+
+if __name__ == '__main__':
+    RunnerExportGraph(net_model=ssd_vgg_300, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt").run()
+    # RunnerExportGraph(net_model=ssd_vgg_512, ckpt_path="./checkpoints/VGG_VOC0712Plus_SSD_512x512.ckpt").run()
+    # RunnerExportGraph(net_model=ssd_mobilenet_300, ckpt_path="./models/ssd_mobilenet_300").run()
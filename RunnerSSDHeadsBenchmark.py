@@ -0,0 +1,98 @@
+import time
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from nets import ssd_vgg_300, ssd_vgg_512
+from changemodels import fuse_heads
+
+
+"""
+预测层的推理时间：conv_loc和conv_cls两次卷积 vs conv_box一次卷积
+
+融合的网络用fuse_heads从分开的网络转换权重，同时检查两者输出一致。
+"""
+
+
+class RunnerHeadsBenchmark(object):
+
+    def __init__(self, net_model, ckpt_filename=None, num_class=21, batch_size=1, data_format="NHWC",
+                 num_warmup=10, num_iter=100):
+        """
+        :param net_model: ssd_vgg_300 or ssd_vgg_512
+        :param ckpt_filename: checkpoint of the split heads, random weights if None
+        :param num_warmup: runs not timed
+        :param num_iter: runs timed
+        """
+        self.net_model = net_model
+        self.ckpt_filename = ckpt_filename
+        self.num_class = num_class
+        self.batch_size = batch_size
+        self.data_format = data_format
+        self.num_warmup = num_warmup
+        self.num_iter = num_iter
+
+        self.net_shape = self.net_model.SSDNet.default_params.img_shape
+        self.images = np.random.uniform(-128., 128., size=(self.batch_size,) + tuple(self.net_shape) + (3,))
+        pass
+
+    def build(self, fused_heads):
+        ssd_net = self.net_model.SSDNet(self.net_model.SSDNet.default_params._replace(num_classes=self.num_class),
+                                        fused_heads=fused_heads)
+        img_input = tf.placeholder(tf.float32, shape=(self.batch_size,) + tuple(self.net_shape) + (3,))
+        with slim.arg_scope(ssd_net.arg_scope(data_format=self.data_format)):
+            predictions, localisations, _, _ = ssd_net.net(img_input, is_training=False)
+        return img_input, predictions + localisations
+
+    def time_net(self, sess, img_input, outputs):
+        for _ in range(self.num_warmup):
+            sess.run(outputs, feed_dict={img_input: self.images})
+        run_times = []
+        for _ in range(self.num_iter):
+            start_time = time.time()
+            sess.run(outputs, feed_dict={img_input: self.images})
+            run_times.append(time.time() - start_time)
+        return np.asarray(run_times) * 1000
+
+    def run(self):
+        results = {}
+        values = None
+        for fused_heads in [False, True]:
+            with tf.Graph().as_default() as graph:
+                img_input, outputs = self.build(fused_heads)
+                num_conv = sum(op.type == "Conv2D" for op in graph.get_operations())
+                with tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True))) as sess:
+                    if not fused_heads:
+                        # 分开的网络：加载模型或随机初始化，记下权重
+                        if self.ckpt_filename:
+                            tf.train.Saver().restore(sess, self.ckpt_filename)
+                        else:
+                            sess.run(tf.global_variables_initializer())
+                        values = dict(zip([v.op.name for v in tf.global_variables()],
+                                          sess.run(tf.global_variables())))
+                    else:
+                        # 融合的网络：用转换后的权重
+                        fused = fuse_heads.fuse_head_values(values)
+                        for variable in tf.global_variables():
+                            variable.load(fused[variable.op.name], sess)
+                    results[fused_heads] = (num_conv, sess.run(outputs, feed_dict={img_input: self.images}),
+                                            self.time_net(sess, img_input, outputs))
+                pass
+            pass
+
+        max_diff = max(np.max(np.abs(split - fused)) for split, fused in zip(results[False][1], results[True][1]))
+        print("{} batch_size={} max |split - fused|={}".format(self.net_model.__name__, self.batch_size, max_diff))
+        for fused_heads, name in [(False, "split"), (True, "fused")]:
+            num_conv, _, run_times = results[fused_heads]
+            print("{}: {} Conv2D, mean={:.2f}ms median={:.2f}ms p90={:.2f}ms".format(
+                name, num_conv, np.mean(run_times), np.median(run_times), np.percentile(run_times, 90)))
+        return results
+
+    pass
+
+
+if __name__ == '__main__':
+    runner = RunnerHeadsBenchmark(net_model=ssd_vgg_300, batch_size=1)
+    runner.run()
+    runner = RunnerHeadsBenchmark(net_model=ssd_vgg_512, batch_size=1)
+    runner.run()
@@ -0,0 +1,127 @@
+import time
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from nets import ssd_vgg_300
+
+
+"""
+难负样本挖掘的时间：整个批次的tf.nn.top_k（global） vs 每张图片的tf.nn.nth_element（per_image）
+
+1. loss：固定的logits上只计算损失，即挖掘本身的时间
+2. step：网络前向、损失、反向和更新一步的时间
+目标用随机的真实框编码，logits和图片是随机的。
+"""
+
+
+class RunnerLossBenchmark(object):
+
+    def __init__(self, net_model=ssd_vgg_300, num_class=21, batch_size=8, num_objects=3,
+                 num_warmup=5, num_iter=50, num_step_iter=10):
+        """
+        :param num_objects: 每张图片的真实框数
+        :param num_warmup: runs not timed
+        :param num_iter: loss timed runs
+        :param num_step_iter: train step timed runs
+        """
+        self.net_model = net_model
+        self.num_class = num_class
+        self.batch_size = batch_size
+        self.num_objects = num_objects
+        self.num_warmup = num_warmup
+        self.num_iter = num_iter
+        self.num_step_iter = num_step_iter
+
+        self.net_shape = self.net_model.SSDNet.default_params.img_shape
+        self.ssd_params = self.net_model.SSDNet.default_params._replace(num_classes=self.num_class)
+        self.images = np.random.uniform(-128., 128., size=(self.batch_size,) + tuple(self.net_shape) + (3,))
+        self.targets = self._random_targets()
+        pass
+
+    def _random_targets(self):
+        """编码后的随机真实框：gclasses, glocalisations, gscores，每一层 [batch_size, ...]"""
+        ssd_net = self.net_model.SSDNet(self.ssd_params)
+        anchors = ssd_net.anchors(self.net_shape)
+        with tf.Graph().as_default():
+            labels = tf.placeholder(tf.int64, [None])
+            bboxes = tf.placeholder(tf.float32, [None, 4])
+            encoded = ssd_net.bboxes_encode(labels, bboxes, anchors)
+            with tf.Session() as sess:
+                images_targets = []
+                for _ in range(self.batch_size):
+                    center = np.random.uniform(0.2, 0.8, size=(self.num_objects, 2))
+                    size = np.random.uniform(0.05, 0.4, size=(self.num_objects, 2))
+                    feed_dict = {labels: np.random.randint(1, self.num_class, size=self.num_objects),
+                                 bboxes: np.concatenate([center - size / 2, center + size / 2], axis=1)}
+                    images_targets.append(sess.run(encoded, feed_dict=feed_dict))
+                pass
+            pass
+        # 按图片堆叠成批次
+        return [[np.stack([t[k][i] for t in images_targets]) for i in range(len(anchors))] for k in range(3)]
+
+    def _target_placeholders(self):
+        placeholders = [[tf.placeholder(tf.as_dtype(v.dtype), v.shape) for v in target] for target in self.targets]
+        feed_dict = {p: v for ps, vs in zip(placeholders, self.targets) for p, v in zip(ps, vs)}
+        return placeholders, feed_dict
+
+    def _time(self, sess, fetches, feed_dict, num_iter):
+        for _ in range(self.num_warmup):
+            sess.run(fetches, feed_dict=feed_dict)
+        run_times = []
+        for _ in range(num_iter):
+            start_time = time.time()
+            sess.run(fetches, feed_dict=feed_dict)
+            run_times.append(time.time() - start_time)
+        return np.asarray(run_times) * 1000
+
+    def time_loss(self, negative_mining):
+        with tf.Graph().as_default():
+            (g_classes, g_localisations, g_scores), feed_dict = self._target_placeholders()
+            logits = [tf.constant(np.random.normal(size=c.get_shape().as_list() + [self.num_class]), tf.float32)
+                      for c in g_classes]
+            localisations = [tf.constant(np.random.normal(size=l.get_shape().as_list()), tf.float32)
+                             for l in g_localisations]
+            # 网络自己的损失函数：ssd_vgg_512按层挖掘（ssd_losses_per_layer）
+            self.net_model.SSDNet.loss_fn(logits, localisations, g_classes, g_localisations, g_scores,
+                                          negative_mining=negative_mining)
+            losses = tf.get_collection(tf.GraphKeys.LOSSES)
+            with tf.Session() as sess:
+                return sess.run(losses, feed_dict=feed_dict), self._time(sess, losses, feed_dict, self.num_iter)
+            pass
+        pass
+
+    def time_step(self, negative_mining):
+        with tf.Graph().as_default():
+            ssd_net = self.net_model.SSDNet(self.ssd_params)
+            img_input = tf.placeholder(tf.float32, shape=self.images.shape)
+            (g_classes, g_localisations, g_scores), feed_dict = self._target_placeholders()
+            feed_dict[img_input] = self.images
+            with slim.arg_scope(ssd_net.arg_scope()):
+                _, localisations, logits, _ = ssd_net.net(img_input, is_training=True)
+            ssd_net.losses(logits, localisations, g_classes, g_localisations, g_scores,
+                           negative_mining=negative_mining)
+            train_op = tf.train.GradientDescentOptimizer(1e-6).minimize(tf.losses.get_total_loss())
+            with tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True))) as sess:
+                sess.run(tf.global_variables_initializer())
+                return self._time(sess, train_op, feed_dict, self.num_step_iter)
+            pass
+        pass
+
+    def run(self):
+        results = {}
+        for negative_mining in ["global", "per_image"]:
+            losses, loss_times = self.time_loss(negative_mining)
+            step_times = self.time_step(negative_mining)
+            results[negative_mining] = (loss_times, step_times)
+            print("{}: losses(pos, neg, loc)={} loss mean={:.2f}ms median={:.2f}ms, step mean={:.2f}ms median={:.2f}ms".format(
+                negative_mining, np.round(losses, 4), np.mean(loss_times), np.median(loss_times),
+                np.mean(step_times), np.median(step_times)))
+            pass
+        return results
+
+    pass
+
+
+if __name__ == '__main__':
+    RunnerLossBenchmark(net_model=ssd_vgg_300, batch_size=8).run()
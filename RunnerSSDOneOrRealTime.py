@@ -4,7 +4,7 @@ import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 
-from nets import ssd_vgg_300, ssd_vgg_512, np_methods
+from nets import ssd_vgg_300, ssd_vgg_512, np_methods, ssd_resolution
 from preprocessing import ssd_vgg_preprocessing
 
 
@@ -16,7 +16,12 @@ from preprocessing import ssd_vgg_preprocessing
 class RunnerOneOrRealTime(object):
 
     def __init__(self, ckpt_filename, net_model, num_class=23, net_shape=(300, 300), data_format="NHWC",
-                 select_threshold=0.5, nms_threshold=0.45):
+                 select_threshold=0.5, nms_threshold=0.45, fused_heads=False, resolution_buckets=None):
+        """
+        :param net_shape: 网络的输入大小，resolution_buckets不为None时不使用
+        :param resolution_buckets: ssd_resolution.ResolutionBuckets，每张图片按宽高比缩放到其中一个输入大小，
+                                   而不是都压缩成net_shape，默认框按输入大小缓存在anchor_cache中
+        """
         self.ckpt_filename = ckpt_filename
         self.data_format = data_format
         self.net_shape = net_shape
@@ -25,8 +30,14 @@ class RunnerOneOrRealTime(object):
         self.select_threshold = select_threshold
         self.nms_threshold = nms_threshold
 
-        self.ssd_net = net_model.SSDNet(net_model.SSDNet.default_params._replace(num_classes=num_class))
+        # fused_heads：模型需要先用changemodels/fuse_heads.py转换
+        self.ssd_net = net_model.SSDNet(net_model.SSDNet.default_params._replace(num_classes=num_class),
+                                        fused_heads=fused_heads)
         self.img_input = tf.placeholder(tf.uint8, shape=(None, None, 3))
+        self.resolution_buckets = resolution_buckets
+        if self.resolution_buckets is not None:
+            self.anchor_cache = ssd_resolution.AnchorCache(self.ssd_net)
+            self.net_shape = tf.placeholder(tf.int32, shape=(2,))
         self.image_4d, self.predictions, self.localisations, self.bbox_img, self.ssd_anchors = self.net(
             self.ssd_net, self.img_input, self.net_shape, self.data_format)
 
@@ -45,20 +56,30 @@ class RunnerOneOrRealTime(object):
         with slim.arg_scope(ssd_net.arg_scope(data_format=data_format)):
             predictions, localisations, _, _ = ssd_net.net(image_4d, is_training=False, reuse=False)
 
-        # 得到默认的bounding boxes
-        ssd_anchors = ssd_net.anchors(net_shape)
+        # 得到默认的bounding boxes，输入大小不固定时在运行时得到（ssd_resolution.AnchorCache）
+        ssd_anchors = None if isinstance(net_shape, tf.Tensor) else ssd_net.anchors(net_shape)
 
         return image_4d, predictions, localisations, bbox_img, ssd_anchors
 
     def run_net(self, img, bboxes_sort_top_k=400):
+        feed_dict = {self.img_input: img}
+        net_shape, ssd_anchors = self.net_shape, self.ssd_anchors
+        if self.resolution_buckets is not None:
+            net_shape = self.resolution_buckets.bucket(img.shape)
+            feed_dict[self.net_shape] = net_shape
+
         # Run SSD network.
         r_img, r_predictions, r_localisations, r_bbox_img = self.sess.run(
-            [self.image_4d, self.predictions, self.localisations, self.bbox_img], feed_dict={self.img_input: img})
+            [self.image_4d, self.predictions, self.localisations, self.bbox_img], feed_dict=feed_dict)
+
+        if self.resolution_buckets is not None:
+            # 特征图大小从预测结果得到，每个输入大小只计算一次
+            ssd_anchors = self.anchor_cache.anchors(net_shape, r_predictions)
 
         # 将符合条件（非背景得分大于select_threshold）框的类别、得分和边界框筛选出
         r_classes, r_scores, r_bboxes = np_methods.ssd_bboxes_select(
-            r_predictions, r_localisations, self.ssd_anchors, select_threshold=self.select_threshold,
-            img_shape=self.net_shape, num_classes=self.num_class, decode=True)
+            r_predictions, r_localisations, ssd_anchors, select_threshold=self.select_threshold,
+            img_shape=net_shape, num_classes=self.num_class, decode=True)
 
         # 使bboxes的范围在bbox_ref内
         r_bboxes = np_methods.bboxes_clip(r_bbox_img, r_bboxes)
@@ -183,6 +204,15 @@ def demo_300(ckpt_filename='checkpoints/VGG_VOC0712_SSD_300x300.ckpt',
     pass
 
 
+def demo_buckets(ckpt_filename='checkpoints/VGG_VOC0712_SSD_300x300.ckpt', prop_id="demo/video1.mp4"):
+    # 16:9的视频缩放到300x536，而不是压缩成300x300
+    runner = RunnerOneOrRealTime(ckpt_filename=ckpt_filename, net_model=ssd_vgg_300, num_class=21,
+                                 resolution_buckets=ssd_resolution.ResolutionBuckets(short_side=300))
+    runner.run(prop_id=prop_id)
+    print("frames per input shape: {}".format(dict(runner.resolution_buckets.counts)))
+    pass
+
+
 def demo_512():
     runner = RunnerOneOrRealTime(ckpt_filename='checkpoints/VGG_VOC0712Plus_SSD_512x512.ckpt',
                                  net_model=ssd_vgg_512, num_class=21, net_shape=(512, 512))
@@ -0,0 +1,173 @@
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from nets import ssd_vgg_300, ssd_vgg_512
+from changemodels import prune
+from changemodels.checkpoint_utils import read_checkpoint, write_checkpoint
+from RunnerSSDEval import RunnerEval
+from RunnerSSDOneOrRealTime import RunnerOneOrRealTime
+
+
+"""
+VGG主干和额外层的通道剪枝：
+
+1. sensitivity：每一层按L1范数去掉一部分通道（置零，和去掉等价），在验证子集上测mAP，结果保存在sensitivity.json，可以断点续跑
+2. prune：每一层选择mAP下降不超过max_drop的最少通道数，得到depths（SSDNet(depths=...)），并改写模型
+3. 比较剪枝前后验证子集上的mAP、推理的FLOPs和时间
+
+剪枝后的模型在work_dir下，用RunnerTrain(run_type=2, ckpt_path=work_dir, net_kwargs={"depths": depths})微调。
+"""
+
+
+class RunnerPrune(object):
+
+    def __init__(self, net_model=ssd_vgg_300, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt",
+                 work_dir="./models/ssd_vgg_300_pruned", ckpt_name="ssd_300_vgg.ckpt", num_class=21,
+                 eval_dataset_dir="./data/eval_sample", eval_split_name="test", batch_size=16,
+                 depth_ratios=(0.75, 0.5, 0.25), prune_layers=None, num_warmup=10, num_iter=50):
+        """
+        :param ckpt_path: 剪枝前的模型
+        :param work_dir: 敏感度、剪枝后的模型和depths的目录
+        :param ckpt_name: 剪枝后的模型名，RunnerTrain微调时使用相同的名字
+        :param eval_dataset_dir: 验证子集，比如RunnerEvalSample抽样的目录，每张图片验证一次
+        :param depth_ratios: 敏感度分析时每一层保留通道的比例
+        :param prune_layers: 剪枝的层（如"conv6"、"block8/conv3x3"），None表示ssd_vgg_layers的所有层
+        :param num_warmup: 推理计时前运行的次数
+        :param num_iter: 推理计时的次数
+        """
+        self.net_model = net_model
+        self.ckpt_path = tf.train.latest_checkpoint(ckpt_path) if tf.gfile.IsDirectory(ckpt_path) else ckpt_path
+        self.work_dir = work_dir
+        if not tf.gfile.Exists(self.work_dir):
+            tf.gfile.MakeDirs(self.work_dir)
+        self.pruned_ckpt_path = os.path.join(self.work_dir, ckpt_name)
+        self.sensitivity_name = os.path.join(self.work_dir, "sensitivity.json")
+        self.masked_ckpt_path = os.path.join(self.work_dir, "masked", "masked.ckpt")
+
+        self.num_class = num_class
+        self.net_shape = self.net_model.SSDNet.default_params.img_shape
+        self.net_scope = self.net_model.SSDNet.default_scope
+        self.layers = ssd_vgg_300.ssd_vgg_layers(self.net_model.EXTRA_BLOCKS)
+        self.prune_layers = prune_layers
+
+        self.eval_dataset_dir = eval_dataset_dir
+        self.eval_split_name = eval_split_name
+        self.batch_size = batch_size
+        self.depth_ratios = depth_ratios
+
+        self.num_warmup = num_warmup
+        self.num_iter = num_iter
+        pass
+
+    def eval_map(self, ckpt_path, net_kwargs=None):
+        """
+        :return: 验证子集上的mAP_voc_07
+        """
+        final_results = []
+        with tf.Graph().as_default():
+            runner = RunnerEval(batch_size=self.batch_size, num_class=self.num_class, net_model=self.net_model,
+                                image_shape=self.net_shape, dataset_dir=self.eval_dataset_dir,
+                                dataset_split_name=self.eval_split_name, ckpt_path=ckpt_path, num_epochs=1,
+                                net_kwargs=net_kwargs)
+            runner.run(runner.run_list, func_print=None, func_final_print=final_results.append)
+            runner.sess.close()
+            pass
+        return float(final_results[0][11])
+
+    def sensitivity(self):
+        """
+        :return: {"baseline": mAP, "layers": {层: {通道数: mAP}}}
+        """
+        result = prune.read_json(self.sensitivity_name) if tf.gfile.Exists(self.sensitivity_name) else {}
+        result.setdefault("layers", {})
+        if result.get("baseline") is None:
+            result["baseline"] = self.eval_map(self.ckpt_path)
+            prune.write_json(result, self.sensitivity_name)
+        print("baseline mAP_voc_07={:.4f}".format(result["baseline"]))
+
+        values = {name: value for name, value in read_checkpoint(self.ckpt_path).items()
+                  if prune.is_model_value(name, self.net_scope)}
+        for layer, default_depth, _ in self.layers:
+            if self.prune_layers is not None and layer not in self.prune_layers:
+                continue
+            for ratio in self.depth_ratios:
+                depth = int(round(default_depth * ratio))
+                if str(depth) in result["layers"].get(layer, {}):  # 已经测过
+                    continue
+                write_checkpoint(prune.mask_values(values, self.net_scope, layer, depth), self.masked_ckpt_path)
+                m_ap = self.eval_map(self.masked_ckpt_path)
+                result["layers"].setdefault(layer, {})[str(depth)] = m_ap
+                prune.write_json(result, self.sensitivity_name)
+                print("{} {}/{}: mAP_voc_07={:.4f} drop={:+.4f}".format(
+                    layer, depth, default_depth, m_ap, m_ap - result["baseline"]))
+                pass
+            pass
+        return result
+
+    def prune(self, sensitivity, max_drop=0.005):
+        """
+        :param max_drop: 每一层允许的mAP下降
+        :return: depths
+        """
+        depths = prune.choose_depths(sensitivity["layers"], sensitivity["baseline"], self.layers, max_drop)
+        pruned = prune.prune_values(read_checkpoint(self.ckpt_path), self.net_scope, self.layers, depths)
+        write_checkpoint(pruned, self.pruned_ckpt_path)
+        prune.write_json(depths, prune.get_depths_filename(self.pruned_ckpt_path))
+        for layer, default_depth, _ in self.layers:
+            if layer in depths:
+                print("{}: {} ==> {}".format(layer, default_depth, depths[layer]))
+        print("Pruned {} layers in {}".format(len(depths), self.pruned_ckpt_path))
+        return depths
+
+    def latency(self, ckpt_path, net_kwargs=None, image_shape=(375, 500, 3)):
+        """
+        :return: 网络的FLOPs，推理时间(ms)的平均值和中位数
+        """
+        image = np.random.randint(0, 256, size=image_shape).astype(np.uint8)
+        with tf.Graph().as_default() as graph:
+            ssd_net = self.net_model.SSDNet(self.net_model.SSDNet.default_params._replace(
+                num_classes=self.num_class), **(net_kwargs or {}))
+            img_input = tf.placeholder(tf.uint8, shape=(None, None, 3))
+            _, predictions, localisations, bbox_img, _ = RunnerOneOrRealTime.net(
+                ssd_net, img_input, self.net_shape, "NHWC")
+            outputs = predictions + localisations + [bbox_img]
+            flops = tf.profiler.profile(graph, options=tf.profiler.ProfileOptionBuilder.float_operation()).total_float_ops
+            with tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True))) as sess:
+                tf.train.Saver().restore(sess, ckpt_path)
+                for _ in range(self.num_warmup):
+                    sess.run(outputs, feed_dict={img_input: image})
+                run_times = []
+                for _ in range(self.num_iter):
+                    start_time = time.time()
+                    sess.run(outputs, feed_dict={img_input: image})
+                    run_times.append(time.time() - start_time)
+                pass
+            pass
+        run_times = np.asarray(run_times) * 1000
+        return flops, np.mean(run_times), np.median(run_times)
+
+    def run(self, max_drop=0.005):
+        sensitivity = self.sensitivity()
+        depths = self.prune(sensitivity, max_drop=max_drop)
+        pruned_map = self.eval_map(self.pruned_ckpt_path, net_kwargs={"depths": depths})
+        flops, mean_time, median_time = self.latency(self.ckpt_path)
+        pruned_flops, pruned_mean_time, pruned_median_time = self.latency(self.pruned_ckpt_path, {"depths": depths})
+
+        print("mAP_voc_07: {:.4f} ==> {:.4f} (before fine-tuning)".format(sensitivity["baseline"], pruned_map))
+        print("GFLOPs: {:.2f} ==> {:.2f}".format(flops / 1e9, pruned_flops / 1e9))
+        print("latency: mean={:.2f}ms median={:.2f}ms ==> mean={:.2f}ms median={:.2f}ms".format(
+            mean_time, median_time, pruned_mean_time, pruned_median_time))
+        return depths
+
+    pass
+
+
+if __name__ == '__main__':
+    runner = RunnerPrune(net_model=ssd_vgg_300, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt",
+                         work_dir="./models/ssd_vgg_300_pruned", ckpt_name="ssd_300_vgg.ckpt")
+    runner.run(max_drop=0.005)
+    # runner = RunnerPrune(net_model=ssd_vgg_512, ckpt_path="./checkpoints/VGG_VOC0712Plus_SSD_512x512.ckpt",
+    #                      work_dir="./models/ssd_vgg_512_pruned", ckpt_name="ssd_512_vgg.ckpt")
+    # runner.run(max_drop=0.005)
@@ -0,0 +1,238 @@
+import os
+import time
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from nets import ssd_vgg_300, ssd_vgg_512
+from changemodels import quantize, graph_fusion
+from changemodels.checkpoint_utils import read_checkpoint, write_checkpoint
+from RunnerSSDEval import RunnerEval
+from RunnerSSDOneOrRealTime import RunnerOneOrRealTime
+
+
+"""
+训练后int8量化：卷积核按输出通道量化为int8，卷积的输入在VOC样本上校准范围后伪量化为8位
+
+1. calibrate：在训练集的若干批次上统计每个卷积输入的范围
+2. quantize：生成int8模型 <ckpt>_int8.ckpt 和范围 <ckpt>_int8.ckpt.ranges.json
+3. eval_map：RunnerEval 比较 float32 和 int8 的mAP
+4. latency：比较推理时间（预处理+网络）
+5. export：冻结的int8模拟推理图 <ckpt>_int8.ckpt.pb，卷积核是反量化后的float32常量（取值为int8乘scale），
+   卷积输入伪量化为8位，并做了推理时的融合（graph_fusion）
+
+计算都是float32：int8模型只是文件小了4倍，int8推理图只用来模拟int8的精度，不会比float32更快，
+真正的int8卷积需要支持int8的推理引擎
+"""
+
+
+class RunnerEvalQuant(RunnerEval):
+    """RunnerEval of a quantized checkpoint."""
+
+    def __init__(self, ranges, **kwargs):
+        self.ranges = ranges
+        super(RunnerEvalQuant, self).__init__(**kwargs)
+        pass
+
+    def _get_net_tensor(self, ssd_net, data_format, image, g_classes, g_localisations, g_scores):
+        with tf.variable_scope(tf.get_variable_scope(), custom_getter=quantize.int8_weights_getter):
+            r = RunnerEval._get_net_tensor(ssd_net, data_format, image, g_classes, g_localisations, g_scores)
+        quantize.quantize_activations(tf.get_default_graph(), self.ranges)
+        return r
+
+    pass
+
+
+class RunnerQuantize(object):
+
+    def __init__(self, net_model=ssd_vgg_300, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt",
+                 quant_ckpt_path=None, num_class=21, batch_size=16,
+                 calib_dataset_dir="./data/train", calib_split_name="train", num_calib_batches=32,
+                 eval_dataset_dir="./data/test", eval_split_name="test", num_eval_batches=None,
+                 num_warmup=10, num_iter=100):
+        """
+        :param ckpt_path: float32模型
+        :param quant_ckpt_path: int8模型，默认在float32模型旁边
+        :param num_calib_batches: 校准的批次数
+        :param num_eval_batches: 验证的批次数，None表示所有
+        :param num_warmup: 推理计时前运行的次数
+        :param num_iter: 推理计时的次数
+        """
+        self.net_model = net_model
+        self.ckpt_path = tf.train.latest_checkpoint(ckpt_path) if tf.gfile.IsDirectory(ckpt_path) else ckpt_path
+        if quant_ckpt_path is None:
+            quant_ckpt_path = self.ckpt_path.replace('.ckpt', '_int8.ckpt')
+            quant_ckpt_path = quant_ckpt_path if quant_ckpt_path != self.ckpt_path else self.ckpt_path + '_int8'
+        self.quant_ckpt_path = quant_ckpt_path
+        self.num_class = num_class
+        self.net_shape = self.net_model.SSDNet.default_params.img_shape
+        self.batch_size = batch_size
+
+        self.calib_dataset_dir = calib_dataset_dir
+        self.calib_split_name = calib_split_name
+        self.num_calib_batches = num_calib_batches
+        self.eval_dataset_dir = eval_dataset_dir
+        self.eval_split_name = eval_split_name
+        self.num_eval_batches = num_eval_batches
+
+        self.num_warmup = num_warmup
+        self.num_iter = num_iter
+        pass
+
+    def _eval_kwargs(self, ckpt_path, dataset_dir, dataset_split_name):
+        return dict(batch_size=self.batch_size, num_class=self.num_class, net_model=self.net_model,
+                    image_shape=self.net_shape, dataset_dir=dataset_dir, dataset_split_name=dataset_split_name,
+                    ckpt_path=ckpt_path)
+
+    def calibrate(self):
+        """
+        :return: 每个卷积输入的范围（各批次最小值和最大值的平均），模型变量的名字
+        """
+        batch_ranges = []
+
+        def func_print(run_result, batch_index, run_time):
+            batch_ranges.append(run_result)
+            pass
+
+        def func_final_print(run_result):
+            print("Calibrated {} convolutions on {} batches".format(len(run_result), len(batch_ranges)))
+            pass
+
+        with tf.Graph().as_default() as graph:
+            runner = RunnerEval(**self._eval_kwargs(self.ckpt_path, self.calib_dataset_dir, self.calib_split_name))
+            calibration = quantize.calibration_tensors(graph, runner.ssd_net.default_scope)
+            names = [variable.op.name for variable in slim.get_model_variables()]
+            runner.run(calibration, func_print=func_print, func_final_print=func_final_print,
+                       num_batches=self.num_calib_batches)
+            runner.sess.close()
+            pass
+
+        ranges = {name: (float(np.mean([r[name][0] for r in batch_ranges])),
+                         float(np.mean([r[name][1] for r in batch_ranges]))) for name in calibration}
+        return ranges, names
+
+    def quantize(self, ranges, names):
+        values = read_checkpoint(self.ckpt_path)
+        quantized = quantize.quantize_values(values, names)
+        write_checkpoint(quantized, self.quant_ckpt_path)
+        quantize.write_ranges(ranges, self.quant_ckpt_path)
+
+        float_bytes = sum(values[name].nbytes for name in names)
+        quant_bytes = sum(value.nbytes for value in quantized.values())
+        print("{} ==> {}: {:.1f}MB ==> {:.1f}MB".format(self.ckpt_path, self.quant_ckpt_path,
+                                                        float_bytes / 2 ** 20, quant_bytes / 2 ** 20))
+        return float_bytes, quant_bytes
+
+    def eval_map(self, quantized):
+        """
+        :return: mAP_voc_07, mAP_voc_12
+        """
+        final_results = []
+
+        def func_print(run_result, batch_index, run_time):
+            if batch_index % 20 == 0:
+                print("{} time={} : mAP_voc_07={} mAP_voc_12={}".format(
+                    batch_index, run_time, run_result[11], run_result[12]))
+            pass
+
+        with tf.Graph().as_default():
+            if quantized:
+                runner = RunnerEvalQuant(quantize.read_ranges(self.quant_ckpt_path), **self._eval_kwargs(
+                    self.quant_ckpt_path, self.eval_dataset_dir, self.eval_split_name))
+            else:
+                runner = RunnerEval(**self._eval_kwargs(self.ckpt_path, self.eval_dataset_dir, self.eval_split_name))
+            runner.run(runner.run_list, func_print=func_print, func_final_print=final_results.append,
+                       num_batches=self.num_eval_batches)
+            runner.sess.close()
+            pass
+        return final_results[0][11], final_results[0][12]
+
+    def _build_inference(self, quantized):
+        """
+        quantized时卷积核是float32变量，由_load_variables载入反量化后的值，卷积输入伪量化
+        """
+        ssd_net = self.net_model.SSDNet(self.net_model.SSDNet.default_params._replace(num_classes=self.num_class))
+        img_input = tf.placeholder(tf.uint8, shape=(None, None, 3), name="image")
+        _, predictions, localisations, bbox_img, _ = RunnerOneOrRealTime.net(ssd_net, img_input, self.net_shape, "NHWC")
+        if quantized:
+            quantize.quantize_activations(tf.get_default_graph(), quantize.read_ranges(self.quant_ckpt_path))
+        return img_input, predictions + localisations + [bbox_img]
+
+    def _load_variables(self, sess, quantized):
+        if quantized:
+            # 卷积核在这里反量化一次，不在每次运行时反量化
+            values = quantize.dequantize_values(read_checkpoint(self.quant_ckpt_path))
+            for variable in tf.global_variables():
+                variable.load(values[variable.op.name], sess)
+        else:
+            tf.train.Saver().restore(sess, self.ckpt_path)
+        pass
+
+    def latency(self, quantized, image_shape=(375, 500, 3)):
+        """
+        quantized时是int8模拟推理图的时间，计算仍是float32，加上伪量化的开销
+        :return: 推理时间(ms)：平均值，中位数
+        """
+        image = np.random.randint(0, 256, size=image_shape).astype(np.uint8)
+        with tf.Graph().as_default():
+            img_input, outputs = self._build_inference(quantized)
+            with tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True))) as sess:
+                self._load_variables(sess, quantized)
+                for _ in range(self.num_warmup):
+                    sess.run(outputs, feed_dict={img_input: image})
+                run_times = []
+                for _ in range(self.num_iter):
+                    start_time = time.time()
+                    sess.run(outputs, feed_dict={img_input: image})
+                    run_times.append(time.time() - start_time)
+                pass
+            pass
+        run_times = np.asarray(run_times) * 1000
+        return np.mean(run_times), np.median(run_times)
+
+    def export(self):
+        """
+        冻结的int8模拟推理图：输入uint8图片"image"，输出各层的predictions、localisations和bbox_img。
+        卷积核是反量化后的float32常量，图中没有Cast和Mul，只有卷积输入的伪量化：用来模拟int8的精度，不是更快的模型
+        """
+        pb_name = self.quant_ckpt_path + '.pb'
+        with tf.Graph().as_default() as graph:
+            img_input, outputs = self._build_inference(quantized=True)
+            with tf.Session() as sess:
+                self._load_variables(sess, quantized=True)
+                graph_def = tf.graph_util.convert_variables_to_constants(
+                    sess, graph.as_graph_def(), [output.op.name for output in outputs])
+            graph_def = graph_fusion.optimize_for_inference(graph_def, [output.op.name for output in outputs])
+            tf.train.write_graph(graph_def, os.path.dirname(pb_name), os.path.basename(pb_name), as_text=False)
+            pass
+        print("Exported {} (int8 accuracy simulation: float32 kernels with int8 values and fake-quantized "
+              "inputs, float32 maths, not faster than float32): outputs {}".format(
+                  pb_name, [output.name for output in outputs]))
+        return pb_name
+
+    def run(self):
+        ranges, names = self.calibrate()
+        float_bytes, quant_bytes = self.quantize(ranges, names)
+        float_map, quant_map = self.eval_map(quantized=False), self.eval_map(quantized=True)
+        float_latency, quant_latency = self.latency(quantized=False), self.latency(quantized=True)
+        self.export()
+
+        print("weights (checkpoint size): float32={:.1f}MB int8={:.1f}MB".format(float_bytes / 2 ** 20,
+                                                                                 quant_bytes / 2 ** 20))
+        print("mAP_voc_07: float32={:.4f} int8={:.4f} drift={:+.4f}".format(
+            float_map[0], quant_map[0], quant_map[0] - float_map[0]))
+        print("mAP_voc_12: float32={:.4f} int8={:.4f} drift={:+.4f}".format(
+            float_map[1], quant_map[1], quant_map[1] - float_map[1]))
+        print("latency: float32 mean={:.2f}ms median={:.2f}ms, int8 simulation (float32 maths + fake quantization) "
+              "mean={:.2f}ms median={:.2f}ms".format(float_latency[0], float_latency[1],
+                                                    quant_latency[0], quant_latency[1]))
+        pass
+
+    pass
+
+
+if __name__ == '__main__':
+    runner = RunnerQuantize(net_model=ssd_vgg_300, ckpt_path="./checkpoints/VGG_VOC0712_SSD_300x300.ckpt")
+    runner.run()
+    # runner = RunnerQuantize(net_model=ssd_vgg_512, ckpt_path="./checkpoints/VGG_VOC0712Plus_SSD_512x512.ckpt")
+    # runner.run()
@@ -1,8 +1,8 @@
 import os
 import time
 import tensorflow as tf
-from nets import ssd_vgg_300
-from datasets import pascalvoc_2007
+from nets import ssd_vgg_300, ssd_vgg_512, ssd_teacher
+from datasets import pascalvoc_2007, pascalvoc_view, image_cache, dataset_check
 import tensorflow.contrib.slim as slim
 from preprocessing import ssd_vgg_preprocessing
 
@@ -25,7 +25,9 @@ class RunnerTrain(object):
                  data_format='NHWC', dataset_name=pascalvoc_2007,
                  ckpt_path='./models/ssd_vgg_300', ckpt_name="ssd_300_vgg.ckpt",
                  image_net_ckpt_model_file="./models/vgg/vgg_16.ckpt", image_net_ckpt_model_scope="vgg_16",
-                 weight_decay=0.00004, negative_ratio=3., loss_alpha=1., label_smoothing=0.0):
+                 weight_decay=0.00004, negative_ratio=3., loss_alpha=1., label_smoothing=0.0,
+                 image_cache_dir=None, image_cache_max_side=None, dataset_view=None, net_kwargs=None,
+                 distillation=None, negative_mining=None):
         # 运行方式
         # run_type=1：从0开始训练
         # run_type=2：从SSD模型开始训练
@@ -40,6 +42,20 @@ class RunnerTrain(object):
         self.dataset_name = dataset_name
         self.dataset_split_name = dataset_split_name
         self.dataset = dataset_name.get_split(dataset_split_name, dataset_dir, None, None)
+        # 隔离列表：data/check_data.py检查出的坏记录，不为空时通过数据视图跳过
+        self.quarantine_filename = dataset_check.get_dataset_quarantine_filename(self.dataset)
+        self.quarantine = dataset_check.read_quarantine(self.quarantine_filename) \
+            if tf.gfile.Exists(self.quarantine_filename) else None
+        # 数据视图：只训练某些类的图片(labels)或者按类别权重重采样(class_weights)，参数见pascalvoc_view.get_view
+        if dataset_view is not None and image_cache_dir:
+            # 图片缓存包含划分的所有记录，均匀地读取，不能按视图筛选和重采样
+            raise ValueError("dataset_view can not be used with image_cache_dir, the image cache reads all the "
+                             "records of the split uniformly.")
+        if dataset_view is not None or self.quarantine:
+            self.dataset = pascalvoc_view.get_view(self.dataset, **(dataset_view or {}))
+        # 解码后的图片缓存：不为None时从内存映射文件读取图片，不再解码JPEG，适合小数据集
+        self.image_cache_dir = image_cache_dir
+        self.image_cache_max_side = image_cache_max_side
 
         # 训练相关参数
         self.batch_size = batch_size
@@ -49,6 +65,8 @@ class RunnerTrain(object):
         self.negative_ratio = negative_ratio
         self.loss_alpha = loss_alpha
         self.label_smoothing = label_smoothing
+        # 难负样本挖掘："global"整个批次一起选，"per_image"每张图片分别选（ssd_losses），None为损失函数的默认值
+        self.negative_mining = negative_mining
         self.decay_steps = int(self.dataset.num_samples / self.batch_size * 2.0)
         self.learning_rate_decay_factor = 0.94
         self.num_epochs_per_decay = 2.0
@@ -72,20 +90,40 @@ class RunnerTrain(object):
         self.image_net_ckpt_model_scope = image_net_ckpt_model_scope
 
         # 网络和default boxes
-        self.ssd_net = self.net_model.SSDNet(self.ssd_params)
+        # net_kwargs：SSDNet的其他参数，比如剪枝后的depths（changemodels/prune.py）
+        self.ssd_net = self.net_model.SSDNet(self.ssd_params, **(net_kwargs or {}))
         self.ssd_anchors = self.ssd_net.anchors(self.img_shape)
 
+        # 蒸馏：distillation不为None时，冻结的老师网络（比如ssd_vgg_512）检测的框和logits作为额外的监督
+        # {"net_model": ssd_vgg_512, "ckpt_path": 老师的模型, "top_k": 每张图片老师的框数,
+        #  "use_cache": 老师的输出是否缓存在image_cache_dir中（只算一次），"temperature", "beta", "alpha": 见ssd_distillation_losses}
+        self.distillation = dict(distillation) if distillation is not None else None
+        self.teacher = None
+        if self.distillation is not None:
+            self.teacher = ssd_teacher.SSDTeacher(self.distillation["net_model"], self.distillation["ckpt_path"],
+                                                  num_classes=self.num_class, top_k=self.distillation.get("top_k", 200))
+            if self.distillation.get("use_cache", False) and not self.image_cache_dir:
+                raise ValueError("The teacher cache needs an image cache, set image_cache_dir.")
+            pass
+
         # 数据：预处理，encode，批次
         # g_scores是（当前默认框与真实框的交）占（真实框）的比例
-        image, g_classes, g_localisations, g_scores = self._get_data_tensor(self.dataset, self.batch_size, self.data_format)
+        # 蒸馏时还有老师的目标：t_logits, t_localisations, t_scores
+        data_tensors = self._get_data_tensor(self.dataset, self.batch_size, self.data_format)
+        image, g_classes, g_localisations, g_scores = data_tensors[:4]
 
         # train_op, r_total_loss, r_predictions, r_localisations, r_logits, r_end_points,
         # learning_rate, image, g_classes, g_localisations, g_scores, global_step
-        self.net_tensor = self._get_net_tensor(data_format, image, g_classes, g_localisations, g_scores)
+        self.net_tensor = self._get_net_tensor(data_format, image, g_classes, g_localisations, g_scores,
+                                               teacher_targets=data_tensors[4:] or None)
 
         self.sess = tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True)))
-        # 默认保存：全局变量和可保存变量(ops.GraphKeys.GLOBAL_VARIABLES,ops.GraphKeys.SAVEABLE_OBJECTS)
-        self.saver = tf.train.Saver(max_to_keep=5, keep_checkpoint_every_n_hours=1.0, write_version=2)
+        # 默认保存：全局变量和可保存变量(ops.GraphKeys.GLOBAL_VARIABLES,ops.GraphKeys.SAVEABLE_OBJECTS)，老师的变量除外
+        var_list = None
+        if self.teacher is not None:
+            teacher_names = set(var.op.name for var in self.teacher.variables())
+            var_list = [var for var in tf.global_variables() if var.op.name not in teacher_names]
+        self.saver = tf.train.Saver(var_list=var_list, max_to_keep=5, keep_checkpoint_every_n_hours=1.0, write_version=2)
         pass
 
     def train_demo(self, num_batches=1000, print_1_freq=2, save_model_freq=200):
@@ -124,6 +162,10 @@ class RunnerTrain(object):
         else:
             self.print_info("run type is {}, but it is error.....")
             pass
+        # 老师在数据队列中运行，要在start_queue_runners之前恢复
+        if self.teacher is not None:
+            self.teacher.restore(self.sess)
+            self.print_info("Restored teacher from {}".format(self.teacher.ckpt_path))
 
         coord = tf.train.Coordinator()
         threads = tf.train.start_queue_runners(sess=self.sess, coord=coord)
@@ -150,33 +192,87 @@ class RunnerTrain(object):
 
     # 获取数据
     def _get_data_tensor(self, dataset, batch_size, data_format):
-        # 数据
-        provider = slim.dataset_data_provider.DatasetDataProvider(
-            dataset, common_queue_capacity=20 * batch_size, common_queue_min=10 * batch_size, shuffle=True)
-        # 提取数据
-        [image, labels, bboxes] = provider.get(['image', 'object/label', 'object/bbox'])
+        if self.image_cache_dir:
+            # 第一次使用时构建缓存，TFRecord文件、image_cache_max_side或者隔离列表变了时重新构建
+            filenames = sorted(tf.gfile.Glob(dataset.data_sources))
+            rebuilt = False
+            if not image_cache.has_image_cache(self.image_cache_dir, self.dataset_split_name, filenames,
+                                               max_side=self.image_cache_max_side, quarantine=self.quarantine):
+                num_images = image_cache.build_image_cache(filenames, self.image_cache_dir, self.dataset_split_name,
+                                                           max_side=self.image_cache_max_side,
+                                                           quarantine=self.quarantine)
+                self.print_info("cached {} images in {}".format(num_images, self.image_cache_dir))
+                rebuilt = True
+            # 提取数据
+            image, labels, bboxes, index = image_cache.ImageCache(
+                self.image_cache_dir, self.dataset_split_name).get_tensors(shuffle=True, return_index=True)
+            if self.teacher is not None and self.distillation.get("use_cache", False):
+                # 第一次使用时构建老师的缓存，图片缓存重新构建后或者老师（模型、top_k、num_classes）变了时重新构建
+                if rebuilt or not ssd_teacher.has_teacher_cache(self.image_cache_dir, self.dataset_split_name,
+                                                                self.teacher):
+                    num_images = ssd_teacher.build_teacher_cache(self.teacher, self.image_cache_dir,
+                                                                 self.dataset_split_name)
+                    self.print_info("cached teacher outputs of {} images in {}".format(num_images, self.image_cache_dir))
+                t_bboxes, t_logits = ssd_teacher.TeacherCache(self.image_cache_dir,
+                                                              self.dataset_split_name).get_tensors(index)
+        else:
+            # 数据
+            provider = slim.dataset_data_provider.DatasetDataProvider(
+                dataset, common_queue_capacity=20 * batch_size, common_queue_min=10 * batch_size, shuffle=True)
+            # 提取数据
+            [image, labels, bboxes] = provider.get(['image', 'object/label', 'object/bbox'])
+
+        if self.teacher is not None:
+            if not (self.image_cache_dir and self.distillation.get("use_cache", False)):
+                # 老师看的是数据增强之前的图片
+                t_bboxes, t_logits = self.teacher.detections(image)
+            # 老师的框和真实框一起做数据增强：标签为-(i+1)，裁剪后和真实框一起过滤，之后再分开。
+            # 老师的框也参与了随机裁剪的min_object_covered，裁剪的分布略有不同
+            labels = tf.concat([labels, -1 - tf.range(self.teacher.top_k, dtype=labels.dtype)], axis=0)
+            bboxes = tf.concat([bboxes, t_bboxes], axis=0)
+            pass
+
         # 数据预处理
         image, labels, bboxes = ssd_vgg_preprocessing.preprocess_for_train(image, labels, bboxes,
                                                                            self.img_shape, data_format)
 
+        teacher_tensors = []
+        if self.teacher is not None:
+            is_teacher = labels < 0
+            t_indexes, t_bboxes = -1 - tf.boolean_mask(labels, is_teacher), tf.boolean_mask(bboxes, is_teacher)
+            labels, bboxes = tf.boolean_mask(labels, tf.logical_not(is_teacher)), \
+                tf.boolean_mask(bboxes, tf.logical_not(is_teacher))
+            # 老师的框和学生的默认框匹配：t_logits, t_localisations, t_scores
+            teacher_tensors = list(ssd_teacher.match_to_anchors(t_indexes, t_bboxes, t_logits, self.ssd_anchors,
+                                                                prior_scaling=self.ssd_params.prior_scaling))
+            pass
+
         # 编码label和boxes：Encode ground-truth labels and bboxes.
         classes, localisations, scores = self.ssd_net.bboxes_encode(labels, bboxes, self.ssd_anchors)
 
         # reshape_list：拉直
-        batch_tensors = self._reshape_list([image, classes, localisations, scores])
+        batch_tensors = self._reshape_list([image, classes, localisations, scores] + teacher_tensors)
         r = tf.train.batch(batch_tensors, batch_size=batch_size, capacity=5 * batch_size)
 
         # reshape_list：变成原来的形状
-        return self._reshape_list(r, shape=[1] + [len(self.ssd_anchors)] * 3)
+        return self._reshape_list(r, shape=[1] + [len(self.ssd_anchors)] * (3 + len(teacher_tensors)))
 
     # 获取网络输出
-    def _get_net_tensor(self, data_format, image, g_classes, g_localisations, g_scores):
+    def _get_net_tensor(self, data_format, image, g_classes, g_localisations, g_scores, teacher_targets=None):
         with slim.arg_scope(self.ssd_net.arg_scope(weight_decay=self.weight_decay, data_format=data_format)):
             r_predictions, r_localisations, r_logits, r_end_points = self.ssd_net.net(image, is_training=True)
+            # 蒸馏的损失：老师的目标和参数
+            teacher = None
+            if teacher_targets is not None:
+                t_logits, t_localisations, t_scores = teacher_targets
+                teacher = dict(tlogits=t_logits, tlocalisations=t_localisations, tscores=t_scores,
+                               temperature=self.distillation.get("temperature", 2.),
+                               beta=self.distillation.get("beta", 1.), alpha=self.distillation.get("alpha", 1.))
             # Add loss function.
             self.ssd_net.losses(r_logits, r_localisations, g_classes, g_localisations, g_scores,
                                 negative_ratio=self.negative_ratio, alpha=self.loss_alpha,
-                                label_smoothing=self.label_smoothing)
+                                label_smoothing=self.label_smoothing, teacher=teacher,
+                                negative_mining=self.negative_mining)
             total_loss = tf.get_collection(tf.GraphKeys.LOSSES)
             r_total_loss = tf.add_n(total_loss, name='total_loss')
 
@@ -198,7 +294,9 @@ class RunnerTrain(object):
 
         # run_type=4：从ImageNet模型开始训练，且固定ImageNet的参数来训练指定的scope。达到要求后，可以转run_type=2
         var_list = self.get_variables_to_train(Trainable_Scopes) if self.run_type == 4 else tf.trainable_variables()
-        train_op = optimizer.minimize(r_total_loss, global_step, var_list=var_list)
+        # 有批归一化的网络(例如ssd_mobilenet_300)需要同时更新滑动平均，VGG网络没有update ops
+        with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+            train_op = optimizer.minimize(r_total_loss, global_step, var_list=var_list)
 
         return [train_op, r_total_loss, r_predictions, r_localisations, r_logits, r_end_points,
                 learning_rate, image, g_classes, g_localisations, g_scores, global_step]
@@ -253,8 +351,11 @@ class RunnerTrain(object):
         # 加载模型
         ckpt = tf.train.get_checkpoint_state(log_dir)
         if ckpt and ckpt.model_checkpoint_path:
-            # 恢复可训练变量
-            var_list = tf.trainable_variables()
+            # 1. 恢复可训练变量和模型变量（批归一化的moving_mean/moving_variance不可训练，但要恢复），老师的变量除外
+            teacher_names = set(var.op.name for var in self.teacher.variables()) if self.teacher is not None else set()
+            var_list = [var for var in tf.trainable_variables() if var.op.name not in teacher_names]
+            var_list.extend([var for var in slim.get_model_variables()
+                             if var not in var_list and var.op.name not in teacher_names])
             # 2. 恢复全局步长变量（若设置全局步长变量为可训练，则不需要这一步，在获取可训练变量的时候就会获取到）
             global_step = tf.get_collection(tf.GraphKeys.GLOBAL_STEP)
             if global_step:
@@ -334,5 +435,17 @@ def run_type_4():
     pass
 
 
+# 蒸馏：SSD512老师，SSD300学生
+def run_distillation():
+    runner = RunnerTrain(run_type=2, ckpt_path="./models/ssd_vgg_300_distill", ckpt_name="ssd_300_vgg.ckpt",
+                         batch_size=16, learning_rate=0.001, end_learning_rate=0.00001,
+                         image_cache_dir="./data/cache", image_cache_max_side=600,
+                         distillation={"net_model": ssd_vgg_512,
+                                       "ckpt_path": "./checkpoints/VGG_VOC0712Plus_SSD_512x512.ckpt",
+                                       "top_k": 200, "use_cache": True, "temperature": 2., "beta": 1., "alpha": 1.})
+    runner.train_demo(num_batches=100000, print_1_freq=10, save_model_freq=1000)
+    pass
+
+
 if __name__ == '__main__':
     run_type_1_or_2()
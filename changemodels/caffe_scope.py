@@ -2,13 +2,137 @@
 Specific Caffe scope used to import weights from a .caffemodel file.
 
 The idea is to create special initializers loading weights from protobuf .caffemodel files.
+
+The .caffemodel file is not parsed with `caffe_pb2`, which needs the caffe.proto of Caffe
+and copies every float of the repeated fields into Python objects. `read_caffemodel` walks
+the protobuf wire format of the memory-mapped file with the few fields below (a minimal
+caffe.proto), and the blobs are NumPy views on the packed floats of the file, without copy.
 """
-from caffe.proto import caffe_pb2
+import mmap
+from collections import namedtuple
 
 import numpy as np
 import tensorflow as tf
 
 
+# 最小的caffe.proto：只解析需要的字段，{字段号: 名字}
+NET_PARAMETER_FIELDS = {100: 'layer', 2: 'layers'}
+LAYER_PARAMETER_FIELDS = {1: 'name', 2: 'type', 7: 'blobs'}
+V1_LAYER_PARAMETER_FIELDS = {4: 'name', 5: 'type', 6: 'blobs'}
+BLOB_PROTO_FIELDS = {1: 'num', 2: 'channels', 3: 'height', 4: 'width', 5: 'data', 7: 'shape', 8: 'double_data'}
+BLOB_SHAPE_FIELDS = {1: 'dim'}
+# V1LayerParameter.LayerType中用到的类型
+V1_LAYER_TYPES = {4: 'Convolution'}
+
+# protobuf的wire type
+WIRE_VARINT, WIRE_FIXED64, WIRE_LENGTH_DELIMITED, WIRE_FIXED32 = 0, 1, 2, 5
+
+CaffeLayer = namedtuple('CaffeLayer', ['name', 'type', 'blobs'])
+
+
+def _read_varint(buf, pos):
+    result, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf, start, end, fields):
+    """Fields of a message in buf[start:end] whose numbers are in `fields`.
+
+    Yields:
+      (name, wire_type, value): value is the integer of a varint, else the (start, end)
+        of the bytes of the field.
+    """
+    pos = start
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == WIRE_VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == WIRE_FIXED64:
+            value, pos = (pos, pos + 8), pos + 8
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            length, pos = _read_varint(buf, pos)
+            value, pos = (pos, pos + length), pos + length
+        elif wire_type == WIRE_FIXED32:
+            value, pos = (pos, pos + 4), pos + 4
+        else:
+            raise ValueError('Unsupported protobuf wire type %d at offset %d.' % (wire_type, pos))
+        if number in fields:
+            yield fields[number], wire_type, value
+        pass
+    pass
+
+
+def _read_numbers(buf, wire_type, value, dtype):
+    """A packed repeated field as a view on buf, or one unpacked element as an array."""
+    if wire_type == WIRE_LENGTH_DELIMITED:
+        start, end = value
+        return np.frombuffer(buf, dtype=dtype, count=(end - start) // np.dtype(dtype).itemsize, offset=start)
+    if wire_type == WIRE_VARINT:
+        return np.array([value], dtype=dtype)
+    return np.frombuffer(buf, dtype=dtype, count=1, offset=value[0])
+
+
+def _decode_varints(buf, value):
+    start, end = value
+    result = []
+    while start < end:
+        dim, start = _read_varint(buf, start)
+        result.append(dim)
+    return result
+
+
+def _read_blob(buf, start, end):
+    data, dims, legacy_dims = [], [], {}
+    for name, wire_type, value in _iter_fields(buf, start, end, BLOB_PROTO_FIELDS):
+        if name == 'data':
+            data.append(_read_numbers(buf, wire_type, value, '<f4'))
+        elif name == 'double_data':
+            data.append(_read_numbers(buf, wire_type, value, '<f8'))
+        elif name == 'shape':
+            for _, dim_wire_type, dim in _iter_fields(buf, value[0], value[1], BLOB_SHAPE_FIELDS):
+                dims.extend(_decode_varints(buf, dim) if dim_wire_type == WIRE_LENGTH_DELIMITED else [dim])
+        else:
+            legacy_dims[name] = value
+        pass
+    # 打包的数据只有一段，是文件的视图；未打包的数据才需要拼接
+    data = data[0] if len(data) == 1 else np.concatenate(data) if data else np.zeros([0], np.float32)
+    if not dims:
+        dims = [legacy_dims.get(name, 1) for name in ['num', 'channels', 'height', 'width']]
+    return np.reshape(data, dims)
+
+
+def read_caffemodel(buf):
+    """Layers of a .caffemodel, one at a time.
+
+    Args:
+      buf: The content of the .caffemodel file, e.g. a read-only mmap.
+
+    Yields:
+      CaffeLayer(name, type, blobs): the blobs are views on buf, in the Caffe shape.
+    """
+    for name, _, (start, end) in _iter_fields(buf, 0, len(buf), NET_PARAMETER_FIELDS):
+        is_v1 = name == 'layers'
+        layer = {'name': '', 'type': '', 'blobs': []}
+        for field, _, value in _iter_fields(buf, start, end,
+                                            V1_LAYER_PARAMETER_FIELDS if is_v1 else LAYER_PARAMETER_FIELDS):
+            if field == 'blobs':
+                layer['blobs'].append(_read_blob(buf, value[0], value[1]))
+            elif field == 'type' and is_v1:
+                layer['type'] = V1_LAYER_TYPES.get(value, str(value))
+            else:
+                layer[field] = bytes(buf[value[0]:value[1]]).decode('utf-8')
+            pass
+        yield CaffeLayer(layer['name'], layer['type'], layer['blobs'])
+    pass
+
+
 class CaffeScope(object):
 
     def __init__(self):
@@ -16,20 +140,24 @@ class CaffeScope(object):
         self.layers = {}
         self.caffe_layers = None
         self.bgr_to_rgb = 0
+        self._file = None
+        self._buf = None
         pass
 
     def load(self, filename, bgr_to_rgb=True):
         """
         Load weights from a .caffemodel file and initialize counters.
 
+        The file is memory-mapped and only the layers with blobs are kept, as views on it.
+
         Params:
           filename: caffemodel file.
         """
         print('Loading Caffe file:', filename)
-        caffemodel_params = caffe_pb2.NetParameter()
-        caffemodel_str = open(filename, 'rb').read()
-        caffemodel_params.ParseFromString(caffemodel_str)
-        self.caffe_layers = caffemodel_params.layer
+        self.close()
+        self._file = open(filename, 'rb')
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.caffe_layers = [layer for layer in read_caffemodel(self._buf) if layer.blobs]
 
         # Layers collection.
         self.layers['convolution'] = [i for i, l in enumerate(self.caffe_layers) if l.type == 'Convolution']
@@ -39,19 +167,35 @@ class CaffeScope(object):
 
         pass
 
+    def close(self):
+        """Frees the layers and unmaps the file."""
+        self.caffe_layers = None
+        if self._buf is not None:
+            self._buf.close()
+            self._file.close()
+        self._buf, self._file = None, None
+        pass
+
+    def _take_blob(self, idx, blob_index):
+        """A blob of a layer, the layer being freed once all its blobs have been taken."""
+        layer = self.caffe_layers[idx]
+        blob = layer.blobs[blob_index]
+        layer.blobs[blob_index] = None
+        if all(b is None for b in layer.blobs):
+            self.caffe_layers[idx] = CaffeLayer(layer.name, layer.type, [])
+        return layer, blob
+
     def conv_weights_init(self):
         def _initializer(shape, dtype, partition_info=None):
             counter = self.counters.get(self.conv_weights_init, 0)
             idx = self.layers['convolution'][counter]
-            layer = self.caffe_layers[idx]
-            # Weights: reshape and transpose dimensions.
-            w = np.array(layer.blobs[0].data)
-            w = np.reshape(w, layer.blobs[0].shape.dim)
+            layer, w = self._take_blob(idx, 0)
+            # Weights: transpose dimensions.
             # w = np.transpose(w, (1, 0, 2, 3))
             w = np.transpose(w, (2, 3, 1, 0))
             if self.bgr_to_rgb == 1 and w.shape[2] == 3:
                 print('Convert BGR to RGB in convolution layer:', layer.name)
-                w[:, :, (0, 1, 2)] = w[:, :, (2, 1, 0)]
+                w = w[:, :, ::-1]
                 self.bgr_to_rgb += 1
             self.counters[self.conv_weights_init] = counter + 1
             print('Load weights from convolution layer:', layer.name, w.shape)
@@ -62,9 +206,9 @@ class CaffeScope(object):
         def _initializer(shape, dtype, partition_info=None):
             counter = self.counters.get(self.conv_biases_init, 0)
             idx = self.layers['convolution'][counter]
-            layer = self.caffe_layers[idx]
             # Biases data...
-            b = np.array(layer.blobs[1].data)
+            layer, b = self._take_blob(idx, 1)
+            b = np.reshape(b, [-1])
             self.counters[self.conv_biases_init] = counter + 1
             print('Load biases from convolution layer:', layer.name, b.shape)
             return tf.cast(b, dtype)
@@ -74,10 +218,8 @@ class CaffeScope(object):
         def _initializer(shape, dtype, partition_info=None):
             counter = self.counters.get(self.l2_norm_scale_init, 0)
             idx = self.layers['l2_normalization'][counter]
-            layer = self.caffe_layers[idx]
             # Scaling parameter.
-            s = np.array(layer.blobs[0].data)
-            s = np.reshape(s, layer.blobs[0].shape.dim)
+            layer, s = self._take_blob(idx, 0)
             self.counters[self.l2_norm_scale_init] = counter + 1
             print('Load scaling from L2 normalization layer:', layer.name, s.shape)
             return tf.cast(s, dtype)
@@ -2,11 +2,22 @@
 Convert a Caffe model file to TensorFlow checkpoint format.
 
 Assume that the network built is a equivalent (or a sub-) to the Caffe definition.
+
+  * `ConvertCaffeToTensorflow`: builds the network with initializers reading the Caffe
+    layers in the order of the network, then saves it;
+  * `ConvertCaffeToCheckpoint`: maps the Caffe layers to the variables with an explicit
+    table (`caffe_variable_table`), checks the shapes and writes the checkpoint from the
+    numpy arrays, without building the network.
 """
+import collections
+import mmap
+
+import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 
 from changemodels import caffe_scope
+from changemodels.checkpoint_utils import write_checkpoint
 from nets import ssd_vgg_300, ssd_vgg_512
 
 
@@ -26,33 +37,169 @@ class ConvertCaffeToTensorflow(object):
         # 加载权重
         caffemodel = caffe_scope.CaffeScope()
         caffemodel.load(self.caffemodel_path)
-        # 建立图， 加载网络后，利用caffemodel加载的权值初始化网络
-        with tf.Graph().as_default():
-            # Image placeholder and model.
-            img_input = tf.placeholder(shape=(1, self.net_model.default_params.img_shape[0],
-                                              self.net_model.default_params.img_shape[1], 3),  dtype=tf.float32)
-            # 定义网络， 使用caffemodel作为初始化器
-            with slim.arg_scope(self.ssd_net.arg_scope_caffe(caffemodel)):
-                self.ssd_net.net(img_input, is_training=False)
+        try:
+            # 建立图， 加载网络后，利用caffemodel加载的权值初始化网络
+            with tf.Graph().as_default():
+                # Image placeholder and model.
+                img_input = tf.placeholder(shape=(1, self.net_model.default_params.img_shape[0],
+                                                  self.net_model.default_params.img_shape[1], 3),  dtype=tf.float32)
+                # 定义网络， 使用caffemodel作为初始化器
+                with slim.arg_scope(self.ssd_net.arg_scope_caffe(caffemodel)):
+                    self.ssd_net.net(img_input, is_training=False)
+                    pass
+                # 保存图
+                with tf.Session() as session:
+                    # Run the init operation.
+                    session.run(tf.global_variables_initializer())
+                    # Save model in checkpoint.
+                    tf.train.Saver().save(session, self.ckpt_path, write_meta_graph=False)
                 pass
-            # 保存图
-            with tf.Session() as session:
-                # Run the init operation.
-                session.run(tf.global_variables_initializer())
-                # Save model in checkpoint.
-                tf.train.Saver().save(session, self.ckpt_path, write_meta_graph=False)
-            pass
+        finally:
+            # 释放层和内存映射的文件
+            caffemodel.close()
 
         pass
 
     pass
 
 
+def caffe_variable_table(net_model, num_classes=21):
+    """Caffe layers of an SSD VGG model (weiliu89/caffe, branch ssd) and their variables.
+
+    Returns:
+      An OrderedDict of Caffe layer name to (variable scope, [shape of every blob in the
+      TensorFlow layout]), a None dimension being unchecked.
+    """
+    ssd_net = net_model.SSDNet
+    params = ssd_net.default_params
+    scope = ssd_net.default_scope
+    table = collections.OrderedDict()
+
+    # VGG、conv6/conv7（Caffe的fc6/fc7）、额外层（blockN是Caffe的conv{N-2}_1和conv{N-2}_2）
+    caffe_names = {'conv6': 'fc6', 'conv7': 'fc7'}
+    for end_point, _, _, kernel_size, _, _ in net_model.EXTRA_BLOCKS:
+        caffe_name = 'conv%d' % (int(end_point[len('block'):]) - 2)
+        caffe_names[end_point + '/conv1x1'] = caffe_name + '_1'
+        caffe_names[end_point + '/conv%dx%d' % (kernel_size, kernel_size)] = caffe_name + '_2'
+    for layer, depth, end_point in ssd_vgg_300.ssd_vgg_layers(net_model.EXTRA_BLOCKS):
+        caffe_name = caffe_names.get(layer, layer.split('/')[-1])
+        table[caffe_name] = (scope + '/' + layer, [[None, None, None, depth], [depth]])
+
+    # 预测层：block4的输入是conv4_3_norm
+    for i, feat_layer in enumerate(params.feat_layers):
+        end_point_name = ('conv4_3' if feat_layer == 'block4' else 'fc7' if feat_layer == 'block7'
+                          else 'conv%d_2' % (int(feat_layer[len('block'):]) - 2))
+        box_scope = '%s/%s_box' % (scope, feat_layer)
+        if params.normalizations[i] > 0:
+            end_point_name += '_norm'
+            table[end_point_name] = (box_scope + '/L2Normalization', [[None]])
+        num_anchors = len(params.anchor_sizes[i]) + len(params.anchor_ratios[i])
+        for caffe_suffix, tf_name, depth in [('loc', 'conv_loc', num_anchors * 4),
+                                             ('conf', 'conv_cls', num_anchors * num_classes)]:
+            table['%s_mbox_%s' % (end_point_name, caffe_suffix)] = (box_scope + '/' + tf_name,
+                                                                    [[3, 3, None, depth], [depth]])
+    return table
+
+
+def _check_shape(caffe_name, shape, expected):
+    if len(shape) != len(expected) or any(e is not None and e != d for d, e in zip(shape, expected)):
+        raise ValueError('Caffe layer %s: shape %s, expected %s' % (caffe_name, list(shape), expected))
+    pass
+
+
+def caffe_to_values(caffe_layers, table, bgr_to_rgb=True):
+    """Variables of the checkpoint from the Caffe layers.
+
+    Args:
+      caffe_layers: An iterable of `caffe_scope.CaffeLayer`, e.g. `caffe_scope.read_caffemodel`.
+      table: See `caffe_variable_table`.
+      bgr_to_rgb: Whether to swap the input channels of the first convolution.
+
+    Returns:
+      A dict of variable name to numpy array.
+
+    Raises:
+      ValueError: if a layer of the table is missing or has another shape.
+    """
+    values = {}
+    found = set()
+    for layer in caffe_layers:
+        if layer.name not in table:
+            if layer.blobs:
+                print('Skip Caffe layer:', layer.name, layer.type)
+            continue
+        var_scope, shapes = table[layer.name]
+        if len(layer.blobs) != len(shapes):
+            raise ValueError('Caffe layer %s: %d blobs, expected %d' % (layer.name, len(layer.blobs), len(shapes)))
+        if layer.type == 'Normalize':
+            gamma = np.reshape(layer.blobs[0], [-1])
+            values[var_scope + '/gamma'] = gamma.astype(np.float32)
+        else:
+            # Caffe: [out, in, h, w] ==> TensorFlow: [h, w, in, out]
+            weights = np.transpose(layer.blobs[0], (2, 3, 1, 0))
+            if bgr_to_rgb and weights.shape[2] == 3:
+                weights = weights[:, :, ::-1]
+            values[var_scope + '/weights'] = weights.astype(np.float32)
+            values[var_scope + '/biases'] = np.reshape(layer.blobs[1], [-1]).astype(np.float32)
+        for blob_name, expected in zip(['weights', 'biases'] if layer.type != 'Normalize' else ['gamma'], shapes):
+            _check_shape(layer.name, values[var_scope + '/' + blob_name].shape, expected)
+        found.add(layer.name)
+        pass
+
+    missing = [name for name in table if name not in found]
+    if missing:
+        raise ValueError('Caffe layers not found: %s' % missing)
+    return values
+
+
+class ConvertCaffeToCheckpoint(object):
+
+    def __init__(self, net_model, caffemodel_path, num_class=21, ckpt_path=None, bgr_to_rgb=True):
+        self.net_model = net_model
+        self.caffemodel_path = caffemodel_path
+        self.num_class = num_class
+        self.ckpt_path = self.caffemodel_path.replace('.caffemodel', '.ckpt') if ckpt_path is None else ckpt_path
+        self.bgr_to_rgb = bgr_to_rgb
+        self.table = caffe_variable_table(net_model, num_classes=num_class)
+        pass
+
+    def convert(self):
+        """
+        :return: 变量名和形状
+        """
+        print('Loading Caffe file:', self.caffemodel_path)
+        with open(self.caffemodel_path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                # astype复制了数据，之后可以关闭文件
+                values = caffe_to_values(caffe_scope.read_caffemodel(buf), self.table, bgr_to_rgb=self.bgr_to_rgb)
+            finally:
+                try:
+                    buf.close()
+                except BufferError:
+                    # 出错时异常的traceback还引用着文件的视图，不能关闭，不掩盖原来的异常，由垃圾回收关闭
+                    pass
+        write_checkpoint(values, self.ckpt_path)
+        print('Saved {} variables from {} Caffe layers in {}'.format(len(values), len(self.table), self.ckpt_path))
+        return {name: value.shape for name, value in values.items()}
+
+    pass
+
+
 if __name__ == '__main__':
-    ConvertCaffeToTensorflow(net_model=ssd_vgg_300,
-                             caffemodel_path="../caffemodels/VGG_VOC0712_SSD_300x300/"
-                                             "VGG_VOC0712_SSD_300x300_iter_120000.caffemodel",
-                             ckpt_path="../checkpoints/VGG_VOC0712_SSD_300x300.ckpt").convert()
+    for _net_model, _caffemodel_path, _ckpt_path in [
+        (ssd_vgg_300, "../caffemodels/VGG_VOC0712_SSD_300x300/VGG_VOC0712_SSD_300x300_iter_120000.caffemodel",
+         "../checkpoints/VGG_VOC0712_SSD_300x300.ckpt"),
+        (ssd_vgg_512, "../caffemodels/VGG_VOC0712Plus_SSD_512x512_ft/"
+                      "VGG_VOC0712Plus_SSD_512x512_ft_iter_160000.caffemodel",
+         "../checkpoints/VGG_VOC0712Plus_SSD_512x512.ckpt")]:
+        ConvertCaffeToCheckpoint(net_model=_net_model, caffemodel_path=_caffemodel_path, ckpt_path=_ckpt_path).convert()
+
+    # 建图的转换
+    # ConvertCaffeToTensorflow(net_model=ssd_vgg_300,
+    #                          caffemodel_path="../caffemodels/VGG_VOC0712_SSD_300x300/"
+    #                                          "VGG_VOC0712_SSD_300x300_iter_120000.caffemodel",
+    #                          ckpt_path="../checkpoints/VGG_VOC0712_SSD_300x300.ckpt").convert()
 
     # ConvertCaffeToTensorflow(net_model=ssd_vgg_512,
     #                          caffemodel_path="../caffemodels/VGG_VOC0712Plus_SSD_512x512_ft/"
@@ -0,0 +1,25 @@
+"""
+Reading and writing checkpoints as dicts of variable name to numpy array, without building the network.
+"""
+import tensorflow as tf
+
+
+def read_checkpoint(ckpt_path):
+    """Reads all the variables of a checkpoint as a dict of name to numpy array."""
+    reader = tf.train.NewCheckpointReader(ckpt_path)
+    return {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()}
+
+
+def write_checkpoint(values, ckpt_path):
+    """Writes a dict of name to numpy array as a checkpoint."""
+    names = sorted(values)
+    with tf.Graph().as_default():
+        # 用load赋值，权重不会作为常量存进图里
+        variables = [tf.get_variable(name, shape=values[name].shape, dtype=tf.as_dtype(values[name].dtype))
+                     for name in names]
+        with tf.Session() as session:
+            for name, variable in zip(names, variables):
+                variable.load(values[name], session)
+            tf.train.Saver(variables).save(session, ckpt_path, write_meta_graph=False)
+        pass
+    pass
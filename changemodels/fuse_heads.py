@@ -0,0 +1,77 @@
+"""
+Convert a checkpoint with split multibox heads to fused multibox heads.
+
+`ssd_multibox_layer` predicts the locations and the classes of a feature layer with two
+convolutions, `conv_loc` and `conv_cls`. `ssd_multibox_layer_fused` does it with a single
+`conv_box` convolution whose output channels are the location channels then the class
+channels, hence its weights and biases are the ones of `conv_loc` and `conv_cls`
+concatenated on the last (output channels) axis. The optimizer slots of the heads are
+concatenated the same way, every other variable is copied unchanged.
+"""
+import os
+import numpy as np
+import tensorflow as tf
+
+from changemodels.checkpoint_utils import read_checkpoint, write_checkpoint
+
+
+_LOC_SCOPE = '/conv_loc/'
+_CLS_SCOPE = '/conv_cls/'
+_BOX_SCOPE = '/conv_box/'
+
+
+def fuse_head_values(values):
+    """Fuses the heads of the values of a checkpoint.
+
+    Args:
+      values: A dict of variable name to numpy array, with split heads.
+
+    Returns:
+      A dict of variable name to numpy array, with fused heads.
+    """
+    fused = {}
+    for name, value in values.items():
+        if _CLS_SCOPE in name:
+            if name.replace(_CLS_SCOPE, _LOC_SCOPE) not in values:
+                raise ValueError('%s has no location counterpart.' % name)
+            continue
+        if _LOC_SCOPE in name:
+            cls_name = name.replace(_LOC_SCOPE, _CLS_SCOPE)
+            if cls_name not in values:
+                raise ValueError('%s has no class counterpart.' % name)
+            # 位置通道在前，类别通道在后
+            fused[name.replace(_LOC_SCOPE, _BOX_SCOPE)] = np.concatenate([value, values[cls_name]], axis=-1)
+        else:
+            fused[name] = value
+    return fused
+
+
+class FuseMultiboxHeads(object):
+
+    def __init__(self, ckpt_path, fused_ckpt_path=None):
+        """
+        :param ckpt_path: checkpoint of the split heads, or its directory for the latest one
+        :param fused_ckpt_path: checkpoint of the fused heads, next to the input one by default
+        """
+        self.ckpt_path = tf.train.latest_checkpoint(ckpt_path) if os.path.isdir(ckpt_path) else ckpt_path
+        if self.ckpt_path is None:
+            raise ValueError('no checkpoint in %s.' % ckpt_path)
+        if fused_ckpt_path is None:
+            fused_ckpt_path = self.ckpt_path.replace('.ckpt', '_fused.ckpt')
+            fused_ckpt_path = fused_ckpt_path if fused_ckpt_path != self.ckpt_path else self.ckpt_path + '_fused'
+        self.fused_ckpt_path = fused_ckpt_path
+        pass
+
+    def convert(self):
+        values = read_checkpoint(self.ckpt_path)
+        fused = fuse_head_values(values)
+        write_checkpoint(fused, self.fused_ckpt_path)
+        print('{} variables, {} of fused heads: {} ==> {}'.format(
+            len(fused), sum(_BOX_SCOPE in name for name in fused), self.ckpt_path, self.fused_ckpt_path))
+        pass
+
+    pass
+
+
+if __name__ == '__main__':
+    FuseMultiboxHeads(ckpt_path="../checkpoints/VGG_VOC0712_SSD_300x300.ckpt").convert()
@@ -0,0 +1,246 @@
+"""
+Inference-time fusions on a frozen GraphDef, which keep the outputs of the graph:
+
+  * `remove_identities`: the Identity nodes, e.g. the `read` of the frozen variables and what
+    `tf.layers.dropout(training=False)` leaves in the graph;
+  * `fold_batch_norms`: a FusedBatchNorm after a convolution becomes a BiasAdd, its scale
+    being folded in the output channels of the convolution weights;
+  * `fold_scales`: a per-channel Mul by a constant which is only read by convolutions, like
+    the `gamma` of `l2_normalization`, is folded in the input channels of their weights. The
+    normalization before it is not linear, so the scale can not go into the preceding
+    convolution, but it can go into the next ones, the zero padding being unchanged by a scale;
+  * `fuse_conv_bias_relu`: Conv2D + BiasAdd (+ Relu) becomes one `_FusedConv2D` node,
+    if this TensorFlow has it (1.13 and later, NHWC on CPU).
+
+`optimize_for_inference` applies all of them and removes the nodes no longer used.
+"""
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2
+
+
+CONV_OP_TYPES = ('Conv2D', 'DepthwiseConv2dNative')
+BATCH_NORM_OP_TYPES = ('FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3')
+
+
+def node_name(input_name):
+    """Name of the node of an input, without the control dependency mark and the output index."""
+    return (input_name[1:] if input_name.startswith('^') else input_name).split(':')[0]
+
+
+def _copy(graph_def):
+    result = tf.GraphDef()
+    result.CopyFrom(graph_def)
+    return result
+
+
+def _nodes(graph_def):
+    return {node.name: node for node in graph_def.node}
+
+
+def _consumers(graph_def):
+    """Nodes reading every node, with the output index they read (-1 for a control dependency)."""
+    consumers = {}
+    for node in graph_def.node:
+        for input_name in node.input:
+            index = -1 if input_name.startswith('^') else int(input_name.split(':')[1]) if ':' in input_name else 0
+            consumers.setdefault(node_name(input_name), []).append((node, index))
+    return consumers
+
+
+def _only_output_0_read(consumers, name):
+    return all(index == 0 for _, index in consumers.get(name, []))
+
+
+def _const_value(node):
+    return tf.make_ndarray(node.attr['value'].tensor)
+
+
+def _add_const(graph_def, nodes, name, value):
+    """Adds a Const node, with a unique name."""
+    unique_name, i = name, 1
+    while unique_name in nodes:
+        unique_name, i = '%s_%d' % (name, i), i + 1
+    node = graph_def.node.add()
+    node.name, node.op = unique_name, 'Const'
+    node.attr['dtype'].type = tf.as_dtype(value.dtype).as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(value))
+    nodes[unique_name] = node
+    return node
+
+
+def _const_input(nodes, node, index):
+    """Value of an input which is a Const node, None otherwise."""
+    input_node = nodes.get(node_name(node.input[index]))
+    return _const_value(input_node) if input_node is not None and input_node.op == 'Const' else None
+
+
+def remove_identities(graph_def, output_names):
+    """Removes the Identity nodes, except the outputs and the ones with control dependencies."""
+    forward = {node.name: node.input[0] for node in graph_def.node
+               if node.op == 'Identity' and node.name not in output_names
+               and not any(input_name.startswith('^') for input_name in node.input)}
+
+    def resolve(input_name):
+        if input_name.startswith('^'):
+            name = input_name[1:]
+            while name in forward:
+                name = node_name(forward[name])
+            return '^' + name
+        while node_name(input_name) in forward:
+            input_name = forward[node_name(input_name)]
+        return input_name
+
+    result = tf.GraphDef()
+    result.versions.CopyFrom(graph_def.versions)
+    result.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if node.name in forward:
+            continue
+        new_node = result.node.add()
+        new_node.CopyFrom(node)
+        del new_node.input[:]
+        new_node.input.extend([resolve(input_name) for input_name in node.input])
+    return result
+
+
+def fold_batch_norms(graph_def, output_names):
+    """Folds the inference FusedBatchNorm after a convolution into the convolution weights and a BiasAdd."""
+    graph_def = _copy(graph_def)
+    nodes, consumers = _nodes(graph_def), _consumers(graph_def)
+    for bn in list(graph_def.node):
+        if bn.op not in BATCH_NORM_OP_TYPES or bn.attr['is_training'].b or not _only_output_0_read(consumers, bn.name):
+            continue
+        conv = nodes[node_name(bn.input[0])]
+        if conv.op not in CONV_OP_TYPES or conv.name in output_names or len(consumers[conv.name]) != 1:
+            continue
+        weights = _const_input(nodes, conv, 1)
+        params = [_const_input(nodes, bn, i) for i in range(1, 5)]
+        if weights is None or any(param is None for param in params):
+            continue
+        scale, offset, mean, variance = params
+        multiplier = scale / np.sqrt(variance + bn.attr['epsilon'].f)
+        # Conv2D: [h, w, in, out]，DepthwiseConv2dNative: [h, w, in, multiplier]，输出通道是 in * multiplier
+        weights = weights * np.reshape(multiplier, weights.shape[2:] if conv.op != 'Conv2D' else [-1])
+        conv.input[1] = _add_const(graph_def, nodes, conv.name + '/folded_weights', weights.astype(np.float32)).name
+        bias = _add_const(graph_def, nodes, bn.name + '/folded_bias', (offset - mean * multiplier).astype(np.float32))
+
+        # 名字不变，使用者不用改
+        dtype, data_format = bn.attr['T'].type, bn.attr['data_format'].s
+        bn.op = 'BiasAdd'
+        del bn.input[:]
+        bn.input.extend([conv.name, bias.name])
+        bn.ClearField('attr')
+        bn.attr['T'].type = dtype
+        bn.attr['data_format'].s = data_format
+    return graph_def
+
+
+def fold_scales(graph_def, output_names):
+    """Folds a per-channel Mul by a constant into the input channels of the NHWC convolutions reading it."""
+    graph_def = _copy(graph_def)
+    nodes, consumers = _nodes(graph_def), _consumers(graph_def)
+    for mul in list(graph_def.node):
+        if mul.op != 'Mul' or mul.name in output_names:
+            continue
+        for scale_index in (1, 0):
+            scale = _const_input(nodes, mul, scale_index)
+            if scale is not None and scale.ndim == 1:
+                break
+        else:
+            continue
+        users = consumers.get(mul.name, [])
+        users_weights = [_const_input(nodes, user, 1) if user.op in CONV_OP_TYPES else None for user, _ in users]
+        if not users or any(weights is None or weights.shape[2] != scale.size or index != 0 or
+                            node_name(user.input[0]) != mul.name or node_name(user.input[1]) == mul.name or
+                            user.attr['data_format'].s not in (b'', b'NHWC')
+                            for (user, index), weights in zip(users, users_weights)):
+            continue
+        # 卷积直接读Mul的另一个输入，scale乘到卷积核的输入通道上
+        for (user, _), weights in zip(users, users_weights):
+            weights = weights * np.reshape(scale, [1, 1, -1, 1])
+            user.input[0] = mul.input[1 - scale_index]
+            user.input[1] = _add_const(graph_def, nodes, user.name + '/folded_weights', weights.astype(np.float32)).name
+        pass
+    return graph_def
+
+
+def has_fused_conv2d():
+    """Whether this TensorFlow has the `_FusedConv2D` op."""
+    graph_def = tf.GraphDef()
+    for name in ['x', 'filter', 'bias']:
+        node = graph_def.node.add()
+        node.name, node.op = name, 'Placeholder'
+        node.attr['dtype'].type = tf.float32.as_datatype_enum
+    node = graph_def.node.add()
+    node.name, node.op = 'conv', '_FusedConv2D'
+    node.input.extend(['x', 'filter', 'bias'])
+    node.attr['T'].type = tf.float32.as_datatype_enum
+    node.attr['num_args'].i = 1
+    node.attr['strides'].list.i.extend([1, 1, 1, 1])
+    node.attr['padding'].s = b'SAME'
+    node.attr['fused_ops'].list.s.extend([b'BiasAdd'])
+    try:
+        with tf.Graph().as_default():
+            tf.import_graph_def(graph_def, name='')
+    except (ValueError, tf.errors.NotFoundError):
+        return False
+    return True
+
+
+def fuse_conv_bias_relu(graph_def, output_names):
+    """Fuses NHWC Conv2D + BiasAdd (+ Relu) into `_FusedConv2D`."""
+    graph_def = _copy(graph_def)
+    nodes, consumers = _nodes(graph_def), _consumers(graph_def)
+    for bias_add in list(graph_def.node):
+        if bias_add.op != 'BiasAdd':
+            continue
+        conv = nodes[node_name(bias_add.input[0])]
+        if conv.op != 'Conv2D' or conv.name in output_names or len(consumers[conv.name]) != 1 or \
+                conv.attr['data_format'].s not in (b'', b'NHWC') or conv.attr['padding'].s == b'EXPLICIT':
+            continue
+        users = consumers.get(bias_add.name, [])
+        if len(users) == 1 and users[0][0].op == 'Relu' and bias_add.name not in output_names:
+            fused, fused_ops = users[0][0], [b'BiasAdd', b'Relu']
+        else:
+            fused, fused_ops = bias_add, [b'BiasAdd']
+
+        # 名字不变，使用者不用改
+        attrs = {key: attr_value_pb2.AttrValue() for key in ['T', 'strides', 'padding', 'dilations',
+                                                             'use_cudnn_on_gpu'] if key in conv.attr}
+        for key, value in attrs.items():
+            value.CopyFrom(conv.attr[key])
+        inputs = [conv.input[0], conv.input[1], bias_add.input[1]]
+        fused.op = '_FusedConv2D'
+        del fused.input[:]
+        fused.input.extend(inputs)
+        fused.ClearField('attr')
+        for key, value in attrs.items():
+            fused.attr[key].CopyFrom(value)
+        fused.attr['data_format'].s = b'NHWC'
+        fused.attr['num_args'].i = 1
+        fused.attr['fused_ops'].list.s.extend(fused_ops)
+    return graph_def
+
+
+def optimize_for_inference(graph_def, output_names, fuse_activations=True):
+    """Applies all the fusions to a frozen GraphDef.
+
+    Args:
+      output_names: Names of the output nodes, kept as they are.
+      fuse_activations: Whether to fuse Conv2D + BiasAdd + Relu, if this TensorFlow can.
+
+    Returns:
+      The optimized GraphDef, with only the nodes the outputs need.
+    """
+    graph_def = remove_identities(graph_def, output_names)
+    graph_def = fold_batch_norms(graph_def, output_names)
+    graph_def = fold_scales(graph_def, output_names)
+    if fuse_activations and has_fused_conv2d():
+        graph_def = fuse_conv_bias_relu(graph_def, output_names)
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, list(output_names))
+    # 被删掉的变量不能再作为colocation
+    for node in graph_def.node:
+        if '_class' in node.attr:
+            del node.attr['_class']
+    return graph_def
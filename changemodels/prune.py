@@ -0,0 +1,124 @@
+"""
+Structured channel pruning of the VGG-based SSD networks.
+
+The channels of a convolution are ranked by the L1 norm of their filters and the smallest
+ones are removed. Removing the output channel c of a layer removes:
+  * `weights[..., c]` and `biases[c]` of the layer;
+  * `weights[:, :, c, :]` of the next convolution;
+  * if the layer is a feature layer, `weights[:, :, c, :]` of its multibox heads and
+    `gamma[c]` of its L2 normalization.
+
+All the convolutions being followed by a ReLU, zeroing the filter and the bias of a channel
+gives the same outputs as removing it: `mask_values` is used to measure the sensitivity of
+every layer without building the slimmer network, `prune_values` to write its checkpoint.
+The pruned network is `SSDNet(depths=...)`, `depths` being saved in `<pruned checkpoint>.depths.json`.
+"""
+import json
+import numpy as np
+import tensorflow as tf
+
+
+def kept_channels(weights, depth):
+    """Indices, in order, of the `depth` output channels with the largest L1 norms."""
+    l1_norms = np.sum(np.abs(np.reshape(weights, (-1, weights.shape[-1]))), axis=0)
+    return np.sort(np.argsort(-l1_norms, kind='mergesort')[:depth])
+
+
+def mask_values(values, scope, layer, depth):
+    """Zeroes the output channels of a layer which pruning to `depth` channels would remove.
+
+    Returns:
+      A dict of variable name to numpy array, only the weights and biases of the layer being copied.
+    """
+    weights_name, biases_name = '%s/%s/weights' % (scope, layer), '%s/%s/biases' % (scope, layer)
+    removed = np.ones(values[weights_name].shape[-1], dtype=bool)
+    removed[kept_channels(values[weights_name], depth)] = False
+    masked = dict(values)
+    masked[weights_name] = np.where(removed, 0, values[weights_name]).astype(values[weights_name].dtype)
+    masked[biases_name] = np.where(removed, 0, values[biases_name]).astype(values[biases_name].dtype)
+    return masked
+
+
+def is_model_value(name, scope):
+    # 只保留网络的权重，不保留优化器的slot
+    return name.startswith(scope + '/') and name.rsplit('/', 1)[-1] in ('weights', 'biases', 'gamma')
+
+
+def prune_values(values, scope, layers, depths):
+    """Prunes the values of a checkpoint.
+
+    Args:
+      values: A dict of variable name to numpy array.
+      scope: The scope of the network, e.g. 'ssd_300_vgg'.
+      layers: The convolutions of the backbone, see `ssd_vgg_300.ssd_vgg_layers`.
+      depths: A dict of convolution scope to its number of channels after pruning.
+
+    Returns:
+      A dict of variable name to numpy array of the pruned network, with a zero global step
+      and without the optimizer slots.
+    """
+    pruned = {name: value for name, value in values.items() if is_model_value(name, scope)}
+    for i, (layer, _, end_point) in enumerate(layers):
+        weights_name = '%s/%s/weights' % (scope, layer)
+        depth = depths.get(layer)
+        if depth is None or depth >= values[weights_name].shape[-1]:
+            continue
+        keep = kept_channels(values[weights_name], depth)
+        # 这一层的输出通道
+        pruned[weights_name] = pruned[weights_name][..., keep]
+        pruned['%s/%s/biases' % (scope, layer)] = pruned['%s/%s/biases' % (scope, layer)][keep]
+        # 下一层卷积和预测层的输入通道，L2归一化的scale
+        consumers = ['%s/%s/weights' % (scope, layers[i + 1][0])] if i + 1 < len(layers) else []
+        if end_point is not None:
+            consumers += [name for name in pruned if name.startswith('%s/%s_box/' % (scope, end_point))]
+        for name in consumers:
+            if name.endswith('/weights'):
+                pruned[name] = pruned[name][:, :, keep, :]
+            elif name.endswith('/gamma'):
+                pruned[name] = pruned[name][keep]
+        pass
+    pruned['global_step'] = np.zeros([], dtype=np.int64)
+    return pruned
+
+
+def choose_depths(sensitivity, baseline, layers, max_drop, multiple=8):
+    """Chooses the depth of every layer from its sensitivity.
+
+    Args:
+      sensitivity: A dict of layer to a dict of depth to the mAP with the layer pruned to this depth.
+      baseline: The mAP of the network not pruned.
+      max_drop: The largest mAP drop allowed for each layer.
+      multiple: The depths are multiples of it.
+
+    Returns:
+      A dict of layer to its depth, only for the pruned layers.
+    """
+    depths = {}
+    for layer, default_depth, _ in layers:
+        # 从大到小，直到第一个下降超过max_drop的通道数
+        depth = default_depth
+        for tested_depth, m_ap in sorted(((int(d), m) for d, m in sensitivity.get(layer, {}).items()), reverse=True):
+            if baseline - m_ap > max_drop:
+                break
+            depth = tested_depth
+        depth = max(int(np.ceil(depth / float(multiple))) * multiple, multiple)
+        if depth < default_depth:
+            depths[layer] = depth
+    return depths
+
+
+def write_json(value, filename):
+    with tf.gfile.GFile(filename + '.tmp', 'w') as f:
+        json.dump(value, f, indent=1, sort_keys=True)
+    tf.gfile.Rename(filename + '.tmp', filename, overwrite=True)
+    pass
+
+
+def read_json(filename):
+    with tf.gfile.GFile(filename, 'r') as f:
+        return json.load(f)
+    pass
+
+
+def get_depths_filename(pruned_ckpt_path):
+    return pruned_ckpt_path + '.depths.json'
@@ -0,0 +1,142 @@
+"""
+Post-training int8 quantization of the SSD networks.
+
+Weights: every convolution kernel `<scope>/weights` is quantized per output channel and
+symmetrically, scale[c] = max|w[..., c]| / 127 and w_int8 = round(w / scale). The quantized
+checkpoint stores `<scope>/weights_int8` (int8) and `<scope>/weights_scale` (float32) instead,
+4 times less memory, and `int8_weights_getter` dequantizes them in the graph. The biases and
+the L2 normalization scales are small and stay in float32.
+
+Activations: the range of the input of every convolution is calibrated on a sample of images
+(`calibration_tensors`), then `quantize_activations` inserts an 8 bits fake quantization before
+every convolution, so that the graph computes what an int8 convolution would.
+
+The ranges are saved next to the quantized checkpoint, in `<quantized checkpoint>.ranges.json`.
+
+All the maths stays in float32: the int8 checkpoint is 4 times smaller, and the graphs simulate
+the accuracy of an int8 network, but they are not faster. `dequantize_values` gives the float32
+kernels with the int8 values, to freeze them as constants instead of dequantizing at every run.
+"""
+import json
+import numpy as np
+import tensorflow as tf
+from tensorflow.contrib import graph_editor
+
+
+CONV_OP_TYPES = ('Conv2D', 'DepthwiseConv2dNative')
+
+
+def is_quantized_weights(name, shape):
+    """Whether a variable is a convolution kernel quantized to int8."""
+    return name.endswith('/weights') and shape is not None and len(shape) == 4
+
+
+def quantize_weights(weights):
+    """Quantizes a kernel per output channel (last axis).
+
+    Returns:
+      The int8 kernel and the float32 scale of every output channel.
+    """
+    max_abs = np.max(np.abs(np.reshape(weights, (-1, weights.shape[-1]))), axis=0)
+    scale = np.where(max_abs > 0, max_abs / 127., 1.).astype(np.float32)
+    return np.clip(np.round(weights / scale), -127, 127).astype(np.int8), scale
+
+
+def quantize_values(values, names=None):
+    """Quantizes the kernels of the values of a checkpoint.
+
+    Args:
+      values: A dict of variable name to numpy array.
+      names: Names of the variables to keep, e.g. the model variables without the optimizer
+        slots, None to keep all of them.
+
+    Returns:
+      A dict of variable name to numpy array, with int8 kernels and their scales.
+    """
+    quantized = {}
+    for name in (values if names is None else names):
+        value = values[name]
+        if is_quantized_weights(name, value.shape):
+            quantized[name + '_int8'], quantized[name + '_scale'] = quantize_weights(value)
+        else:
+            quantized[name] = value
+    return quantized
+
+
+def dequantize_values(quantized):
+    """Inverse of `quantize_values`: float32 kernels with the int8 values, times their scales.
+
+    Returns:
+      A dict of variable name to numpy array, with the names of the float checkpoint.
+    """
+    values = {}
+    for name, value in quantized.items():
+        if name.endswith('_int8'):
+            name = name[:-len('_int8')]
+            values[name] = value.astype(np.float32) * quantized[name + '_scale']
+        elif not (name.endswith('_scale') and name[:-len('_scale')] + '_int8' in quantized):
+            values[name] = value
+    return values
+
+
+def int8_weights_getter(getter, name, *args, **kwargs):
+    """Custom getter creating the int8 kernels and their scales, and returning the dequantized kernels.
+
+    Usage:
+        with tf.variable_scope(tf.get_variable_scope(), custom_getter=int8_weights_getter):
+            ssd_net.net(inputs, is_training=False)
+    """
+    shape = kwargs.get('shape')
+    if not is_quantized_weights(name, shape):
+        return getter(name, *args, **kwargs)
+    kwargs.update(dtype=tf.int8, initializer=tf.zeros_initializer(), regularizer=None, trainable=False)
+    weights = getter(name + '_int8', *args, **kwargs)
+    kwargs.update(shape=shape[-1:], dtype=tf.float32, initializer=tf.ones_initializer())
+    scale = getter(name + '_scale', *args, **kwargs)
+    return tf.cast(weights, tf.float32) * scale
+
+
+def conv_inputs(graph, scope):
+    """Inputs of the convolutions of a network, by convolution op name."""
+    return {op.name: op.inputs[0] for op in graph.get_operations()
+            if op.type in CONV_OP_TYPES and op.name.startswith(scope + '/')}
+
+
+def calibration_tensors(graph, scope):
+    """Min and max of the input of every convolution of a network, by convolution op name."""
+    with tf.name_scope('calibration'):
+        return {name: [tf.reduce_min(x), tf.reduce_max(x)] for name, x in conv_inputs(graph, scope).items()}
+    pass
+
+
+def quantize_activations(graph, ranges, num_bits=8):
+    """Inserts a fake quantization before every convolution of `ranges`.
+
+    Args:
+      ranges: A dict of convolution op name to the (min, max) of its input.
+    """
+    for name, (min_value, max_value) in ranges.items():
+        op = graph.get_operation_by_name(name)
+        x = op.inputs[0]
+        with graph.as_default(), tf.name_scope(None):
+            x_quant = tf.fake_quant_with_min_max_args(x, min=min_value, max=max_value, num_bits=num_bits,
+                                                      name=name + '_input_quant')
+        # 只改这个卷积的输入，x的其他使用者不变
+        graph_editor.reroute_ts([x_quant], [x], can_modify=[op])
+    pass
+
+
+def get_ranges_filename(quant_ckpt_path):
+    return quant_ckpt_path + '.ranges.json'
+
+
+def write_ranges(ranges, quant_ckpt_path):
+    with tf.gfile.GFile(get_ranges_filename(quant_ckpt_path), 'w') as f:
+        json.dump({name: [float(v) for v in value] for name, value in ranges.items()}, f, indent=1, sort_keys=True)
+    pass
+
+
+def read_ranges(quant_ckpt_path):
+    with tf.gfile.GFile(get_ranges_filename(quant_ckpt_path), 'r') as f:
+        return json.load(f)
+    pass
@@ -0,0 +1,25 @@
+"""
+Check the TFRecord files of a split in parallel and write the quarantine list of the bad records,
+which the data views, the image cache and RunnerTrain then skip.
+"""
+import tensorflow as tf
+
+from datasets import dataset_check, pascalvoc_2007
+
+FLAGS = tf.app.flags.FLAGS
+
+tf.app.flags.DEFINE_string('dataset_dir', './data/train', 'Directory of the TFRecord files.')
+tf.app.flags.DEFINE_string('dataset_split_name', 'train', 'The name of the split to check.')
+tf.app.flags.DEFINE_string('file_pattern', pascalvoc_2007.FILE_PATTERN, 'The file pattern of the split.')
+tf.app.flags.DEFINE_integer('num_classes', pascalvoc_2007.NUM_CLASSES,
+                            'Number of classes without the background, labels must be in [1, num_classes].')
+tf.app.flags.DEFINE_integer('num_workers', None, 'Number of checking processes, None means the number of CPUs.')
+
+
+def main(_):
+    print('Dataset directory:', FLAGS.dataset_dir)
+    dataset_check.check_split(FLAGS.dataset_dir, FLAGS.dataset_split_name, FLAGS.file_pattern,
+                              FLAGS.num_classes, num_workers=FLAGS.num_workers)
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -1,9 +1,10 @@
 import cv2
+import numpy as np
 import tensorflow as tf
 import matplotlib.pyplot as plt
 import tensorflow.contrib.slim as slim
 
-from datasets import pascalvoc_2007
+from datasets import pascalvoc_2007, pascalvoc_view, annotation_index, tfrecord_index
 
 
 class ShowImage(object):
@@ -55,6 +56,39 @@ class ShowImage(object):
         coord.join(threads)
         pass
 
+    # 通过记录偏移索引直接读取任意一张图片，不用从头读取TFRecord
+    def show_random_access(self, record_indexes=(), image_names=()):
+        """
+        :param record_indexes: 记录的下标，按照排序后的TFRecord文件连续编号
+        :param image_names: 原图片的名字，例如"000005"，需要转换时生成的标注索引
+        """
+        reader = tfrecord_index.RandomAccessTFRecords(sorted(tf.gfile.Glob(self.dataset.data_sources)))
+        records = [reader[index] for index in record_indexes]
+        if image_names:
+            index = annotation_index.AnnotationIndex(pascalvoc_view.get_dataset_index_filename(self.dataset))
+            records.extend(reader.read_image(index, index.find(name)) for name in image_names)
+
+        for record in records:
+            feature = tf.train.Example.FromString(record).features.feature
+            image = cv2.imdecode(np.frombuffer(feature['image/encoded'].bytes_list.value[0], dtype=np.uint8),
+                                 cv2.IMREAD_COLOR)[:, :, ::-1].copy()
+            height, width = image.shape[:2]
+            labels = list(feature['image/object/bbox/label'].int64_list.value)
+            bboxes = zip(*[feature['image/object/bbox/%s' % key].float_list.value
+                           for key in ['ymin', 'xmin', 'ymax', 'xmax']])
+            for ymin, xmin, ymax, xmax in bboxes:
+                cv2.rectangle(image, (int(xmin * width), int(ymin * height)), (int(xmax * width), int(ymax * height)),
+                              (255, 0, 0), 2)
+
+            plt.figure(figsize=(10, 10))
+            plt.imshow(image)
+            plt.show()
+
+            print('Image shape:', image.shape)
+            print('Labels:', labels)
+        reader.close()
+        pass
+
     pass
 
 
@@ -17,11 +17,11 @@ Convert a dataset to TFRecords format, which can be easily integrated into a Ten
 """
 import tensorflow as tf
 
-from datasets import pascalvoc_to_tfrecords
+from datasets import pascalvoc_to_tfrecords, coco_to_tfrecords, yolo_to_tfrecords, detection_to_tfrecords
 
 FLAGS = tf.app.flags.FLAGS
 
-tf.app.flags.DEFINE_string('dataset_name', 'pascalvoc', 'The name of the dataset to convert.')
+tf.app.flags.DEFINE_string('dataset_name', 'pascalvoc', 'The name of the dataset to convert: pascalvoc, coco or yolo.')
 tf.app.flags.DEFINE_string('dataset_dir',
                            # "C:\\ALISURE\\DataModel\\Data\\voc\\VOCtrainval_06-Nov-2007\\VOCdevkit\\VOC2007\\",
                            # "C:\\ALISURE\\DataModel\\Data\\voc\\VOCtest_06-Nov-2007\\VOCdevkit\\VOC2007\\",
@@ -35,6 +35,18 @@ tf.app.flags.DEFINE_string('output_dir',
                            './data/train',
                            # '../data/test',
                            'Output directory where to store TFRecords files.')
+tf.app.flags.DEFINE_integer('num_workers', None,
+                            'Number of conversion processes, None means the number of CPUs.')
+tf.app.flags.DEFINE_boolean('incremental', True,
+                            'Only convert the new or changed images of the manifest in output_dir.')
+tf.app.flags.DEFINE_integer('max_side', None,
+                            'Store the images downscaled to this longest side (e.g. 600), None keeps the originals.')
+tf.app.flags.DEFINE_integer('jpeg_quality', 95, 'JPEG quality of the downscaled images.')
+tf.app.flags.DEFINE_string('annotation_file', None, 'coco: the instances JSON file, dataset_dir being the image directory.')
+tf.app.flags.DEFINE_string('names_file', None, 'yolo: the class names file, one name per line.')
+tf.app.flags.DEFINE_string('label_file', None,
+                           'coco/yolo: a labels.txt of "label:name" lines, only these classes are converted. '
+                           'None numbers all the classes from 1.')
 
 
 def main(_):
@@ -44,7 +56,17 @@ def main(_):
     print('Output directory:', FLAGS.output_dir)
 
     if FLAGS.dataset_name == 'pascalvoc':
-        pascalvoc_to_tfrecords.run(FLAGS.dataset_dir, FLAGS.output_dir, FLAGS.output_name)
+        pascalvoc_to_tfrecords.run(FLAGS.dataset_dir, FLAGS.output_dir, FLAGS.output_name,
+                                   num_workers=FLAGS.num_workers, incremental=FLAGS.incremental,
+                                   max_side=FLAGS.max_side, jpeg_quality=FLAGS.jpeg_quality)
+    elif FLAGS.dataset_name in ('coco', 'yolo'):
+        label_table = detection_to_tfrecords.read_label_table(FLAGS.label_file) if FLAGS.label_file else None
+        if FLAGS.dataset_name == 'coco':
+            coco_to_tfrecords.run(FLAGS.annotation_file, FLAGS.dataset_dir, FLAGS.output_dir, FLAGS.output_name,
+                                  label_table=label_table, num_workers=FLAGS.num_workers)
+        else:
+            yolo_to_tfrecords.run(FLAGS.dataset_dir, FLAGS.output_dir, FLAGS.names_file, FLAGS.output_name,
+                                  label_table=label_table, num_workers=FLAGS.num_workers)
     else:
         raise ValueError('Dataset [%s] was not recognized.' % FLAGS.dataset_name)
 
@@ -0,0 +1,159 @@
+"""Columnar annotation index of Pascal VOC TFRecord files.
+
+The index is a sidecar `.npz` file next to the TFRecord files of a split, e.g.
+`voc_2007_train_index.npz` for `voc_2007_train_*.tfrecord`. It stores a row per
+image and a row per object, so that split sizes, per-class statistics and
+filtered subsets are computed with numpy instead of streaming the TFRecords.
+
+Images columns:
+    image_names: source image name ('' when unknown);
+    image_files, image_offsets: TFRecord file (index in `files`) and record offset in the file;
+    image_heights, image_widths: stored image size.
+Objects columns:
+    image_id: row of the image of the object;
+    label, ymin, xmin, ymax, xmax, difficult, truncated: annotations, boxes being relative;
+    file, offset: TFRecord file and record offset of the image of the object.
+"""
+import os
+import numpy as np
+import tensorflow as tf
+
+
+def get_index_filename(dataset_dir, file_pattern, split_name):
+    """Filename of the index of the files matching `file_pattern % split_name`, e.g. voc_2007_train_index.npz."""
+    return os.path.join(dataset_dir, (file_pattern % split_name).replace('_*.tfrecord', '') + '_index.npz')
+
+
+def read_tfrecord_annotations(filename):
+    """Reads the annotations of every record of a TFRecord file, without decoding the images.
+
+    Returns:
+      A list of (shape, bboxes, labels, difficult, truncated) per record, like `_process_image`.
+    """
+    annotations = []
+    for record in tf.python_io.tf_record_iterator(filename):
+        feature = tf.train.Example.FromString(record).features.feature
+        labels = list(feature['image/object/bbox/label'].int64_list.value)
+        bboxes = list(zip(*[feature['image/object/bbox/%s' % key].float_list.value
+                            for key in ['ymin', 'xmin', 'ymax', 'xmax']]))
+        difficult = list(feature['image/object/bbox/difficult'].int64_list.value) or [0] * len(labels)
+        truncated = list(feature['image/object/bbox/truncated'].int64_list.value) or [0] * len(labels)
+        annotations.append((list(feature['image/shape'].int64_list.value), bboxes, labels, difficult, truncated))
+    return annotations
+
+
+def write_annotation_index(index_filename, images):
+    """Writes the columnar index.
+
+    Args:
+      index_filename: The `.npz` file to write.
+      images: A list of (image name, TFRecord filename, record offset, annotations) per image,
+        annotations being (shape, bboxes, labels, difficult, truncated).
+    """
+    # 按照文件和偏移排序，和TFRecord中记录的顺序一致
+    images = sorted(images, key=lambda image: (os.path.basename(image[1]), image[2]))
+    files = sorted(set(os.path.basename(image[1]) for image in images))
+    file_ids = {filename: i for i, filename in enumerate(files)}
+
+    image_files = np.array([file_ids[os.path.basename(image[1])] for image in images], dtype=np.int64)
+    image_offsets = np.array([image[2] for image in images], dtype=np.int64)
+    num_objects = np.array([len(image[3][2]) for image in images], dtype=np.int64)
+    image_id = np.repeat(np.arange(len(images), dtype=np.int64), num_objects)
+    bboxes = np.reshape(np.array([bbox for image in images for bbox in image[3][1]], dtype=np.float32), (-1, 4))
+
+    columns = {
+        'files': np.array(files),
+        'image_names': np.array([image[0] for image in images]),
+        'image_files': image_files,
+        'image_offsets': image_offsets,
+        'image_heights': np.array([image[3][0][0] for image in images], dtype=np.int64),
+        'image_widths': np.array([image[3][0][1] for image in images], dtype=np.int64),
+        'image_id': image_id,
+        'label': np.array([label for image in images for label in image[3][2]], dtype=np.int64),
+        'ymin': bboxes[:, 0], 'xmin': bboxes[:, 1], 'ymax': bboxes[:, 2], 'xmax': bboxes[:, 3],
+        'difficult': np.array([d for image in images for d in image[3][3]], dtype=np.int64),
+        'truncated': np.array([t for image in images for t in image[3][4]], dtype=np.int64),
+        'file': image_files[image_id],
+        'offset': image_offsets[image_id],
+    }
+    np.savez(index_filename, **columns)
+    pass
+
+
+def build_annotation_index(filenames, index_filename):
+    """Builds the index of already converted TFRecord files, by streaming their Example protos once.
+
+    Returns:
+      The `AnnotationIndex`.
+    """
+    images = []
+    for filename in sorted(filenames):
+        images.extend(('', filename, offset, annotation)
+                      for offset, annotation in enumerate(read_tfrecord_annotations(filename)))
+    write_annotation_index(index_filename, images)
+    return AnnotationIndex(index_filename)
+
+
+class AnnotationIndex(object):
+    """Columns of an annotation index, see the module docstring."""
+
+    def __init__(self, index_filename):
+        columns = np.load(index_filename)
+        for key in columns.files:
+            setattr(self, key, columns[key])
+        pass
+
+    def image_annotations(self, image_id):
+        """Annotations of an image, as (shape, bboxes, labels, difficult, truncated) lists."""
+        rows = np.where(self.image_id == image_id)[0]
+        shape = [int(self.image_heights[image_id]), int(self.image_widths[image_id]), 3]
+        bboxes = [tuple(float(v) for v in bbox) for bbox in
+                  zip(self.ymin[rows], self.xmin[rows], self.ymax[rows], self.xmax[rows])]
+        return (shape, bboxes, self.label[rows].tolist(), self.difficult[rows].tolist(),
+                self.truncated[rows].tolist())
+
+    @property
+    def num_images(self):
+        return len(self.image_files)
+
+    @property
+    def num_objects(self):
+        return len(self.label)
+
+    def statistics(self, labels_to_names, ignore_difficult=False):
+        """(Images, Objects) statistics on every class, like `pascalvoc_2007.TRAIN_STATISTICS`.
+
+        Args:
+          labels_to_names: A map of labels to class names, e.g. {1: 'aeroplane', ...}.
+        """
+        mask = self.difficult == 0 if ignore_difficult else np.ones(self.num_objects, dtype=bool)
+        num_labels = max(list(labels_to_names.keys()) + [int(self.label.max()) if self.num_objects else 0]) + 1
+        objects = np.bincount(self.label[mask], minlength=num_labels)
+        # 每张图片每一类只算一次
+        pairs = np.unique(self.image_id[mask] * num_labels + self.label[mask])
+        images = np.bincount(pairs % num_labels, minlength=num_labels)
+
+        statistics = {name: (int(images[label]), int(objects[label])) for label, name in labels_to_names.items()}
+        statistics['total'] = (self.num_images, int(np.sum(mask)))
+        return statistics
+
+    def select(self, labels=None, ignore_difficult=False):
+        """Ids of the images with at least one object of `labels` (all the images with objects if None)."""
+        mask = self.difficult == 0 if ignore_difficult else np.ones(self.num_objects, dtype=bool)
+        if labels is not None:
+            mask = np.logical_and(mask, np.isin(self.label, list(labels)))
+        return np.unique(self.image_id[mask])
+
+    def find(self, image_name):
+        """Id of the image converted from `image_name`, e.g. '000005'."""
+        image_ids = np.where(self.image_names == image_name)[0]
+        if len(image_ids) == 0:
+            raise KeyError('image %s is not in the index.' % image_name)
+        return int(image_ids[0])
+
+    def record_locations(self, image_ids):
+        """TFRecord basenames and record offsets of some images."""
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        return self.files[self.image_files[image_ids]], self.image_offsets[image_ids]
+
+    pass
@@ -0,0 +1,99 @@
+"""Converts COCO detection annotations (instances_*.json) to TFRecords.
+
+The annotation file is streamed with `dataset_utils.iter_json_array`, so that
+large files are never loaded as a whole: the 'images' array is read first, then
+the boxes of the 'annotations' array are accumulated in compact columns.
+The examples are then written by `detection_to_tfrecords.run_sharded`, with the
+same schema as the Pascal VOC TFRecords.
+
+COCO boxes are [x, y, width, height] in pixels and are stored relative to the image
+size. Crowd annotations (iscrowd=1) are flagged as difficult, so that the VOC
+metrics ignore them.
+"""
+import os
+from array import array
+
+import numpy as np
+
+from datasets import dataset_utils, detection_to_tfrecords
+
+
+def _read_categories(annotation_file):
+    return [(category['id'], category['name']) for category in
+            dataset_utils.iter_json_array(annotation_file, 'categories')]
+
+
+def _read_images(annotation_file):
+    """Image id -> (file name, height, width)."""
+    return {image['id']: (image['file_name'], image['height'], image['width']) for image in
+            dataset_utils.iter_json_array(annotation_file, 'images')}
+
+
+def _read_annotations(annotation_file, category_labels):
+    """Compact columns of the boxes whose category is in `category_labels`, sorted by image id."""
+    image_ids, labels, crowds, boxes = array('q'), array('q'), array('b'), array('d')
+    for annotation in dataset_utils.iter_json_array(annotation_file, 'annotations'):
+        label = category_labels.get(annotation['category_id'])
+        if label is None:
+            continue
+        image_ids.append(annotation['image_id'])
+        labels.append(label)
+        crowds.append(int(annotation.get('iscrowd', 0)))
+        boxes.extend(annotation['bbox'])
+    image_ids = np.frombuffer(image_ids, dtype=np.int64)
+    boxes = np.reshape(np.frombuffer(boxes, dtype=np.float64), (-1, 4))
+    order = np.argsort(image_ids, kind='mergesort')
+    return (image_ids[order], np.frombuffer(labels, dtype=np.int64)[order],
+            np.frombuffer(crowds, dtype=np.int8)[order], boxes[order])
+
+
+def get_items(annotation_file, image_dir, label_table=None):
+    """Items of `detection_to_tfrecords.run_sharded`, one per image, sorted by image id.
+
+    Args:
+      annotation_file: COCO instances JSON file.
+      image_dir: Directory of the images.
+      label_table: {category name: (label, description)}, None numbers the categories
+        of the file from 1 in their order. The other categories are skipped.
+
+    Returns:
+      The items and the label table.
+    """
+    categories = _read_categories(annotation_file)
+    if label_table is None:
+        label_table = detection_to_tfrecords.make_label_table([name for _, name in categories])
+    category_labels = {category_id: label_table[name][0] for category_id, name in categories if name in label_table}
+    label_names = {label: name for name, (label, _) in label_table.items()}
+
+    images = _read_images(annotation_file)
+    image_ids, labels, crowds, boxes = _read_annotations(annotation_file, category_labels)
+    starts = np.searchsorted(image_ids, sorted(images.keys()), side='left')
+    ends = np.searchsorted(image_ids, sorted(images.keys()), side='right')
+
+    items = []
+    for image_id, start, end in zip(sorted(images.keys()), starts, ends):
+        file_name, height, width = images[image_id]
+        x, y, w, h = [boxes[start:end, i] for i in range(4)]
+        bboxes = list(zip((y / height).tolist(), (x / width).tolist(),
+                          np.minimum((y + h) / height, 1.).tolist(), np.minimum((x + w) / width, 1.).tolist()))
+        image_labels = labels[start:end].tolist()
+        items.append((os.path.splitext(file_name)[0], os.path.join(image_dir, file_name), [height, width, 3],
+                      image_labels, [label_names[label].encode('utf-8') for label in image_labels], bboxes,
+                      crowds[start:end].astype(np.int64).tolist(), [0] * len(image_labels)))
+    return items, label_table
+
+
+def run(annotation_file, image_dir, output_dir, name='coco_train', label_table=None, shuffling=False,
+        num_workers=None):
+    """Runs the conversion operation.
+
+    Args:
+      annotation_file: COCO instances JSON file, e.g. annotations/instances_train2017.json.
+      image_dir: Directory of the images, e.g. train2017/.
+      output_dir: Output directory, where labels.txt is also written.
+      label_table: See `get_items`.
+    """
+    items, label_table = get_items(annotation_file, image_dir, label_table)
+    detection_to_tfrecords.run_sharded(items, output_dir, name, shuffling, num_workers)
+    detection_to_tfrecords.write_label_table(label_table, output_dir)
+    pass
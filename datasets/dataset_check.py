@@ -0,0 +1,197 @@
+"""Parallel integrity check of the TFRecord files of a split, and its quarantine list.
+
+A bad record otherwise only shows up in the middle of a training, as a NaN loss or
+a decoder error in a queue runner thread. Every record is checked for:
+
+    * decoding: the Example parses and its image decodes, like `slim.tfexample_decoder.Image`;
+    * shape: `image/shape`, `image/height` and `image/width` match the decoded image;
+    * boxes: as many ymin, xmin, ymax, xmax as labels, finite, inside [0, 1],
+      with ymin < ymax and xmin < xmax;
+    * labels: in [1, num_classes], 0 being the background.
+
+The records with a problem are listed, as (file basename, record offset in the file),
+in `<prefix>_quarantine.json` next to the `<prefix>_*.tfrecord` files. The loaders
+skip them: `pascalvoc_view.get_view`, `image_cache.build_image_cache` and `RunnerTrain`.
+"""
+import os
+import sys
+import json
+import math
+import time
+import multiprocessing
+import tensorflow as tf
+
+from datasets import annotation_index
+
+
+def get_quarantine_filename(dataset_dir, file_pattern, split_name):
+    """Filename of the quarantine list of the files matching `file_pattern % split_name`."""
+    return os.path.join(dataset_dir, (file_pattern % split_name).replace('_*.tfrecord', '') + '_quarantine.json')
+
+
+def get_dataset_quarantine_filename(dataset):
+    """Filename of the quarantine list of a `Dataset` returned by `get_split`."""
+    data_sources = dataset.data_sources
+    return os.path.join(os.path.dirname(data_sources),
+                        os.path.basename(data_sources).replace('_*.tfrecord', '') + '_quarantine.json')
+
+
+def check_example(feature, image_shape, num_classes):
+    """Checks the annotations of a parsed Example against its decoded image.
+
+    Args:
+      feature: The `features.feature` map of the Example.
+      image_shape: [height, width, channels] of the decoded image.
+      num_classes: Number of classes, without the background.
+
+    Returns:
+      A list of problems, empty if the record is valid.
+    """
+    problems = []
+    shape = list(feature['image/shape'].int64_list.value)
+    if shape[:2] != list(image_shape[:2]):
+        problems.append('image/shape %s but decoded %s' % (shape, list(image_shape)))
+    for i, key in enumerate(['image/height', 'image/width']):
+        value = list(feature[key].int64_list.value)
+        if value != [image_shape[i]]:
+            problems.append('%s %s but decoded %d' % (key, value, image_shape[i]))
+
+    labels = list(feature['image/object/bbox/label'].int64_list.value)
+    coordinates = [list(feature['image/object/bbox/%s' % key].float_list.value)
+                   for key in ['ymin', 'xmin', 'ymax', 'xmax']]
+    if any(len(values) != len(labels) for values in coordinates):
+        problems.append('%d labels but %s coordinates' % (len(labels), [len(values) for values in coordinates]))
+        return problems
+    for key in ['difficult', 'truncated']:
+        values = feature['image/object/bbox/%s' % key].int64_list.value
+        if values and len(values) != len(labels):
+            problems.append('%d labels but %d %s flags' % (len(labels), len(values), key))
+
+    for i, (label, ymin, xmin, ymax, xmax) in enumerate(zip(labels, *coordinates)):
+        if not 1 <= label <= num_classes:
+            problems.append('object %d: label %d not in [1, %d]' % (i, label, num_classes))
+        bbox = (ymin, xmin, ymax, xmax)
+        if not all(math.isfinite(v) for v in bbox):
+            problems.append('object %d: box %s is not finite' % (i, bbox))
+        elif not all(0. <= v <= 1. for v in bbox):
+            problems.append('object %d: box %s is outside [0, 1]' % (i, bbox))
+        elif ymin >= ymax or xmin >= xmax:
+            problems.append('object %d: box %s is degenerate' % (i, bbox))
+    return problems
+
+
+def _check_file(filename, num_classes):
+    """Checks every record of a TFRecord file, decoding the images with TensorFlow.
+
+    Returns:
+      The file basename, its number of records and a list of (record offset, problems).
+    """
+    bad_records = []
+    num_records = 0
+    # 每个文件一个图，只用CPU，多个进程不会抢GPU
+    with tf.Graph().as_default():
+        image_data = tf.placeholder(tf.string, [])
+        image_shape = tf.shape(tf.image.decode_image(image_data, channels=3))
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            for offset, record in enumerate(tf.python_io.tf_record_iterator(filename)):
+                num_records += 1
+                try:
+                    feature = tf.train.Example.FromString(record).features.feature
+                    shape = sess.run(image_shape, {image_data: feature['image/encoded'].bytes_list.value[0]})
+                except Exception as e:
+                    bad_records.append((offset, ['decoding: %s' % str(e).split('\n')[0]]))
+                    continue
+                problems = check_example(feature, shape.tolist(), num_classes)
+                if problems:
+                    bad_records.append((offset, problems))
+    return os.path.basename(filename), num_records, bad_records
+
+
+def _check_file_star(args):
+    return _check_file(*args)
+
+
+def check_files(filenames, num_classes, num_workers=None):
+    """Checks TFRecord files with a process pool, one file per task.
+
+    Args:
+      filenames: A list of TFRecord filenames.
+      num_classes: Number of classes, without the background.
+      num_workers: Number of processes, None means the number of CPUs, 1 checks in the current process.
+
+    Returns:
+      The number of records and the quarantine list, a list of
+      {'file': basename, 'offset': record offset, 'problems': [...]} sorted by file and offset.
+    """
+    filenames = sorted(filenames)
+    num_workers = min(num_workers or multiprocessing.cpu_count(), max(len(filenames), 1))
+    args = [(filename, num_classes) for filename in filenames]
+
+    start_time = time.time()
+    num_records = 0
+    records = []
+    # spawn：每个子进程有自己干净的TensorFlow运行时
+    pool = multiprocessing.get_context("spawn").Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        results = pool.imap_unordered(_check_file_star, args) if pool else map(_check_file_star, args)
+        for i, (basename, file_records, bad_records) in enumerate(results):
+            num_records += file_records
+            records.extend({'file': basename, 'offset': offset, 'problems': problems}
+                           for offset, problems in bad_records)
+            sys.stdout.write('\r>> Checked %d/%d files, %d records (%.1f records/s), %d bad' % (
+                i + 1, len(filenames), num_records, num_records / max(time.time() - start_time, 1e-6), len(records)))
+            sys.stdout.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    print('')
+    return num_records, sorted(records, key=lambda record: (record['file'], record['offset']))
+
+
+def write_quarantine(quarantine_filename, num_records, records):
+    """Writes the quarantine list atomically."""
+    with tf.gfile.GFile(quarantine_filename + '.tmp', 'w') as f:
+        json.dump({'num_records': num_records, 'records': records}, f, indent=1, sort_keys=True)
+    tf.gfile.Rename(quarantine_filename + '.tmp', quarantine_filename, overwrite=True)
+    pass
+
+
+def read_quarantine(quarantine_filename):
+    """Reads a quarantine list as a set of (file basename, record offset)."""
+    with tf.gfile.GFile(quarantine_filename, 'r') as f:
+        records = json.load(f)['records']
+    return set((record['file'], record['offset']) for record in records)
+
+
+def quarantined_image_ids(index, quarantine):
+    """Ids in an `AnnotationIndex` of the quarantined records."""
+    locations = zip(index.files[index.image_files].tolist(), index.image_offsets.tolist())
+    return [image_id for image_id, location in enumerate(locations) if location in quarantine]
+
+
+def check_split(dataset_dir, split_name, file_pattern, num_classes, num_workers=None):
+    """Checks all the files of a split and writes its quarantine list.
+
+    The annotation index of the split, used by the views to skip the quarantined
+    records, is also built if the converter did not write one, even when no record
+    is quarantined.
+
+    Returns:
+      The quarantine list, see `check_files`.
+    """
+    filenames = tf.gfile.Glob(os.path.join(dataset_dir, file_pattern % split_name))
+    if not filenames:
+        raise ValueError('no file matches %s in %s.' % (file_pattern % split_name, dataset_dir))
+    num_records, records = check_files(filenames, num_classes, num_workers)
+
+    quarantine_filename = get_quarantine_filename(dataset_dir, file_pattern, split_name)
+    write_quarantine(quarantine_filename, num_records, records)
+    index_filename = annotation_index.get_index_filename(dataset_dir, file_pattern, split_name)
+    if not tf.gfile.Exists(index_filename):
+        annotation_index.build_annotation_index(filenames, index_filename)
+
+    for record in records:
+        print('%s:%d %s' % (record['file'], record['offset'], '; '.join(record['problems'])))
+    print('%d/%d records quarantined in %s' % (len(records), num_records, quarantine_filename))
+    return records
@@ -19,6 +19,7 @@ from __future__ import print_function
 
 import os
 import sys
+import json
 import tarfile
 
 from six.moves import urllib
@@ -61,6 +62,138 @@ def image_to_tfexample(image_data, image_format, height, width, class_id):
     }))
 
 
+def count_tfrecords(filenames):
+    """Counts the records stored in a list of TFRecord files.
+
+    Records are only framed, not parsed, so this is cheap compared to decoding.
+
+    Args:
+    filenames: A list of TFRecord filenames.
+
+    Returns:
+    The total number of records.
+    """
+    return sum(1 for filename in filenames for _ in tf.python_io.tf_record_iterator(filename))
+
+
+def write_tfrecords_subset(filenames, indexes, output_filename):
+    """Copies some records of a list of TFRecord files into a new TFRecord file.
+
+    Records are numbered continuously over `filenames`, in the given order,
+    and written in the order of `indexes`. They are copied without parsing.
+
+    Args:
+    filenames: A list of TFRecord filenames.
+    indexes: A list of global record indexes to copy.
+    output_filename: The TFRecord file to write.
+    """
+    wanted = set(indexes)
+    records = {}
+    index = 0
+    for filename in filenames:
+        for record in tf.python_io.tf_record_iterator(filename):
+            if index in wanted:
+                records[index] = record
+            index += 1
+    with tf.python_io.TFRecordWriter(output_filename) as tfrecord_writer:
+        for index in indexes:
+            tfrecord_writer.write(records[index])
+
+
+class _JsonStream(object):
+    """Incremental JSON tokenizer over a file read by chunks, values being decoded by `json`."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON file %s.' % self.f.name)
+
+    def next_char(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk.
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        if self.next_char() != '[':
+            raise ValueError('Expected a JSON array in %s.' % self.f.name)
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.next_char()
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('Expected , or ] in %s, got %s.' % (self.f.name, char))
+
+
+def iter_json_array(filename, key, chunk_size=1 << 20):
+    """Yields the elements of the array `key` of a JSON object file, without loading the whole file.
+
+    Only one element at a time is decoded, the other top-level arrays are skipped
+    element by element, so the memory does not depend on the size of the file.
+
+    Args:
+    filename: A JSON file holding an object, e.g. a COCO annotation file.
+    key: The top-level key of the array, e.g. 'annotations'.
+    chunk_size: Number of characters read at a time.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f, chunk_size)
+        if stream.next_char() != '{':
+            raise ValueError('Expected a JSON object in %s.' % filename)
+        while stream.peek() != '}':
+            name = stream.value()
+            if stream.next_char() != ':':
+                raise ValueError('Expected : after key %s in %s.' % (name, filename))
+            if stream.peek() == '[':
+                for element in stream.array():
+                    if name == key:
+                        yield element
+                if name == key:
+                    return
+            else:
+                stream.value()
+            if stream.peek() == ',':
+                stream.pos += 1
+    pass
+
+
 def download_and_uncompress_tarball(tarball_url, dataset_dir):
     """Downloads the `tarball_url` and uncompresses it locally.
 
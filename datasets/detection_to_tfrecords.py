@@ -0,0 +1,135 @@
+"""Sharded, multi-process writer of detection datasets to TFRecords.
+
+The examples use the same schema as `pascalvoc_to_tfrecords._convert_to_example`,
+so every converted dataset is read with `pascalvoc_common.get_split`. Like the
+Pascal VOC converter, the images are split into shards of SAMPLES_PER_FILES images,
+written by a process pool, with the record offset files and the annotation index.
+
+The converters of the other annotation formats (`coco_to_tfrecords`,
+`yolo_to_tfrecords`) only build the list of items, one per image:
+
+    (image name, image path, shape or None, labels, labels_text, bboxes, difficult, truncated)
+
+with relative [ymin, xmin, ymax, xmax] boxes. When the shape is None, it is read from
+the JPEG header.
+
+Labels map through a label table {source class name: (label, description)}, like
+`VOC_LABELS`, which can be read from a `labels.txt` file ('label:name' per line).
+"""
+import os
+import sys
+import time
+import struct
+import random
+import multiprocessing
+
+import tensorflow as tf
+
+from datasets import dataset_utils, annotation_index, tfrecord_index
+from datasets.pascalvoc_to_tfrecords import _convert_to_example, _get_output_filename, _get_index_filename
+from datasets.pascalvoc_to_tfrecords import RANDOM_SEED, SAMPLES_PER_FILES
+
+
+def make_label_table(names):
+    """Label table numbering the class names from 1, 0 being the background."""
+    return {name: (i + 1, name) for i, name in enumerate(names)}
+
+
+def read_label_table(label_file):
+    """Reads a label table from a 'label:name' file, see `dataset_utils.write_label_file`."""
+    labels_to_names = dataset_utils.read_label_file(os.path.dirname(label_file), os.path.basename(label_file))
+    return {name.decode('utf-8'): (label, name.decode('utf-8')) for label, name in labels_to_names.items()}
+
+
+def write_label_table(label_table, output_dir):
+    """Writes the labels.txt of the converted dataset."""
+    dataset_utils.write_label_file({label: name for name, (label, _) in label_table.items()}, output_dir)
+    pass
+
+
+def _jpeg_shape(image_data):
+    """[height, width, channels] from the SOF marker of a JPEG, without decoding it."""
+    pos = 2
+    while pos + 9 < len(image_data):
+        if image_data[pos:pos + 1] != b'\xff':
+            pos += 1
+            continue
+        marker = ord(image_data[pos + 1:pos + 2])
+        if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7 or marker == 0xff:
+            pos += 1 if marker == 0xff else 2
+            continue
+        length = struct.unpack('>H', image_data[pos + 2:pos + 4])[0]
+        # SOF0..SOF15 except DHT (c4), JPG (c8) and DAC (cc)
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', image_data[pos + 5:pos + 9])
+            return [height, width, 3]
+        pos += 2 + length
+    raise ValueError('No JPEG frame header found.')
+
+
+def _convert_shard(output_dir, name, fidx, items):
+    """Converts one shard of items into its own TFRecord file.
+
+    Returns:
+      The file index, the TFRecord filename, the image names written and their annotations.
+    """
+    tf_filename = _get_output_filename(output_dir, name, fidx)
+    img_names, annotations = [], []
+    with tf.python_io.TFRecordWriter(tf_filename) as tfrecord_writer:
+        for img_name, image_path, shape, labels, labels_text, bboxes, difficult, truncated in items:
+            image_data = tf.gfile.FastGFile(image_path, 'rb').read()
+            shape = shape or _jpeg_shape(image_data)
+            example = _convert_to_example(image_data, labels, labels_text, bboxes, shape, difficult, truncated)
+            tfrecord_writer.write(example.SerializeToString())
+            img_names.append(img_name)
+            annotations.append((shape, bboxes, labels, difficult, truncated))
+    tfrecord_index.write_offsets(tf_filename)
+    return fidx, tf_filename, img_names, annotations
+
+
+def _convert_shard_star(args):
+    return _convert_shard(*args)
+
+
+def run_sharded(items, output_dir, name, shuffling=False, num_workers=None):
+    """Writes the items into TFRecord files of SAMPLES_PER_FILES images with a process pool.
+
+    Args:
+      items: A list of items, see the module docstring, in a deterministic order.
+      output_dir: Output directory.
+      name: Basename of the TFRecord files, e.g. 'coco_2017_train'.
+      shuffling: Shuffle the items with RANDOM_SEED before sharding.
+      num_workers: Number of processes, None means the number of CPUs, 1 converts in the current process.
+    """
+    if not tf.gfile.Exists(output_dir):
+        tf.gfile.MakeDirs(output_dir)
+    items = list(items)
+    if shuffling:
+        random.Random(RANDOM_SEED).shuffle(items)
+    shard_args = [(output_dir, name, i // SAMPLES_PER_FILES, items[i:i + SAMPLES_PER_FILES])
+                  for i in range(0, len(items), SAMPLES_PER_FILES)]
+    num_workers = min(num_workers or multiprocessing.cpu_count(), max(len(shard_args), 1))
+
+    start_time = time.time()
+    converted = 0
+    index_images = []
+    # spawn：每个子进程有自己干净的TensorFlow运行时
+    pool = multiprocessing.get_context("spawn").Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        results = pool.imap_unordered(_convert_shard_star, shard_args) if pool else map(_convert_shard_star, shard_args)
+        for fidx, tf_filename, img_names, annotations in results:
+            index_images.extend((img_name, tf_filename, offset, annotation)
+                                for offset, (img_name, annotation) in enumerate(zip(img_names, annotations)))
+            converted += len(img_names)
+            sys.stdout.write('\r>> Converted %d/%d images (%.1f images/s), last file %s' % (
+                converted, len(items), converted / max(time.time() - start_time, 1e-6), tf_filename))
+            sys.stdout.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    annotation_index.write_annotation_index(_get_index_filename(output_dir, name), index_images)
+    print('\nFinished converting %d images in %d files with %d workers, %.1fs' % (
+        converted, len(shard_args), num_workers, time.time() - start_time))
+    pass
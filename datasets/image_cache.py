@@ -0,0 +1,184 @@
+"""Decoded image cache for small Pascal VOC-like datasets.
+
+The images of the TFRecord files of a split are decoded once, optionally
+downscaled, and stored as raw uint8 pixels in a single file which is read back
+with `np.memmap`. An index file stores the offset and shape of every image and
+the annotations (labels, relative bounding boxes, difficult and truncated flags).
+
+    <cache_dir>/<split_name>.uint8        raw RGB pixels of all the images
+    <cache_dir>/<split_name>_index.npz   offsets, shapes and annotations, and what the cache
+                                         was built from (source files, max_side, quarantine)
+
+Training then reads slices of the memory-mapped file instead of decoding JPEGs,
+which is worth it when the dataset fits in the page cache (a few thousand images).
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import tensorflow as tf
+
+
+def _get_cache_filenames(cache_dir, split_name):
+    return os.path.join(cache_dir, split_name + '.uint8'), os.path.join(cache_dir, split_name + '_index.npz')
+
+
+def _quarantine_digest(quarantine):
+    return hashlib.sha1(json.dumps(sorted(quarantine or [])).encode('utf-8')).hexdigest()
+
+
+def _get_cache_sources(filenames, max_side, quarantine):
+    return {'source_files': np.array([os.path.basename(filename) for filename in filenames], dtype=np.str_),
+            'max_side': np.array(max_side or 0, dtype=np.int64),
+            'quarantine_digest': np.array(_quarantine_digest(quarantine))}
+
+
+def has_image_cache(cache_dir, split_name, filenames=None, max_side=None, quarantine=None):
+    """Specifies whether the image cache of a split has been built and is up to date.
+
+    Args:
+      filenames, max_side, quarantine: If filenames is not None, the arguments the cache
+        would be built with by `build_image_cache`; a cache built from other TFRecord files,
+        with another max_side or another quarantine list is stale.
+    """
+    data_filename, index_filename = _get_cache_filenames(cache_dir, split_name)
+    if not (tf.gfile.Exists(data_filename) and tf.gfile.Exists(index_filename)):
+        return False
+    if filenames is None:
+        return True
+    index = np.load(index_filename)
+    # 旧版本的缓存没有记录来源，当作过期
+    if any(key not in index.files for key in ['source_files', 'max_side', 'quarantine_digest']):
+        return False
+    sources = _get_cache_sources(filenames, max_side, quarantine)
+    return (index['source_files'].tolist() == sources['source_files'].tolist() and
+            int(index['max_side']) == int(sources['max_side']) and
+            str(index['quarantine_digest']) == str(sources['quarantine_digest']))
+
+
+def build_image_cache(filenames, cache_dir, split_name, max_side=None, quarantine=None):
+    """Decodes the images of Pascal VOC TFRecord files into an image cache.
+
+    Args:
+      filenames: A list of TFRecord filenames, read in the given order.
+      cache_dir: The directory where the cache files are written.
+      split_name: Basename of the cache files.
+      max_side: If not None, downscale the images so that their longest side is at most max_side.
+        Boxes are relative, so they are unchanged.
+      quarantine: If not None, a set of (file basename, record offset) to skip, see `dataset_check`.
+
+    Returns:
+      The number of cached images.
+    """
+    if not tf.gfile.Exists(cache_dir):
+        tf.gfile.MakeDirs(cache_dir)
+    data_filename, index_filename = _get_cache_filenames(cache_dir, split_name)
+    if tf.gfile.Exists(data_filename):
+        tf.gfile.Remove(data_filename)
+
+    # Same decoding as slim.tfexample_decoder.Image, in a graph of its own.
+    with tf.Graph().as_default():
+        image_data = tf.placeholder(tf.string, [])
+        image = tf.image.decode_image(image_data, channels=3)
+        image.set_shape([None, None, 3])
+        image_size = tf.placeholder(tf.int32, [2])
+        resized = tf.cast(tf.round(tf.image.resize_images(image, image_size, method=tf.image.ResizeMethod.AREA)),
+                          tf.uint8)
+        with tf.Session() as sess:
+            offsets, shapes = [0], []
+            labels, bboxes, difficult, truncated, num_objects = [], [], [], [], []
+            with open(data_filename + '.tmp', 'wb') as f:
+                for filename in filenames:
+                    for offset, record in enumerate(tf.python_io.tf_record_iterator(filename)):
+                        if quarantine and (os.path.basename(filename), offset) in quarantine:
+                            continue
+                        feature = tf.train.Example.FromString(record).features.feature
+                        pixels = sess.run(image, {image_data: feature['image/encoded'].bytes_list.value[0]})
+                        height, width = pixels.shape[:2]
+                        if max_side and max(height, width) > max_side:
+                            scale = float(max_side) / max(height, width)
+                            size = [max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)]
+                            pixels = sess.run(resized, {image: pixels, image_size: size})
+                        f.write(pixels.tobytes())
+                        offsets.append(offsets[-1] + pixels.size)
+                        shapes.append(pixels.shape)
+
+                        label = list(feature['image/object/bbox/label'].int64_list.value)
+                        labels.extend(label)
+                        num_objects.append(len(label))
+                        bboxes.extend(zip(*[feature['image/object/bbox/%s' % key].float_list.value
+                                            for key in ['ymin', 'xmin', 'ymax', 'xmax']]))
+                        difficult.extend(feature['image/object/bbox/difficult'].int64_list.value or [0] * len(label))
+                        truncated.extend(feature['image/object/bbox/truncated'].int64_list.value or [0] * len(label))
+                        pass
+                    pass
+
+    np.savez(index_filename, offsets=np.array(offsets, dtype=np.int64), shapes=np.array(shapes, dtype=np.int64),
+             object_offsets=np.concatenate([[0], np.cumsum(num_objects)]).astype(np.int64),
+             labels=np.array(labels, dtype=np.int64), bboxes=np.reshape(np.array(bboxes, dtype=np.float32), (-1, 4)),
+             difficult=np.array(difficult, dtype=np.int64), truncated=np.array(truncated, dtype=np.int64),
+             **_get_cache_sources(filenames, max_side, quarantine))
+    # 最后才改名，这样中断的构建不会被当成完整的缓存
+    tf.gfile.Rename(data_filename + '.tmp', data_filename, overwrite=True)
+    return len(shapes)
+
+
+class ImageCache(object):
+    """Read access to an image cache built by `build_image_cache`."""
+
+    def __init__(self, cache_dir, split_name):
+        data_filename, index_filename = _get_cache_filenames(cache_dir, split_name)
+        index = np.load(index_filename)
+        self.offsets = index['offsets']
+        self.shapes = index['shapes']
+        self.object_offsets = index['object_offsets']
+        self.labels = index['labels']
+        self.bboxes = index['bboxes']
+        self.difficult = index['difficult']
+        self.truncated = index['truncated']
+        self.data = np.memmap(data_filename, dtype=np.uint8, mode='r')
+        pass
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def get(self, index):
+        """Gets one example, the image being a view of the memory-mapped file.
+
+        Returns:
+          image: uint8 array [height, width, 3];
+          labels: int64 array [N];
+          bboxes: float32 array [N, 4] of relative [ymin, xmin, ymax, xmax];
+          difficult: int64 array [N].
+        """
+        image = self.data[self.offsets[index]:self.offsets[index + 1]].reshape(self.shapes[index])
+        start, end = self.object_offsets[index], self.object_offsets[index + 1]
+        return image, self.labels[start:end], self.bboxes[start:end], self.difficult[start:end]
+
+    def get_tensors(self, shuffle=True, num_epochs=None, seed=None, return_index=False):
+        """Tensors of one example at a time, like `DatasetDataProvider.get(['image', 'object/label', 'object/bbox'])`.
+
+        The example indexes come from a queue, so `tf.train.start_queue_runners` must be called.
+
+        Args:
+          return_index: Whether to also return the index of the example, e.g. to read other
+            per-image data stored in the same order.
+
+        Returns:
+          image, labels, bboxes (, index): Tensors of one example.
+        """
+        index = tf.train.range_input_producer(len(self), num_epochs=num_epochs, shuffle=shuffle, seed=seed).dequeue()
+
+        def _get(i):
+            image, labels, bboxes, _ = self.get(i)
+            return np.asarray(image), labels, bboxes
+
+        image, labels, bboxes = tf.py_func(_get, [index], [tf.uint8, tf.int64, tf.float32], stateful=False)
+        image.set_shape([None, None, 3])
+        labels.set_shape([None])
+        bboxes.set_shape([None, 4])
+        if return_index:
+            return image, labels, bboxes, index
+        return image, labels, bboxes
+
+    pass
@@ -76,3 +76,10 @@ def get_split(split_name, dataset_dir, file_pattern=None, reader=None):
     return pascalvoc_common.get_split(split_name, dataset_dir, file_pattern, reader,
                                       SPLITS_TO_SIZES, ITEMS_TO_DESCRIPTIONS, NUM_CLASSES)
 
+
+def get_statistics(split_name, dataset_dir, file_pattern=None, ignore_difficult=False):
+    """Gets the (Images, Objects) statistics on every class of a split, see `pascalvoc_common.get_statistics`."""
+    if not file_pattern:
+        file_pattern = FILE_PATTERN
+    return pascalvoc_common.get_statistics(split_name, dataset_dir, file_pattern, SPLITS_TO_STATISTICS,
+                                           ignore_difficult)
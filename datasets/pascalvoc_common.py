@@ -15,8 +15,9 @@
 """Provides data for the Pascal VOC Dataset (images + annotations).
 """
 import os
+import numpy as np
 import tensorflow as tf
-from datasets import dataset_utils
+from datasets import dataset_utils, annotation_index
 import tensorflow.contrib.slim as slim
 
 
@@ -48,6 +49,9 @@ VOC_LABELS = {
 def get_split(split_name, dataset_dir, file_pattern, reader, split_to_sizes, items_to_descriptions, num_classes):
     """Gets a dataset tuple with instructions for reading Pascal VOC dataset.
 
+    The number of samples comes from the annotation index of the split if the
+    converter wrote one, otherwise from `split_to_sizes`.
+
     Args:
       split_name: A train/test split name.
       dataset_dir: The base directory of the dataset sources.
@@ -62,7 +66,12 @@ def get_split(split_name, dataset_dir, file_pattern, reader, split_to_sizes, ite
     Raises:
         ValueError: if `split_name` is not a valid train/test split.
     """
-    if split_name not in split_to_sizes:
+    index_filename = annotation_index.get_index_filename(dataset_dir, file_pattern, split_name)
+    if tf.gfile.Exists(index_filename):
+        num_samples = annotation_index.AnnotationIndex(index_filename).num_images
+    elif split_name in split_to_sizes:
+        num_samples = split_to_sizes[split_name]
+    else:
         raise ValueError('split name %s was not recognized.' % split_name)
     file_pattern = os.path.join(dataset_dir, file_pattern % split_name)
 
@@ -101,5 +110,83 @@ def get_split(split_name, dataset_dir, file_pattern, reader, split_to_sizes, ite
         labels_to_names = dataset_utils.read_label_file(dataset_dir)
 
     return slim.dataset.Dataset(data_sources=file_pattern, reader=reader, decoder=decoder,
-                                num_samples=split_to_sizes[split_name], items_to_descriptions=items_to_descriptions,
+                                num_samples=num_samples, items_to_descriptions=items_to_descriptions,
                                 num_classes=num_classes, labels_to_names=labels_to_names)
+
+
+def get_statistics(split_name, dataset_dir, file_pattern, split_to_statistics, ignore_difficult=False):
+    """Gets the (Images, Objects) statistics on every class of a split.
+
+    They are computed from the annotation index of the split if the converter
+    wrote one, otherwise the hard-coded `split_to_statistics` are returned.
+
+    Returns:
+      A dict of class name -> (number of images, number of objects), with a 'total' entry.
+
+    Raises:
+        ValueError: if there is neither an index nor hard-coded statistics for the split.
+    """
+    index_filename = annotation_index.get_index_filename(dataset_dir, file_pattern, split_name)
+    if tf.gfile.Exists(index_filename):
+        labels_to_names = {label: name for name, (label, _) in VOC_LABELS.items()}
+        return annotation_index.AnnotationIndex(index_filename).statistics(labels_to_names, ignore_difficult)
+    if split_name not in split_to_statistics:
+        raise ValueError('split name %s has no annotation index nor statistics.' % split_name)
+    return split_to_statistics[split_name]
+
+
+def get_shard(dataset, num_shards, shard_index):
+    """Restricts a Pascal VOC `Dataset` to a disjoint subset of its TFRecord files.
+
+    The files matching `dataset.data_sources` are sorted and dealt round-robin,
+    so that every shard index always gets the same files and all the shards
+    together cover the split exactly once.
+
+    Args:
+      dataset: A `Dataset` returned by `get_split`.
+      num_shards: Total number of shards.
+      shard_index: Index of the shard to keep, in [0, num_shards).
+
+    Returns:
+      A `Dataset` namedtuple reading only the files of the shard. Its
+      `num_samples` is the exact number of records of these files.
+
+    Raises:
+        ValueError: if `shard_index` is out of range or the shard is empty.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError('shard index %d is not in [0, %d).' % (shard_index, num_shards))
+    filenames = sorted(tf.gfile.Glob(dataset.data_sources))[shard_index::num_shards]
+    if not filenames:
+        raise ValueError('shard %d of %d has no file matching %s.' % (shard_index, num_shards, dataset.data_sources))
+
+    return slim.dataset.Dataset(data_sources=filenames, reader=dataset.reader, decoder=dataset.decoder,
+                                num_samples=dataset_utils.count_tfrecords(filenames),
+                                items_to_descriptions=dataset.items_to_descriptions,
+                                num_classes=dataset.num_classes, labels_to_names=dataset.labels_to_names)
+
+
+def read_labels(filenames, ignore_difficult=True):
+    """Reads the object labels of every record of Pascal VOC TFRecord files.
+
+    Only the Example protos are parsed, images are not decoded.
+
+    Args:
+      filenames: A list of TFRecord filenames, read in the given order.
+      ignore_difficult: Whether to drop the objects flagged as difficult,
+        which are not counted by the VOC metrics.
+
+    Returns:
+      A list with a 1D int64 numpy array of labels per record.
+    """
+    labels = []
+    for filename in filenames:
+        for record in tf.python_io.tf_record_iterator(filename):
+            feature = tf.train.Example.FromString(record).features.feature
+            label = np.array(feature['image/object/bbox/label'].int64_list.value, dtype=np.int64)
+            if ignore_difficult:
+                difficult = np.array(feature['image/object/bbox/difficult'].int64_list.value, dtype=np.int64)
+                if difficult.size == label.size:
+                    label = label[difficult == 0]
+            labels.append(label)
+    return labels
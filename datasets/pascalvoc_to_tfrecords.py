@@ -47,15 +47,26 @@ Note that the length of xmin is identical to the length of xmax, ymin and ymax
 for each example.
 """
 import os
+import re
 import sys
+import json
+import time
 import random
+import hashlib
+import multiprocessing
 
+import numpy as np
 import tensorflow as tf
 
-import xml.etree.ElementTree as ET
+try:
+    # lxml更快，iterparse接口相同
+    from lxml.etree import iterparse as _iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse as _iterparse
 
 from datasets.dataset_utils import int64_feature, float_feature, bytes_feature
 from datasets.pascalvoc_common import VOC_LABELS
+from datasets import annotation_index, tfrecord_index
 
 # Original dataset organisation.
 DIRECTORY_ANNOTATIONS = 'Annotations/'
@@ -66,12 +77,110 @@ RANDOM_SEED = 4242
 SAMPLES_PER_FILES = 200
 
 
-def _process_image(directory, name):
+def _resize_image(image_data, max_side, jpeg_quality=95):
+    """Downscales a JPEG so that its longest side is at most max_side, and re-encodes it.
+
+    Images already small enough are kept as they are, without re-encoding.
+
+    Args:
+      image_data: string, JPEG encoding of the image;
+      max_side: Maximum size in pixels of the longest side;
+      jpeg_quality: Quality of the re-encoded JPEG, in [0, 100].
+    Returns:
+      The JPEG encoding and the shape [height, width, depth] of the stored image,
+      or None for the shape if the image is kept as it is.
+    """
+    # 只有需要缩小时才依赖OpenCV
+    import cv2
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    height, width = image.shape[:2]
+    scale = float(max_side) / max(height, width)
+    if scale >= 1.:
+        return image_data, None
+    size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    _, encoded = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)])
+    return encoded.tobytes(), [size[1], size[0], 3]
+
+
+def _parse_annotation(filename):
+    """Parses a Pascal VOC XML annotation file in one streaming pass.
+
+    Only the fields converted to the TFRecords are kept: the first `size`, and for every
+    `object` child of the root its first `name`, `difficult`, `truncated` and the
+    coordinates of its first `bndbox`. The nested elements of the objects (e.g. the
+    `part` boxes of the person layout annotations) are skipped, like with `find`.
+
+    Returns:
+      shape, bboxes, labels, labels_text, difficult, truncated of the image.
+    """
+    size = {}
+    sizes = 0
+    objects = []
+    obj = None
+    path = []
+    for event, elem in _iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem.tag)
+            if len(path) == 2 and elem.tag == 'size':
+                sizes += 1
+            elif len(path) == 2 and elem.tag == 'object':
+                obj = {'bndboxes': 0}
+            elif len(path) == 3 and path[1] == 'object' and elem.tag == 'bndbox':
+                obj['bndboxes'] += 1
+            continue
+        node = tuple(path[1:])
+        path.pop()
+        if len(node) == 2 and node[0] == 'size' and sizes == 1:
+            size.setdefault(node[1], elem.text)
+        elif node == ('object',):
+            objects.append(obj)
+            elem.clear()
+        elif len(node) == 2 and node[0] == 'object' and node[1] in ('difficult', 'truncated'):
+            # 与原来的`if obj.find('difficult'):`一致：没有子元素的Element为False，即为0
+            obj.setdefault(node[1], elem.text if len(elem) else None)
+        elif len(node) == 2 and node[0] == 'object':
+            obj.setdefault(node[1], elem.text)
+        elif len(node) == 3 and node[:2] == ('object', 'bndbox') and obj['bndboxes'] == 1:
+            obj.setdefault('bndbox/' + node[2], elem.text)
+
+    # Image shape, read once.
+    shape = [int(size['height']), int(size['width']), int(size['depth'])]
+    height, width = shape[0], shape[1]
+    # Annotations.
+    bboxes = []
+    labels = []
+    labels_text = []
+    difficult = []
+    truncated = []
+    for obj in objects:
+        label = obj['name']
+        labels.append(int(VOC_LABELS[label][0]))
+        labels_text.append(label.encode('ascii'))
+        difficult.append(int(obj['difficult']) if obj.get('difficult') is not None else 0)
+        truncated.append(int(obj['truncated']) if obj.get('truncated') is not None else 0)
+        bboxes.append((float(obj['bndbox/ymin']) / height, float(obj['bndbox/xmin']) / width,
+                       float(obj['bndbox/ymax']) / height, float(obj['bndbox/xmax']) / width))
+    return shape, bboxes, labels, labels_text, difficult, truncated
+
+
+def _parse_annotations(directory, names):
+    """Parses the annotations of a batch of images, before any image is read."""
+    return [_parse_annotation(os.path.join(directory, DIRECTORY_ANNOTATIONS, name + '.xml')) for name in names]
+
+
+def _process_image(directory, name, max_side=None, jpeg_quality=95, annotation=None):
     """Process a image and annotation file.
 
+    Bounding boxes are relative to the image size, so they are the same
+    whether the image is downscaled with max_side or not.
+
     Args:
       filename: string, path to an image file e.g., '/path/to/example.JPG'.
       coder: instance of ImageCoder to provide TensorFlow image coding utils.
+      max_side: If not None, downscale the image so that its longest side is at most max_side.
+      jpeg_quality: JPEG quality of the downscaled images.
+      annotation: The result of `_parse_annotation` if already parsed.
     Returns:
       image_buffer: string, JPEG encoding of RGB image.
       height: integer, image height in pixels.
@@ -82,36 +191,14 @@ def _process_image(directory, name):
     image_data = tf.gfile.FastGFile(filename, 'rb').read()
 
     # Read the XML annotation file.
-    filename = os.path.join(directory, DIRECTORY_ANNOTATIONS, name + '.xml')
-    tree = ET.parse(filename)
-    root = tree.getroot()
-
-    # Image shape.
-    size = root.find('size')
-    shape = [int(size.find('height').text), int(size.find('width').text), int(size.find('depth').text)]
-    # Find annotations.
-    bboxes = []
-    labels = []
-    labels_text = []
-    difficult = []
-    truncated = []
-    for obj in root.findall('object'):
-        label = obj.find('name').text
-        labels.append(int(VOC_LABELS[label][0]))
-        labels_text.append(label.encode('ascii'))
-
-        if obj.find('difficult'):
-            difficult.append(int(obj.find('difficult').text))
-        else:
-            difficult.append(0)
-        if obj.find('truncated'):
-            truncated.append(int(obj.find('truncated').text))
-        else:
-            truncated.append(0)
-
-        bbox = obj.find('bndbox')
-        bboxes.append((float(bbox.find('ymin').text) / shape[0], float(bbox.find('xmin').text) / shape[1],
-                       float(bbox.find('ymax').text) / shape[0], float(bbox.find('xmax').text) / shape[1]  ))
+    if annotation is None:
+        annotation = _parse_annotation(os.path.join(directory, DIRECTORY_ANNOTATIONS, name + '.xml'))
+    shape, bboxes, labels, labels_text, difficult, truncated = annotation
+
+    # Downscale after the boxes are normalized by the original size.
+    if max_side:
+        image_data, resized_shape = _resize_image(image_data, max_side, jpeg_quality)
+        shape = resized_shape or shape
     return image_data, shape, bboxes, labels, labels_text, difficult, truncated
 
 
@@ -158,62 +245,251 @@ def _convert_to_example(image_data, labels, labels_text, bboxes, shape, difficul
     return example
 
 
-def _add_to_tfrecord(dataset_dir, name, tfrecord_writer):
+def _add_to_tfrecord(dataset_dir, name, tfrecord_writer, max_side=None, jpeg_quality=95, annotation=None):
     """Loads data from image and annotations files and add them to a TFRecord.
 
     Args:
       dataset_dir: Dataset directory;
       name: Image name to add to the TFRecord;
-      tfrecord_writer: The TFRecord writer to use for writing.
+      tfrecord_writer: The TFRecord writer to use for writing;
+      max_side, jpeg_quality, annotation: See `_process_image`.
+    Returns:
+      The annotations (shape, bboxes, labels, difficult, truncated) of the image.
     """
-    image_data, shape, bboxes, labels, labels_text, difficult, truncated = _process_image(dataset_dir, name)
+    image_data, shape, bboxes, labels, labels_text, difficult, truncated = _process_image(dataset_dir, name,
+                                                                                          max_side, jpeg_quality,
+                                                                                          annotation)
     example = _convert_to_example(image_data, labels, labels_text, bboxes, shape, difficult, truncated)
     tfrecord_writer.write(example.SerializeToString())
-    pass
+    return shape, bboxes, labels, difficult, truncated
 
 
 def _get_output_filename(output_dir, name, idx):
     return '%s/%s_%03d.tfrecord' % (output_dir, name, idx)
 
 
-def run(dataset_dir, output_dir, name='voc_train', shuffling=False):
+def _get_manifest_filename(output_dir, name):
+    return '%s/%s_manifest.json' % (output_dir, name)
+
+
+def _get_index_filename(output_dir, name):
+    return '%s/%s_index.npz' % (output_dir, name)
+
+
+def _load_annotations(output_dir, name, manifest):
+    """Annotations of the images kept from the previous conversion.
+
+    They come from the previous annotation index, or from the kept TFRecord files
+    (without decoding the images) if there is none.
+    """
+    annotations = {}
+    if not manifest:
+        return annotations
+    index_filename = _get_index_filename(output_dir, name)
+    if tf.gfile.Exists(index_filename):
+        index = annotation_index.AnnotationIndex(index_filename)
+        for image_id, img_name in enumerate(index.image_names.tolist()):
+            if img_name in manifest:
+                annotations[img_name] = index.image_annotations(image_id)
+    if len(annotations) < len(manifest):
+        files = {}
+        for img_name, entry in manifest.items():
+            files.setdefault(entry['file'], {})[entry['offset']] = img_name
+        for fidx, offsets in files.items():
+            records = annotation_index.read_tfrecord_annotations(_get_output_filename(output_dir, name, fidx))
+            for offset, img_name in offsets.items():
+                annotations[img_name] = records[offset]
+    return annotations
+
+
+def _hash_image(dataset_dir, name):
+    """Content hash of the image and annotation files of an example.
+
+    Returns:
+      The image name and the sha1 hex digest.
+    """
+    sha1 = hashlib.sha1()
+    for filename in [os.path.join(dataset_dir, DIRECTORY_ANNOTATIONS, name + '.xml'),
+                     dataset_dir + DIRECTORY_IMAGES + name + '.jpg']:
+        sha1.update(tf.gfile.FastGFile(filename, 'rb').read())
+    return name, sha1.hexdigest()
+
+
+def _hash_image_star(args):
+    return _hash_image(*args)
+
+
+def _load_manifest(output_dir, name, options):
+    """Loads the conversion manifest: image name -> {'hash', 'file', 'offset'}.
+
+    A manifest written with other conversion options is ignored.
+    """
+    filename = _get_manifest_filename(output_dir, name)
+    if not tf.gfile.Exists(filename):
+        return {}
+    with tf.gfile.GFile(filename, 'r') as f:
+        manifest = json.load(f)
+    previous = manifest.get('options', {'max_side': None, 'jpeg_quality': None})
+    return manifest['images'] if previous == options else {}
+
+
+def _save_manifest(output_dir, name, images, options):
+    """Saves the manifest atomically, so that a killed conversion keeps the finished files."""
+    filename = _get_manifest_filename(output_dir, name)
+    with tf.gfile.GFile(filename + '.tmp', 'w') as f:
+        json.dump({'name': name, 'samples_per_files': SAMPLES_PER_FILES, 'options': options, 'images': images},
+                  f, sort_keys=True)
+    tf.gfile.Rename(filename + '.tmp', filename, overwrite=True)
+    pass
+
+
+def _convert_shard(dataset_dir, output_dir, name, fidx, img_names, max_side=None, jpeg_quality=95):
+    """Converts one shard of images into its own TFRecord file.
+
+    Args:
+      fidx: Index of the TFRecord file;
+      img_names: Image names of the shard, in order;
+      max_side, jpeg_quality: See `_process_image`.
+    Returns:
+      The file index, the TFRecord filename, the image names written and their annotations.
+    """
+    tf_filename = _get_output_filename(output_dir, name, fidx)
+    # 先批量解析整个分片的XML，再顺序读图像写记录
+    parsed = _parse_annotations(dataset_dir, img_names)
+    with tf.python_io.TFRecordWriter(tf_filename) as tfrecord_writer:
+        annotations = [_add_to_tfrecord(dataset_dir, img_name, tfrecord_writer, max_side, jpeg_quality, annotation)
+                       for img_name, annotation in zip(img_names, parsed)]
+    # Byte offsets of the records, for random access.
+    tfrecord_index.write_offsets(tf_filename)
+    return fidx, tf_filename, img_names, annotations
+
+
+def _convert_shard_star(args):
+    return _convert_shard(*args)
+
+
+def _get_shards(img_names, shuffling=False, first_fidx=0):
+    """Splits the image names into shards of SAMPLES_PER_FILES images.
+
+    The split only depends on the sorted names and RANDOM_SEED, so the output
+    files are the same whatever the number of workers.
+
+    Returns:
+      A list of (file index, image names).
+    """
+    img_names = sorted(img_names)
+    if shuffling:
+        random.seed(RANDOM_SEED)
+        random.shuffle(img_names)
+    return [(first_fidx + i // SAMPLES_PER_FILES, img_names[i:i + SAMPLES_PER_FILES])
+            for i in range(0, len(img_names), SAMPLES_PER_FILES)]
+
+
+def _plan_incremental(output_dir, name, hashes, manifest):
+    """Keeps the TFRecord files whose images are all unchanged and converts the rest.
+
+    A file is kept if it is complete in the manifest and every one of its images still
+    exists with the same hash. The images of the other files (changed, deleted or
+    never finished) are converted again into new files, and the stale files are removed.
+
+    Returns:
+      The kept manifest entries and the image names to convert.
+    """
+    files = {}
+    for img_name, entry in manifest.items():
+        files.setdefault(entry['file'], []).append(img_name)
+    kept = {}
+    for fidx, img_names in files.items():
+        if tf.gfile.Exists(_get_output_filename(output_dir, name, fidx)) and \
+                all(hashes.get(img_name) == manifest[img_name]['hash'] for img_name in img_names):
+            kept.update({img_name: manifest[img_name] for img_name in img_names})
+
+    # Remove the files which are not kept: stale or partially written by a killed conversion.
+    kept_files = set(_get_output_filename(output_dir, name, entry['file']) for entry in kept.values())
+    pattern = re.compile(re.escape(name) + r'_\d{3,}\.tfrecord$')
+    for filename in tf.gfile.ListDirectory(output_dir):
+        tf_filename = '%s/%s' % (output_dir, filename)
+        if pattern.match(filename) and tf_filename not in kept_files:
+            tf.gfile.Remove(tf_filename)
+            if tf.gfile.Exists(tfrecord_index.get_offsets_filename(tf_filename)):
+                tf.gfile.Remove(tfrecord_index.get_offsets_filename(tf_filename))
+    return kept, [img_name for img_name in hashes if img_name not in kept]
+
+
+def run(dataset_dir, output_dir, name='voc_train', shuffling=False, num_workers=None, incremental=True,
+        max_side=None, jpeg_quality=95):
     """Runs the conversion operation.
 
+    A manifest in output_dir maps the content hash of every converted image to its
+    TFRecord file and offset. With incremental, a rerun only converts the new or changed
+    images into new files, and a killed conversion resumes after the finished files.
+
     Args:
       dataset_dir: The dataset directory where the dataset is stored.
       output_dir: Output directory.
+      num_workers: Number of processes, each one writing whole TFRecord files.
+        None means the number of CPUs, 1 converts in the current process.
+      incremental: Reuse the files of the manifest, otherwise convert everything again.
+      max_side: If not None, store the images downscaled so that their longest side is
+        at most max_side, e.g. 600 for SSD300 training. Labels and relative boxes are unchanged.
+      jpeg_quality: JPEG quality of the downscaled images.
     """
     if not tf.gfile.Exists(output_dir):
         tf.gfile.MakeDirs(output_dir)
 
-    # Dataset filenames, and shuffling.
+    # Dataset filenames.
     path = os.path.join(dataset_dir, DIRECTORY_ANNOTATIONS)
-    filenames = sorted(os.listdir(path))
-    if shuffling:
-        random.seed(RANDOM_SEED)
-        random.shuffle(filenames)
-
-    # Process dataset files.
-    i = 0
-    fidx = 0
-    while i < len(filenames):
-        # Open new TFRecord file.
-        tf_filename = _get_output_filename(output_dir, name, fidx)
-        with tf.python_io.TFRecordWriter(tf_filename) as tfrecord_writer:
-            j = 0
-            while i < len(filenames) and j < SAMPLES_PER_FILES:
-                sys.stdout.write('\r>> Converting image %d/%d\n' % (i+1, len(filenames)))
-                sys.stdout.flush()
-
-                filename = filenames[i]
-                img_name = filename[:-4]
-                _add_to_tfrecord(dataset_dir, img_name, tfrecord_writer)
-                i += 1
-                j += 1
-            fidx += 1
+    img_names = [filename[:-4] for filename in sorted(os.listdir(path))]
+    num_workers = num_workers or multiprocessing.cpu_count()
+    start_time = time.time()
+    options = {'max_side': max_side, 'jpeg_quality': jpeg_quality if max_side else None}
+
+    # spawn：每个子进程有自己干净的TensorFlow运行时
+    pool = multiprocessing.get_context("spawn").Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        # Content hashes, and the files of the previous conversion still valid.
+        hash_args = [(dataset_dir, img_name) for img_name in img_names]
+        hashes = dict(pool.imap(_hash_image_star, hash_args, chunksize=64) if pool
+                      else map(_hash_image_star, hash_args))
+        manifest = _load_manifest(output_dir, name, options) if incremental else {}
+        manifest, pending = _plan_incremental(output_dir, name, hashes, manifest)
+        _save_manifest(output_dir, name, manifest, options)
+
+        # New files are numbered after the kept ones.
+        first_fidx = max([entry['file'] for entry in manifest.values()] or [-1]) + 1
+        shards = _get_shards(pending, shuffling, first_fidx)
+        shard_args = [(dataset_dir, output_dir, name, fidx, shard, max_side, jpeg_quality) for fidx, shard in shards]
+        print('>> %d images unchanged, %d images to convert into %d files' % (
+            len(manifest), len(pending), len(shards)))
+
+        # Process dataset files: one shard per task, the manifest is saved after every finished file.
+        annotations = _load_annotations(output_dir, name, manifest)
+        converted = 0
+        results = pool.imap_unordered(_convert_shard_star, shard_args) if pool else map(_convert_shard_star, shard_args)
+        for fidx, tf_filename, shard, shard_annotations in results:
+            for offset, img_name in enumerate(shard):
+                manifest[img_name] = {'hash': hashes[img_name], 'file': fidx, 'offset': offset}
+                annotations[img_name] = shard_annotations[offset]
+            _save_manifest(output_dir, name, manifest, options)
+            converted += len(shard)
+            sys.stdout.write('\r>> Converted %d/%d images (%.1f images/s), last file %s' % (
+                converted, len(pending), converted / max(time.time() - start_time, 1e-6), tf_filename))
+            sys.stdout.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    # Columnar annotation index of the split, for statistics and filtering without reading the images.
+    annotation_index.write_annotation_index(
+        _get_index_filename(output_dir, name),
+        [(img_name, _get_output_filename(output_dir, name, entry['file']), entry['offset'], annotations[img_name])
+         for img_name, entry in manifest.items()])
 
     # Finally, write the labels file:
     # labels_to_class_names = dict(zip(range(len(_CLASS_NAMES)), _CLASS_NAMES))
     # dataset_utils.write_label_file(labels_to_class_names, dataset_dir)
-    print('\nFinished converting the Pascal VOC dataset!')
+    print('\nFinished converting the Pascal VOC dataset: %d images converted, %d images in %d files with %d workers, '
+          '%.1fs' % (converted, len(manifest), len(set(entry['file'] for entry in manifest.values())),
+                     num_workers, time.time() - start_time))
     pass
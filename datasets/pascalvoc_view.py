@@ -0,0 +1,196 @@
+"""Class-filtered and rebalanced views of a Pascal VOC split, without reconversion.
+
+A view is a `Dataset` like the one of `pascalvoc_common.get_split`, whose reader
+only yields some records of the existing TFRecord files. The records are chosen
+with the annotation index of the split (see `annotation_index`):
+
+    * `labels`: only the images with at least one object of these labels;
+    * `class_weights`: every epoch, `num_samples` images drawn with replacement,
+      the probability of an image being the largest weight of its labels, so that
+      rare classes such as sheep or cow are oversampled.
+
+Records are read file by file with one seek each (see `tfrecord_index`), the
+others are not read at all. The records of the quarantine list of the split
+(see `dataset_check`) are always left out.
+"""
+import os
+import functools
+import threading
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from datasets import annotation_index, tfrecord_index, dataset_check
+
+
+def get_dataset_index_filename(dataset):
+    """Filename of the annotation index of a `Dataset` returned by `get_split`."""
+    data_sources = dataset.data_sources
+    return os.path.join(os.path.dirname(data_sources),
+                        os.path.basename(data_sources).replace('_*.tfrecord', '') + '_index.npz')
+
+
+class RecordView(object):
+    """Selected records of the TFRecord files of a split, one epoch after the other."""
+
+    def __init__(self, dataset_dir, index, image_ids, image_weights=None, num_samples=None, shuffle=True,
+                 num_epochs=None, drop_other_labels=None, seed=None):
+        """
+        Args:
+          dataset_dir: The directory of the TFRecord files.
+          index: The `AnnotationIndex` of the split.
+          image_ids: Ids of the images of the view.
+          image_weights: If not None, sampling weight of every image of `image_ids`.
+          num_samples: Number of images drawn per epoch when sampling, default the number of images.
+          shuffle: Whether to shuffle the order of the files every epoch.
+          num_epochs: None for an infinite view, otherwise the number of epochs.
+          drop_other_labels: If not None, remove from the records the objects whose label is not in it.
+        """
+        self.dataset_dir = dataset_dir
+        self.index = index
+        self.image_ids = np.asarray(image_ids, dtype=np.int64)
+        self.image_probs = None
+        if image_weights is not None:
+            self.image_probs = np.asarray(image_weights, dtype=np.float64) / np.sum(image_weights)
+        self.num_samples = num_samples or len(self.image_ids)
+        self.shuffle = shuffle
+        self.num_epochs = num_epochs
+        self.drop_other_labels = None if drop_other_labels is None else set(drop_other_labels)
+        self.rng = np.random.RandomState(seed)
+        self.reader = tfrecord_index.RandomAccessTFRecords(
+            [os.path.join(dataset_dir, str(filename)) for filename in index.files])
+
+        self._lock = threading.Lock()
+        self._records = self._generate()
+        pass
+
+    def _epoch(self):
+        """Files and record offsets of one epoch, an offset appearing once per time it is drawn."""
+        if self.image_probs is None:
+            image_ids = self.image_ids
+        else:
+            image_ids = self.rng.choice(self.image_ids, size=self.num_samples, replace=True, p=self.image_probs)
+        files, offsets = self.index.record_locations(np.sort(image_ids))
+        epoch = {}
+        for filename, offset in zip(files.tolist(), offsets.tolist()):
+            epoch.setdefault(filename, []).append(offset)
+        filenames = sorted(epoch.keys())
+        if self.shuffle:
+            self.rng.shuffle(filenames)
+        return [(filename, epoch[filename]) for filename in filenames]
+
+    def _read_file(self, filename, offsets):
+        """Reads the records at `offsets` (sorted, maybe repeated) of one file."""
+        file_index = self.reader.basenames.index(filename)
+        for offset in offsets:
+            yield '%s:%d' % (filename, offset), self.reader.read_record(file_index, offset)
+        pass
+
+    def _generate(self):
+        epoch = 0
+        while self.num_epochs is None or epoch < self.num_epochs:
+            for filename, offsets in self._epoch():
+                for key, record in self._read_file(filename, offsets):
+                    yield key, record
+            epoch += 1
+        pass
+
+    def _drop_objects(self, record):
+        """Removes the objects whose label is not kept, without decoding the image."""
+        example = tf.train.Example.FromString(record)
+        feature = example.features.feature
+        labels = list(feature['image/object/bbox/label'].int64_list.value)
+        keep = [i for i, label in enumerate(labels) if label in self.drop_other_labels]
+        for key in ['label', 'difficult', 'truncated']:
+            values = list(feature['image/object/bbox/' + key].int64_list.value)
+            if len(values) == len(labels):
+                feature['image/object/bbox/' + key].int64_list.value[:] = [values[i] for i in keep]
+        for key in ['xmin', 'ymin', 'xmax', 'ymax']:
+            values = list(feature['image/object/bbox/' + key].float_list.value)
+            feature['image/object/bbox/' + key].float_list.value[:] = [values[i] for i in keep]
+        values = list(feature['image/object/bbox/label_text'].bytes_list.value)
+        if len(values) == len(labels):
+            feature['image/object/bbox/label_text'].bytes_list.value[:] = [values[i] for i in keep]
+        return example.SerializeToString()
+
+    def next_record(self):
+        """Next (key, serialized Example). Raises StopIteration, i.e. OutOfRange in a py_func, at the end."""
+        with self._lock:
+            key, record = next(self._records)
+        if self.drop_other_labels is not None:
+            record = self._drop_objects(record)
+        return key.encode('utf-8'), record
+
+    pass
+
+
+class RecordViewReader(object):
+    """Reader of a `RecordView`, with the interface of `tf.TFRecordReader` used by `DatasetDataProvider`.
+
+    The filename queue is ignored: the view decides which records of which files are read.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        pass
+
+    def read(self, queue, name=None):
+        key, value = tf.py_func(self.view.next_record, [], [tf.string, tf.string], stateful=True, name=name)
+        key.set_shape([])
+        value.set_shape([])
+        return key, value
+
+    pass
+
+
+def get_view(dataset, labels=None, class_weights=None, num_samples=None, ignore_difficult=False,
+             drop_other_labels=False, shuffle=True, num_epochs=None, seed=None):
+    """Gets a view of a Pascal VOC `Dataset`, reading only some of its records.
+
+    Args:
+      dataset: A `Dataset` returned by `get_split`, whose converter wrote the annotation index.
+      labels: If not None, keep only the images with at least one object of these labels.
+      class_weights: If not None, a dict of label -> weight. Every epoch, `num_samples`
+        images are drawn with replacement, an image weighing the largest weight of
+        its labels (1 for the labels missing from the dict and for images without objects).
+      num_samples: Images per epoch when sampling, default the number of images of the view.
+      ignore_difficult: Do not count the difficult objects when selecting and weighting.
+      drop_other_labels: With `labels`, also remove the objects of the other labels from the records.
+      shuffle: Shuffle the order of the files every epoch; the provider shuffles the records.
+      num_epochs: None for an infinite view, otherwise `OutOfRangeError` after these epochs.
+
+    Returns:
+      A `Dataset` namedtuple, to be used with `DatasetDataProvider` as usual.
+
+    Raises:
+        ValueError: if the split has no annotation index or the view is empty.
+    """
+    index_filename = get_dataset_index_filename(dataset)
+    if not tf.gfile.Exists(index_filename):
+        raise ValueError('%s has no annotation index, convert it again or build one with '
+                         'annotation_index.build_annotation_index.' % dataset.data_sources)
+    index = annotation_index.AnnotationIndex(index_filename)
+
+    image_ids = index.select(labels, ignore_difficult) if labels is not None else np.arange(index.num_images)
+    quarantine_filename = dataset_check.get_dataset_quarantine_filename(dataset)
+    if tf.gfile.Exists(quarantine_filename):
+        quarantine = dataset_check.read_quarantine(quarantine_filename)
+        image_ids = np.setdiff1d(image_ids, dataset_check.quarantined_image_ids(index, quarantine))
+    if len(image_ids) == 0:
+        raise ValueError('no image of %s has an object of labels %s.' % (dataset.data_sources, labels))
+
+    image_weights = None
+    if class_weights is not None:
+        mask = index.difficult == 0 if ignore_difficult else np.ones(index.num_objects, dtype=bool)
+        object_weights = np.array([class_weights.get(label, 1.) for label in index.label.tolist()])
+        image_weights = np.full(index.num_images, -np.inf)
+        np.maximum.at(image_weights, index.image_id[mask], object_weights[mask])
+        image_weights[np.isinf(image_weights)] = 1.
+        image_weights = image_weights[image_ids]
+
+    view = RecordView(os.path.dirname(dataset.data_sources), index, image_ids, image_weights, num_samples, shuffle,
+                      num_epochs, labels if labels is not None and drop_other_labels else None, seed)
+    return slim.dataset.Dataset(data_sources=dataset.data_sources, reader=functools.partial(RecordViewReader, view),
+                                decoder=dataset.decoder, num_samples=view.num_samples,
+                                items_to_descriptions=dataset.items_to_descriptions,
+                                num_classes=dataset.num_classes, labels_to_names=dataset.labels_to_names)
@@ -0,0 +1,119 @@
+"""Record offset index and random-access reader of TFRecord files.
+
+A TFRecord file is a sequence of records framed as:
+
+    uint64 length, uint32 masked crc32c of length, byte data[length], uint32 masked crc32c of data
+
+so the byte offset of every record is found by reading the 12 bytes of every header
+and seeking over the data. The offsets of `<file>.tfrecord` are stored in
+`<file>.tfrecord.idx` as little-endian int64 (one per record, plus the file size),
+and a record is then read with one seek and one read.
+"""
+import os
+import struct
+import threading
+import numpy as np
+import tensorflow as tf
+
+RECORD_HEADER_BYTES = 12
+RECORD_FOOTER_BYTES = 4
+
+
+def get_offsets_filename(tfrecord_filename):
+    return tfrecord_filename + '.idx'
+
+
+def scan_offsets(tfrecord_filename):
+    """Byte offsets of the records of a TFRecord file, reading only the record headers.
+
+    Returns:
+      An int64 array of the offset of every record, followed by the size of the file.
+    """
+    offsets = [0]
+    with tf.gfile.GFile(tfrecord_filename, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER_BYTES)
+            if len(header) < RECORD_HEADER_BYTES:
+                break
+            length = struct.unpack('<Q', header[:8])[0]
+            offsets.append(offsets[-1] + RECORD_HEADER_BYTES + length + RECORD_FOOTER_BYTES)
+            f.seek(offsets[-1])
+    return np.array(offsets, dtype=np.int64)
+
+
+def write_offsets(tfrecord_filename):
+    """Writes the offset index of a TFRecord file.
+
+    Returns:
+      The number of records.
+    """
+    offsets = scan_offsets(tfrecord_filename)
+    with tf.gfile.GFile(get_offsets_filename(tfrecord_filename), 'wb') as f:
+        f.write(offsets.astype('<i8').tobytes())
+    return len(offsets) - 1
+
+
+def read_offsets(tfrecord_filename):
+    """Reads the offset index of a TFRecord file, scanning the file if there is no index."""
+    offsets_filename = get_offsets_filename(tfrecord_filename)
+    if not tf.gfile.Exists(offsets_filename):
+        return scan_offsets(tfrecord_filename)
+    with tf.gfile.GFile(offsets_filename, 'rb') as f:
+        return np.frombuffer(f.read(), dtype='<i8').astype(np.int64)
+
+
+class RandomAccessTFRecords(object):
+    """Reads any record of a list of TFRecord files with one seek and one read.
+
+    Records are numbered continuously over `filenames`, in the given order.
+    """
+
+    def __init__(self, filenames):
+        self.filenames = list(filenames)
+        self.basenames = [os.path.basename(filename) for filename in self.filenames]
+        self.offsets = [read_offsets(filename) for filename in self.filenames]
+        self.first_records = np.cumsum([0] + [len(offsets) - 1 for offsets in self.offsets])
+        self._files = {}
+        self._lock = threading.Lock()
+        pass
+
+    def __len__(self):
+        return int(self.first_records[-1])
+
+    def locate(self, index):
+        """File number and record number in the file of the global record `index`."""
+        if not 0 <= index < len(self):
+            raise IndexError('record %d is not in [0, %d).' % (index, len(self)))
+        file_index = int(np.searchsorted(self.first_records, index, side='right') - 1)
+        return file_index, int(index - self.first_records[file_index])
+
+    def read_record(self, file_index, offset):
+        """Serialized record number `offset` of the file number `file_index`."""
+        start, end = self.offsets[file_index][offset], self.offsets[file_index][offset + 1]
+        with self._lock:
+            if file_index not in self._files:
+                self._files[file_index] = tf.gfile.GFile(self.filenames[file_index], 'rb')
+            f = self._files[file_index]
+            f.seek(int(start) + RECORD_HEADER_BYTES)
+            return f.read(int(end - start) - RECORD_HEADER_BYTES - RECORD_FOOTER_BYTES)
+
+    def __getitem__(self, index):
+        return self.read_record(*self.locate(index))
+
+    def read_image(self, annotations, image_id):
+        """Serialized record of the image `image_id` of the `AnnotationIndex` of these files."""
+        files, offsets = annotations.record_locations([image_id])
+        return self.read_record(self.basenames.index(str(files[0])), int(offsets[0]))
+
+    def get_example(self, index):
+        """Parsed `tf.train.Example` of the global record `index`."""
+        return tf.train.Example.FromString(self[index])
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+        pass
+
+    pass
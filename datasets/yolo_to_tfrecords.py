@@ -0,0 +1,90 @@
+"""Converts YOLO txt annotations to TFRecords.
+
+The dataset is expected as:
+
+    <dataset_dir>/images/<name>.jpg
+    <dataset_dir>/labels/<name>.txt    one 'class x_center y_center width height' line per object,
+                                       relative to the image size
+    <names_file>                       one class name per line, the class index being the line number
+
+Images without a label file have no object. The examples are written by
+`detection_to_tfrecords.run_sharded`, with the same schema as the Pascal VOC
+TFRecords; the image shapes are read from the JPEG headers by the workers.
+"""
+import os
+
+from datasets import detection_to_tfrecords
+
+DIRECTORY_IMAGES = 'images/'
+DIRECTORY_LABELS = 'labels/'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def read_names(names_file):
+    with open(names_file, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _read_labels(label_filename, class_labels, label_names):
+    """Labels, label texts and relative [ymin, xmin, ymax, xmax] boxes of one label file."""
+    labels, labels_text, bboxes = [], [], []
+    if not os.path.exists(label_filename):
+        return labels, labels_text, bboxes
+    with open(label_filename, 'r') as f:
+        for line in f:
+            values = line.split()
+            if len(values) < 5:
+                continue
+            label = class_labels.get(int(values[0]))
+            if label is None:
+                continue
+            x, y, w, h = [float(v) for v in values[1:5]]
+            labels.append(label)
+            labels_text.append(label_names[label].encode('utf-8'))
+            bboxes.append((max(y - h / 2., 0.), max(x - w / 2., 0.), min(y + h / 2., 1.), min(x + w / 2., 1.)))
+    return labels, labels_text, bboxes
+
+
+def get_items(dataset_dir, names, label_table=None):
+    """Items of `detection_to_tfrecords.run_sharded`, one per image, sorted by name.
+
+    Args:
+      dataset_dir: The dataset directory, with images/ and labels/.
+      names: Class names, in the order of the class indexes.
+      label_table: {class name: (label, description)}, None numbers the names from 1.
+        The other classes are skipped.
+
+    Returns:
+      The items and the label table.
+    """
+    if label_table is None:
+        label_table = detection_to_tfrecords.make_label_table(names)
+    class_labels = {i: label_table[name][0] for i, name in enumerate(names) if name in label_table}
+    label_names = {label: name for name, (label, _) in label_table.items()}
+
+    items = []
+    image_dir = os.path.join(dataset_dir, DIRECTORY_IMAGES)
+    for filename in sorted(os.listdir(image_dir)):
+        img_name, extension = os.path.splitext(filename)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        labels, labels_text, bboxes = _read_labels(os.path.join(dataset_dir, DIRECTORY_LABELS, img_name + '.txt'),
+                                                   class_labels, label_names)
+        items.append((img_name, os.path.join(image_dir, filename), None, labels, labels_text, bboxes,
+                      [0] * len(labels), [0] * len(labels)))
+    return items, label_table
+
+
+def run(dataset_dir, output_dir, names_file, name='yolo_train', label_table=None, shuffling=False, num_workers=None):
+    """Runs the conversion operation.
+
+    Args:
+      dataset_dir: The dataset directory, with images/ and labels/.
+      output_dir: Output directory, where labels.txt is also written.
+      names_file: Class names file, e.g. obj.names or classes.txt.
+      label_table: See `get_items`.
+    """
+    items, label_table = get_items(dataset_dir, read_names(names_file), label_table)
+    detection_to_tfrecords.run_sharded(items, output_dir, name, shuffling, num_workers)
+    detection_to_tfrecords.write_label_table(label_table, output_dir)
+    pass
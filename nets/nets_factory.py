@@ -7,6 +7,7 @@ import tensorflow.contrib.slim as slim
 from nets import vgg
 from nets import ssd_vgg_300
 from nets import ssd_vgg_512
+from nets import ssd_mobilenet_300
 
 networks_map = {'vgg_a': vgg.vgg_a,
                 'vgg_16': vgg.vgg_16,
@@ -14,7 +15,8 @@ networks_map = {'vgg_a': vgg.vgg_a,
                 'ssd_300_vgg': ssd_vgg_300.ssd_net,
                 'ssd_300_vgg_caffe': ssd_vgg_300.ssd_net,
                 'ssd_512_vgg': ssd_vgg_512.ssd_net,
-                'ssd_512_vgg_caffe': ssd_vgg_512.ssd_net}
+                'ssd_512_vgg_caffe': ssd_vgg_512.ssd_net,
+                'ssd_300_mobilenet': ssd_mobilenet_300.ssd_net}
 
 arg_scopes_map = {'vgg_a': vgg.vgg_arg_scope,
                   'vgg_16': vgg.vgg_arg_scope,
@@ -22,10 +24,12 @@ arg_scopes_map = {'vgg_a': vgg.vgg_arg_scope,
                   'ssd_300_vgg': ssd_vgg_300.ssd_arg_scope,
                   'ssd_300_vgg_caffe': ssd_vgg_300.ssd_arg_scope_caffe,
                   'ssd_512_vgg': ssd_vgg_512.ssd_arg_scope,
-                  'ssd_512_vgg_caffe': ssd_vgg_512.ssd_arg_scope_caffe}
+                  'ssd_512_vgg_caffe': ssd_vgg_512.ssd_arg_scope_caffe,
+                  'ssd_300_mobilenet': ssd_mobilenet_300.ssd_arg_scope}
 
 networks_obj = {'ssd_300_vgg': ssd_vgg_300.SSDNet,
-                'ssd_512_vgg': ssd_vgg_512.SSDNet}
+                'ssd_512_vgg': ssd_vgg_512.SSDNet,
+                'ssd_300_mobilenet': ssd_mobilenet_300.SSDNet}
 
 
 def get_network(name):
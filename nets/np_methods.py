@@ -218,6 +218,14 @@ def bboxes_nms(classes, scores, bboxes, nms_threshold=0.45):
     """
     Apply non-maximum selection to bounding boxes. 这里的score是已经排过序的
     """
+    idxes = np.where(bboxes_nms_keep(classes, scores, bboxes, nms_threshold))
+    return classes[idxes], scores[idxes], bboxes[idxes]
+
+
+def bboxes_nms_keep(classes, scores, bboxes, nms_threshold=0.45):
+    """
+    Non-maximum selection mask of bounding boxes sorted by decreasing score.
+    """
     keep_bboxes = np.ones(scores.shape, dtype=np.bool)
     for i in range(scores.size-1):
         if keep_bboxes[i]:
@@ -230,7 +238,184 @@ def bboxes_nms(classes, scores, bboxes, nms_threshold=0.45):
             # 计算所有的
             keep_bboxes[(i+1):] = np.logical_and(keep_bboxes[(i+1):], keep_overlap)
         pass
+    return keep_bboxes
 
-    idxes = np.where(keep_bboxes)
-    return classes[idxes], scores[idxes], bboxes[idxes]
 
+# =========================================================================== #
+# Numpy implementation of the SSDNet.detected_bboxes evaluation pipeline.
+# =========================================================================== #
+def ssd_anchors_index(anchors_net):
+    """
+    Describe the anchors of the concatenated network output layers.
+
+    Return:
+      layers, shapes: for every anchor, index of its feature layer and of its anchor shape in the layer.
+    """
+    layers = []
+    shapes = []
+    for i, (y, x, h, w) in enumerate(anchors_net):
+        num_anchors = h.size
+        num_positions = y.shape[0] * y.shape[1]
+        layers.append(np.full(num_positions * num_anchors, i, dtype=np.int64))
+        shapes.append(np.tile(np.arange(num_anchors, dtype=np.int64), num_positions))
+    return np.concatenate(layers, 0), np.concatenate(shapes, 0)
+
+
+def ssd_bboxes_select_per_class(predictions_net, localizations_net, select_threshold=0.01, nms_threshold=0.45,
+                                top_k=400, keep_top_k=200, num_classes=21, anchors_mask=None):
+    """
+    Numpy version of SSDNet.detected_bboxes for one image: per class threshold, top_k, NMS and keep_top_k.
+    Localizations must be decoded already.
+
+    Return:
+      classes, scores, bboxes, anchors: Numpy arrays, anchors being the index of the anchor every box comes from.
+    """
+    predictions = np.concatenate([np.reshape(p, (-1, p.shape[-1])) for p in predictions_net], 0)
+    localizations = np.concatenate([np.reshape(l, (-1, l.shape[-1])) for l in localizations_net], 0)
+    if anchors_mask is not None:  # 去掉某些默认框的预测
+        predictions = predictions * np.expand_dims(anchors_mask, axis=-1)
+
+    l_classes = []
+    l_scores = []
+    l_bboxes = []
+    l_anchors = []
+    for c in range(1, num_classes):
+        scores = predictions[:, c]
+        idxes = np.where(np.logical_and(scores >= select_threshold, scores > 0.))[0]
+        idxes = idxes[np.argsort(-scores[idxes], kind='mergesort')][:top_k]
+        bboxes = localizations[idxes]
+        keep = bboxes_nms_keep(np.zeros(idxes.shape, dtype=np.int64), scores[idxes], bboxes, nms_threshold)
+        idxes = idxes[keep][:keep_top_k]
+        l_classes.append(np.full(idxes.shape, c, dtype=np.int64))
+        l_scores.append(scores[idxes])
+        l_bboxes.append(localizations[idxes])
+        l_anchors.append(idxes)
+        pass
+
+    classes = np.concatenate(l_classes, 0)
+    scores = np.concatenate(l_scores, 0)
+    bboxes = np.reshape(np.concatenate(l_bboxes, 0), (-1, 4))
+    anchors = np.concatenate(l_anchors, 0)
+    return classes, scores, bboxes, anchors
+
+
+def bboxes_matching(label, scores, bboxes, glabels, gbboxes, gdifficults, matching_threshold=0.5):
+    """
+    Numpy version of tf_extend.bboxes_matching: match detected boxes of one class, sorted by decreasing
+    score, with the groundtruth boxes of one image.
+
+    Return:
+      n_gbboxes, tp, fp: number of non difficult groundtruth boxes, True and False Positives arrays.
+    """
+    gdifficults = gdifficults.astype(bool)
+    glabel_mask = glabels == label
+    n_gbboxes = np.count_nonzero(np.logical_and(glabel_mask, np.logical_not(gdifficults)))
+    tp = np.zeros(scores.shape, dtype=bool)
+    fp = np.zeros(scores.shape, dtype=bool)
+    if glabels.size == 0:
+        fp[:] = True
+        return n_gbboxes, tp, fp
+
+    gmatch = np.zeros(glabels.shape, dtype=bool)
+    for i in range(scores.size):
+        jaccard = bboxes_jaccard(bboxes[i], gbboxes) * glabel_mask
+        idxmax = np.argmax(jaccard)
+        match = jaccard[idxmax] > matching_threshold
+        if gdifficults[idxmax]:  # If difficult: no record, i.e FP=False and TP=False.
+            continue
+        tp[i] = match and not gmatch[idxmax]
+        fp[i] = not tp[i]
+        gmatch[idxmax] = gmatch[idxmax] or match
+    return n_gbboxes, tp, fp
+
+
+
+# =========================================================================== #
+# Numpy implementations of the Pascal VOC metrics.
+# =========================================================================== #
+# 和tf_extend.metrics中的计算方式保持一致，用于合并多个进程的验证结果
+def precision_recall(num_gbboxes, tp, fp, scores):
+    """
+    Compute precision and recall from scores, true positives and false positives arrays.
+    """
+    idxes = np.argsort(-scores, kind='mergesort')
+    tp = np.cumsum(tp[idxes].astype(np.float64))
+    fp = np.cumsum(fp[idxes].astype(np.float64))
+    recall = tp / num_gbboxes if num_gbboxes > 0 else np.zeros_like(tp)
+    precision = np.where(tp + fp > 0, tp / np.maximum(tp + fp, 1.), 0.)
+    return precision, recall
+
+
+def average_precision_voc07(precision, recall):
+    """
+    Compute (interpolated) average precision following Pascal 2007 guidelines.
+    """
+    precision = np.concatenate([precision, [0.]])
+    recall = np.concatenate([recall, [np.inf]])
+    ap = 0.
+    for t in np.arange(0., 1.1, 0.1):
+        ap += np.max(precision[recall >= t]) / 11.
+    return ap
+
+
+def average_precision_voc12(precision, recall):
+    """
+    Compute (interpolated) average precision following Pascal 2012 and ILSVRC guidelines.
+    """
+    precision = np.concatenate([[0.], precision, [0.]])
+    recall = np.concatenate([[0.], recall, [1.]])
+    # Ensures precision is increasing in reverse order.
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return np.sum(precision[1:] * (recall[1:] - recall[:-1]))
+
+
+def average_precision(num_gbboxes, tp, fp, scores):
+    """
+    Compute VOC07 and VOC12 average precisions of one class.
+
+    Return:
+      ap_voc07, ap_voc12
+    """
+    precision, recall = precision_recall(num_gbboxes, tp, fp, scores)
+    return average_precision_voc07(precision, recall), average_precision_voc12(precision, recall)
+
+
+def bboxes_matching_image(classes, scores, bboxes, glabels, gbboxes, gdifficults, num_classes=21,
+                          matching_threshold=0.5):
+    """
+    Match the detected boxes of all classes of one image, sorted by decreasing score inside every class.
+
+    Return:
+      num_gbboxes, tp, fp: dictionary of number of groundtruth boxes per class, True and False Positives arrays.
+    """
+    tp = np.zeros(scores.shape, dtype=bool)
+    fp = np.zeros(scores.shape, dtype=bool)
+    num_gbboxes = {}
+    for c in range(1, num_classes):
+        mask = classes == c
+        idxes = np.where(mask)[0]
+        idxes = idxes[np.argsort(-scores[idxes], kind='mergesort')]
+        num_gbboxes[c], tp[idxes], fp[idxes] = bboxes_matching(
+            c, scores[idxes], bboxes[idxes], glabels, gbboxes, gdifficults, matching_threshold)
+    return num_gbboxes, tp, fp
+
+
+def mean_average_precision(records, num_classes=21):
+    """
+    Compute VOC07 and VOC12 mAP from per image records (num_gbboxes, classes, tp, fp, scores).
+
+    Return:
+      mAP_voc_07, mAP_voc_12
+    """
+    aps_voc07 = []
+    aps_voc12 = []
+    for c in range(1, num_classes):
+        num_gbboxes = sum(r[0][c] for r in records)
+        masks = [r[1] == c for r in records]
+        tp = np.concatenate([r[2][m] for r, m in zip(records, masks)])
+        fp = np.concatenate([r[3][m] for r, m in zip(records, masks)])
+        scores = np.concatenate([r[4][m] for r, m in zip(records, masks)])
+        ap_voc07, ap_voc12 = average_precision(num_gbboxes, tp, fp, scores)
+        aps_voc07.append(ap_voc07)
+        aps_voc12.append(ap_voc12)
+    return np.mean(aps_voc07), np.mean(aps_voc12)
@@ -0,0 +1,769 @@
+"""
+SSD meta-architecture shared by all the SSD networks.
+
+An SSD network is a backbone, which builds the feature layers, plus the machinery
+which does not depend on it:
+  * `SSDParams`: input size, feature layers and shapes, anchor sizes / ratios / steps;
+  * the anchors of every feature layer (`ssd_anchors_all_layers`);
+  * the multibox heads on the feature layers (`ssd_multibox_layer`, `ssd_multibox_layer_fused`, `ssd_net`);
+  * the encoding / decoding of the boxes and the post-processing (`SSDNet`);
+  * the losses (`ssd_losses`, `ssd_losses_per_layer`), plus the distillation losses from a
+    teacher network (`ssd_distillation_losses`).
+
+A network module (`ssd_vgg_300`, `ssd_vgg_512`, `ssd_mobilenet_300`) only defines its
+backbone, its default parameters and its arg scopes, in a subclass of `SSDNet`:
+
+    class SSDNet(ssd_meta_arch.SSDNet):
+        default_params = SSDParams(...)
+        default_scope = 'ssd_300_vgg'
+
+        def backbone(self, inputs, is_training=True, dropout_keep_prob=0.5):
+            ...
+            return end_points
+
+Another input size of an existing network is only configuration, the feature shapes,
+anchor sizes and steps being derived from the network itself:
+
+    ssd_params = ssd_vgg_300.SSDNet().params_for_size(384)
+    ssd_params = ssd_vgg_300.SSDNet().params_for_shape((300, 532))
+
+`nets/ssd_resolution.py` does it at inference time, for a stream of images of mixed sizes.
+
+@@ssd_meta_arch
+"""
+
+import copy
+import math
+from collections import namedtuple
+
+import numpy as np
+import tensorflow as tf
+
+import tf_extend as tfe
+from nets import custom_layers
+from nets import ssd_common
+
+import tensorflow.contrib.slim as slim
+
+
+SSDParams = namedtuple('SSDParameters', ['img_shape', 'num_classes', 'no_annotation_label', 'feat_layers',
+                                         'feat_shapes', 'anchor_size_bounds', 'anchor_sizes', 'anchor_ratios',
+                                         'anchor_steps', 'anchor_offset', 'normalizations', 'prior_scaling'])
+
+
+# =========================================================================== #
+# SSD class definition.
+# =========================================================================== #
+class SSDNet(object):
+    """Base class of the SSD networks.
+
+    Subclasses define `default_params`, `default_scope`, `backbone` and the arg scopes.
+    They can also change:
+      multibox_layer: the head of one feature layer, see `ssd_multibox_layer`;
+      multibox_layer_fused: the same head with one convolution, see `ssd_multibox_layer_fused`,
+        None if the network has none;
+      loss_fn: the loss function, see `ssd_losses`;
+      anchor_first_ratio: size of the smallest anchors relatively to the image, used by `params_for_size`.
+    """
+    default_params = None
+    default_scope = None
+    anchor_first_ratio = None
+
+    def __init__(self, params=None, fused_heads=False):
+        """
+        Init the SSD net with some parameters. Use the default ones if none provided.
+
+        Args:
+          fused_heads: Whether to use `multibox_layer_fused`, the checkpoints of the split heads
+            being converted by `changemodels/fuse_heads.py`.
+        """
+        if isinstance(params, SSDParams):
+            self.params = params
+        else:
+            self.params = self.default_params
+        if fused_heads and self.multibox_layer_fused is None:
+            raise ValueError('%s has no fused multibox heads.' % self.default_scope)
+        self.fused_heads = fused_heads
+        pass
+
+    # ======================================================================= #
+    def backbone(self, inputs, is_training=True, dropout_keep_prob=0.5):
+        """Builds the backbone in the current variable scope.
+
+        Returns:
+          The end_points dict, with at least the feature layers of `params.feat_layers`.
+        """
+        raise NotImplementedError('SSD networks must define their backbone.')
+
+    @staticmethod
+    def multibox_layer(inputs, num_classes, sizes, ratios=list([1]), normalization=-1):
+        return ssd_multibox_layer(inputs, num_classes, sizes, ratios, normalization)
+
+    @staticmethod
+    def multibox_layer_fused(inputs, num_classes, sizes, ratios=list([1]), normalization=-1):
+        return ssd_multibox_layer_fused(inputs, num_classes, sizes, ratios, normalization)
+
+    @staticmethod
+    def loss_fn(*args, **kwargs):
+        return ssd_losses(*args, **kwargs)
+
+    def net(self, inputs, is_training=True, update_feat_shapes=True, dropout_keep_prob=0.5,
+            prediction_fn=slim.softmax, reuse=None, scope=None):
+        """SSD network definition.
+        """
+        r = ssd_net(inputs, self.backbone, self.multibox_layer_fused if self.fused_heads else self.multibox_layer,
+                    num_classes=self.params.num_classes,
+                    feat_layers=self.params.feat_layers,
+                    anchor_sizes=self.params.anchor_sizes,
+                    anchor_ratios=self.params.anchor_ratios,
+                    normalizations=self.params.normalizations,
+                    is_training=is_training, dropout_keep_prob=dropout_keep_prob,
+                    prediction_fn=prediction_fn, reuse=reuse, scope=scope or self.default_scope,
+                    default_scope=self.default_scope)
+        # Update feature shapes (try at least!)
+        if update_feat_shapes:
+            shapes = ssd_feat_shapes_from_net(r[0], self.params.feat_shapes)
+            self.params = self.params._replace(feat_shapes=shapes)
+        return r
+
+    def arg_scope(self, weight_decay=0.0005, data_format='NHWC'):
+        """Network arg_scope.
+        """
+        raise NotImplementedError('SSD networks must define their arg_scope.')
+
+    def arg_scope_caffe(self, caffe_scope):
+        """Caffe arg_scope used for weights importing.
+        """
+        raise NotImplementedError('%s has no Caffe model to import.' % self.default_scope)
+
+    # ======================================================================= #
+    def params_for_size(self, img_size, num_classes=None):
+        """Parameters of this network for another square input size, e.g. 384 or 640.
+        """
+        return self.params_for_shape((img_size, img_size), num_classes=num_classes)
+
+    def params_for_shape(self, img_shape, num_classes=None, feat_shapes=None):
+        """Parameters of this network for another input shape (height, width), e.g. (300, 532).
+
+        The feature shapes are inferred by building the network in a scratch graph,
+        unless they are given (e.g. from the predictions of a run at this shape), the
+        anchor sizes follow `anchor_size_bounds` like in Caffe on the short side, and the
+        anchor steps spread the anchors evenly over the image, with a (step_y, step_x)
+        pair when the two differ. Everything else is kept.
+        """
+        img_shape = (int(img_shape[0]), int(img_shape[1]))
+        params = self.params._replace(num_classes=num_classes or self.params.num_classes)
+        if feat_shapes is None:
+            ssd_net = copy.copy(self)
+            ssd_net.params = params
+            with tf.Graph().as_default():
+                inputs = tf.placeholder(tf.float32, [1, img_shape[0], img_shape[1], 3])
+                with slim.arg_scope(self.arg_scope()):
+                    predictions = ssd_net.net(inputs, is_training=False, update_feat_shapes=False)[0]
+                feat_shapes = ssd_feat_shapes_from_net(predictions)
+        feat_shapes = [tuple(shape[:2]) for shape in feat_shapes]
+        anchor_sizes = ssd_size_bounds_to_values(params.anchor_size_bounds, len(params.feat_layers),
+                                                 img_shape, first_ratio=self.anchor_first_ratio)
+        anchor_steps = []
+        for shape in feat_shapes:
+            step_y, step_x = float(img_shape[0]) / shape[0], float(img_shape[1]) / shape[1]
+            anchor_steps.append(step_y if step_y == step_x else (step_y, step_x))
+        return params._replace(img_shape=img_shape, feat_shapes=feat_shapes,
+                               anchor_sizes=anchor_sizes, anchor_steps=anchor_steps)
+
+    def update_feature_shapes(self, predictions):
+        """Update feature shapes from predictions collection (Tensor or Numpy
+        array).
+        """
+        shapes = ssd_feat_shapes_from_net(predictions, self.params.feat_shapes)
+        self.params = self.params._replace(feat_shapes=shapes)
+        pass
+
+    # 前两个为所有“default boxes中心”的坐标，后两个为【原始比例，放大比例、不同的宽高比例...】
+    def anchors(self, img_shape, dtype=np.float32):
+        """Compute the default anchor boxes, given an image shape.
+        """
+        return ssd_anchors_all_layers(
+            img_shape, self.params.feat_shapes, self.params.anchor_sizes,
+            self.params.anchor_ratios, self.params.anchor_steps, self.params.anchor_offset, dtype)
+
+    def bboxes_encode(self, labels, bboxes, anchors, scope=None):
+        """Encode labels and bounding boxes.
+        """
+        return ssd_common.tf_ssd_bboxes_encode(
+            labels, bboxes, anchors, self.params.num_classes, self.params.no_annotation_label,
+            ignore_threshold=0.5, prior_scaling=self.params.prior_scaling, scope=scope)
+
+    def bboxes_decode(self, feat_localizations, anchors, scope='ssd_bboxes_decode'):
+        """Encode labels and bounding boxes.
+        """
+        return ssd_common.tf_ssd_bboxes_decode(
+            feat_localizations, anchors, prior_scaling=self.params.prior_scaling, scope=scope)
+
+    def detected_bboxes(self, predictions, localisations, select_threshold=None, nms_threshold=0.5,
+                        clipping_bbox=None, top_k=400, keep_top_k=200):
+        """Get the detected bounding boxes from the SSD network output.
+        """
+        # Select top_k bboxes from predictions, and clip
+        rscores, rbboxes = ssd_common.tf_ssd_bboxes_select(
+            predictions, localisations, select_threshold=select_threshold, num_classes=self.params.num_classes)
+        rscores, rbboxes = tfe.bboxes_sort(rscores, rbboxes, top_k=top_k)
+        # Apply NMS algorithm.
+        rscores, rbboxes = tfe.bboxes_nms_batch(rscores, rbboxes, nms_threshold=nms_threshold, keep_top_k=keep_top_k)
+        if clipping_bbox is not None:
+            rbboxes = tfe.bboxes_clip(clipping_bbox, rbboxes)
+        return rscores, rbboxes
+
+    def losses(self, logits, localisations, gclasses, glocalisations, gscores, match_threshold=0.5,
+               negative_ratio=3., alpha=1., label_smoothing=0., teacher=None, negative_mining=None,
+               scope='ssd_losses'):
+        """Define the SSD network losses.
+
+        negative_mining: see `ssd_losses`, None for the default of the loss function.
+        """
+        kwargs = {} if negative_mining is None else {'negative_mining': negative_mining}
+        return self.loss_fn(logits, localisations, gclasses, glocalisations, gscores,
+                            match_threshold=match_threshold, negative_ratio=negative_ratio, alpha=alpha,
+                            label_smoothing=label_smoothing, teacher=teacher, scope=scope, **kwargs)
+
+    pass
+
+
+# =========================================================================== #
+# SSD tools...
+# =========================================================================== #
+def ssd_size_bounds_to_values(size_bounds, n_feat_layers, img_shape=(300, 300), first_ratio=None):
+    """Compute the reference sizes of the anchor boxes from relative bounds.
+    The absolute values are measured in pixels, based on the network
+    default size (300 pixels).
+
+    This function follows the computation performed in the original
+    implementation of SSD in Caffe. For a non-square image, the sizes are
+    relative to its short side.
+
+    Args:
+      first_ratio: Size of the smallest anchors relatively to the image, e.g. 0.07 for
+        SSD 300 and 0.04 for SSD 512. None means half of the lower bound.
+
+    Return:
+      list of list containing the absolute sizes at each scale. For each scale,
+      the ratios only apply to the first value.
+    """
+    img_size = min(img_shape[0], img_shape[1])
+    min_ratio = int(size_bounds[0] * 100)
+    max_ratio = int(size_bounds[1] * 100)
+    step = int(math.floor((max_ratio - min_ratio) / (n_feat_layers - 2)))
+    # Start with the following smallest sizes.
+    first_ratio = size_bounds[0] / 2 if first_ratio is None else first_ratio
+    sizes = [[img_size * first_ratio, img_size * size_bounds[0]]]
+    for ratio in range(min_ratio, max_ratio + 1, step):
+        sizes.append((img_size * ratio / 100., img_size * (ratio + step) / 100.))
+    return sizes
+
+
+# 获取合适的shapes
+def ssd_feat_shapes_from_net(predictions, default_shapes=None):
+    """Try to obtain the feature shapes from the prediction layers. The latter
+    can be either a Tensor or Numpy ndarray.
+
+    Return:
+      list of feature shapes. Default values if predictions shape not fully
+      determined.
+    """
+    feat_shapes = []
+    for l in predictions:
+        # Get the shape, from either a np array or a tensor.
+        if isinstance(l, np.ndarray):
+            shape = l.shape
+        else:
+            shape = l.get_shape().as_list()
+        shape = shape[1:4]
+        # Problem: undetermined shape...
+        if None in shape:
+            return default_shapes
+        else:
+            feat_shapes.append(shape)
+    return feat_shapes
+
+
+def ssd_anchor_one_layer(img_shape, feat_shape, sizes, ratios, step, offset=0.5, dtype=np.float32):
+    """Computer SSD default anchor boxes for one feature layer.
+
+    Determine the relative position grid of the centers, and the relative
+    width and height.
+
+    Arguments:
+      feat_shape: Feature shape, used for computing relative position grids;
+      size: Absolute reference sizes; 这里的size是一个tuple（该层的尺寸，下一层的尺寸），因为根据论文所说，ratio为1的会产生两个框，s'_k, scale is s'_k=sqrt(s_k*s_k+1)，这是额外的额外的一个附加框
+      ratios: Ratios to use on these features;
+      img_shape: Image shape, used for computing height, width relatively to the
+        former;
+      step: Step of the grid in pixels, or (step_y, step_x) for a non-square image;
+      offset: Grid offset.
+
+    Return:
+      y, x, h, w: Relative x and y grids, and height and width.
+    """
+
+    # Compute the position grid: simple way.
+    # y, x = np.mgrid[0:feat_shape[0], 0:feat_shape[1]]
+    # y = (y.astype(dtype) + offset) / feat_shape[0]
+    # x = (x.astype(dtype) + offset) / feat_shape[1]
+    # Weird SSD-Caffe computation using steps values...
+    # 对应的特征图上每个点的框的横纵坐标
+    step_y, step_x = step if isinstance(step, (tuple, list)) else (step, step)
+    y, x = np.mgrid[0:feat_shape[0], 0:feat_shape[1]]
+    y = (y.astype(dtype) + offset) * step_y / img_shape[0]
+    x = (x.astype(dtype) + offset) * step_x / img_shape[1]
+
+    # Expand dims to support easy broadcasting.
+    # 这里扩展了维度，因为tf_ssd_bboxes_encode_layer是要用到。
+    y = np.expand_dims(y, axis=-1)
+    x = np.expand_dims(x, axis=-1)
+
+    # Compute relative height and width.
+    # Tries to follow the original implementation of SSD for the order.
+    num_anchors = len(sizes) + len(ratios)
+    h = np.zeros((num_anchors, ), dtype=dtype)  # 对应的特征图上每个点的长宽
+    w = np.zeros((num_anchors, ), dtype=dtype)
+    # Add first anchor boxes with ratio=1.
+    # 论文种的s_k等于=sizes[0] / img_shape[0]
+    h[0] = sizes[0] / img_shape[0]  # sizes[1]是下一层的大小，只有size[0]是当前层的。
+    w[0] = sizes[0] / img_shape[1]  # h[0],w[0]是默认框占整个图片（300*300）的比例。即`aspect ratio is 1`.
+    di = 1
+    if len(sizes) > 1:  # 论文种的s'_k, scale is s'_k=sqrt(s_k*s_k+1)
+        h[1] = math.sqrt(sizes[0] * sizes[1]) / img_shape[0]
+        w[1] = math.sqrt(sizes[0] * sizes[1]) / img_shape[1]
+        di += 1
+    for i, r in enumerate(ratios):  # aspect ratio is r
+        h[i+di] = sizes[0] / img_shape[0] / math.sqrt(r)
+        w[i+di] = sizes[0] / img_shape[1] * math.sqrt(r)
+    return y, x, h, w
+
+
+def ssd_anchors_all_layers(img_shape, layers_shape, anchor_sizes, anchor_ratios,
+                           anchor_steps, offset=0.5, dtype=np.float32):
+    """Compute anchor boxes for all feature layers.
+    """
+    layers_anchors = []
+    for i, s in enumerate(layers_shape):
+        anchor_bboxes = ssd_anchor_one_layer(
+            img_shape, s, anchor_sizes[i], anchor_ratios[i], anchor_steps[i], offset=offset, dtype=dtype)
+        layers_anchors.append(anchor_bboxes)
+    return layers_anchors
+
+
+# =========================================================================== #
+# Functional definition of the SSD heads.
+# =========================================================================== #
+def tensor_shape(x, rank=3):
+    """Returns the dimensions of a tensor.
+    Args:
+      image: A N-D Tensor of shape.
+    Returns:
+      A list of dimensions. Dimensions that are statically known are python
+        integers,otherwise they are integer scalar tensors.
+    """
+    if x.get_shape().is_fully_defined():
+        return x.get_shape().as_list()
+    else:
+        static_shape = x.get_shape().with_rank(rank).as_list()
+        dynamic_shape = tf.unstack(tf.shape(x), rank)
+        return [s if s is not None else d for s, d in zip(static_shape, dynamic_shape)]
+
+    pass
+
+
+def ssd_multibox_layer(inputs, num_classes, sizes, ratios=list([1]), normalization=-1, bn_normalization=False):
+    """Construct a multibox layer, return a class and localization predictions.
+    """
+    net = inputs
+    if normalization > 0:
+        net = custom_layers.l2_normalization(net, scaling=True)
+    # Number of anchors., 两种尺寸，每种都有缩放
+    num_anchors = len(sizes) + len(ratios)
+
+    # Location.：比如第一层：38 * 38 * 4 * 4，每一个点（28 * 38）的num_anchors（4）种框的四个坐标值（4，x_min, x_max, y_min, y_max）
+    num_loc_pred = num_anchors * 4
+    loc_pred = slim.conv2d(net, num_loc_pred, [3, 3], activation_fn=None, scope='conv_loc')
+    loc_pred = custom_layers.channel_to_last(loc_pred)
+    # 特征图的每个点都有每个尺寸的各个缩放比的框
+    loc_pred = tf.reshape(loc_pred, tensor_shape(loc_pred, 4)[:-1]+[num_anchors, 4])   # （38,38,num_anchors,4）
+
+    # Class prediction.: 比如第一层：38 * 38 * 4 * 21，每一个点（28 * 38）的num_anchors（4）种框的每一类预测得分（21）
+    num_cls_pred = num_anchors * num_classes
+    cls_pred = slim.conv2d(net, num_cls_pred, [3, 3], activation_fn=None, scope='conv_cls')
+    cls_pred = custom_layers.channel_to_last(cls_pred)
+    cls_pred = tf.reshape(cls_pred, tensor_shape(cls_pred, 4)[:-1]+[num_anchors, num_classes])
+    return cls_pred, loc_pred
+
+
+def ssd_multibox_layer_fused(inputs, num_classes, sizes, ratios=list([1]), normalization=-1):
+    """Construct a multibox layer with one convolution, return a class and localization predictions.
+
+    Same outputs as `ssd_multibox_layer`. The `conv_box` convolution outputs the location
+    channels then the class channels: its weights and biases are the ones of `conv_loc` and
+    `conv_cls` concatenated on the output channels (see `changemodels/fuse_heads.py`).
+    """
+    net = inputs
+    if normalization > 0:
+        net = custom_layers.l2_normalization(net, scaling=True)
+    num_anchors = len(sizes) + len(ratios)
+    num_loc_pred = num_anchors * 4
+    num_cls_pred = num_anchors * num_classes
+
+    # 位置和类别一次卷积，再按通道切开
+    box_pred = slim.conv2d(net, num_loc_pred + num_cls_pred, [3, 3], activation_fn=None, scope='conv_box')
+    box_pred = custom_layers.channel_to_last(box_pred)
+    loc_pred, cls_pred = tf.split(box_pred, [num_loc_pred, num_cls_pred], axis=-1)
+    loc_pred = tf.reshape(loc_pred, tensor_shape(loc_pred, 4)[:-1]+[num_anchors, 4])
+    cls_pred = tf.reshape(cls_pred, tensor_shape(cls_pred, 4)[:-1]+[num_anchors, num_classes])
+    return cls_pred, loc_pred
+
+
+def ssd_net(inputs, backbone, multibox_layer=ssd_multibox_layer, num_classes=21, feat_layers=None,
+            anchor_sizes=None, anchor_ratios=None, normalizations=None, is_training=True, dropout_keep_prob=0.5,
+            prediction_fn=slim.softmax, reuse=None, scope=None, default_scope='ssd'):
+    """
+    SSD net definition: a backbone and a multibox head on each of its feature layers.
+
+    Args:
+      backbone: A function (inputs, is_training, dropout_keep_prob) -> end_points,
+        building the backbone in the current variable scope.
+      multibox_layer: The head of one feature layer, see `ssd_multibox_layer`.
+    """
+    with tf.variable_scope(scope, default_scope, [inputs], reuse=reuse):
+        # 有批归一化的主干和预测层用到is_training
+        with slim.arg_scope([slim.batch_norm], is_training=is_training):
+            # End_points collect relevant activations for external use.
+            end_points = backbone(inputs, is_training=is_training, dropout_keep_prob=dropout_keep_prob)
+
+            # Prediction and localisations layers.
+            predictions = []
+            logits = []
+            localisations = []
+            # 每一层特征图的预测
+            for i, layer in enumerate(feat_layers):
+                with tf.variable_scope(layer + '_box'):
+                    # 特征图的需要框的点数*每个点的框数
+                    # 每一层特征图框的大小和框的变化已经定好了
+                    pred, loc = multibox_layer(end_points[layer], num_classes,
+                                               anchor_sizes[i], anchor_ratios[i], normalizations[i])
+                predictions.append(prediction_fn(pred))
+                logits.append(pred)
+                localisations.append(loc)
+
+        return predictions, localisations, logits, end_points
+
+    pass
+
+
+# =========================================================================== #
+# SSD loss functions.
+# =========================================================================== #
+def ssd_losses(logits, localisations, gclasses, glocalisations, gscores, match_threshold=0.5,
+               negative_ratio=3., alpha=1., label_smoothing=0., teacher=None, negative_mining='global', scope=None):
+    """Loss functions of SSD, with the hard negatives mined over all the layers of the batch
+    or of every image.
+
+    The losses are added to the TF loss collection.
+
+    Arguments:
+      logits: (list of) predictions logits Tensors;
+      localisations: (list of) localisations Tensors;
+      gclasses: (list of) groundtruth labels Tensors;
+      glocalisations: (list of) groundtruth localisations Tensors;
+      gscores: (list of) groundtruth score Tensors;
+      teacher: None, or the keyword arguments of `ssd_distillation_losses` (tlogits,
+        tlocalisations, tscores, ...) to add the distillation losses;
+      negative_mining: 'global': the hardest negatives of the whole batch, one threshold found
+        with `tf.nn.top_k`; 'per_image': the hardest negatives of every image, see
+        `ssd_hard_negatives_per_image`;
+    """
+    if negative_mining not in ('global', 'per_image'):
+        raise ValueError('Unknown negative mining: %s' % negative_mining)
+    with tf.name_scope(scope, 'ssd_losses'):
+        if teacher is not None:
+            ssd_distillation_losses(logits, localisations, **teacher)
+        lshape = tfe.get_shape(logits[0], 5)
+        num_classes = lshape[-1]
+        batch_size = lshape[0]
+
+        # Flatten out all vectors! 按图片排列：[batch_size, 所有层的默认框, ...]
+        flogits = []
+        fgclasses = []
+        fgscores = []
+        flocalisations = []
+        fglocalisations = []
+        for i in range(len(logits)):
+            flogits.append(tf.reshape(logits[i], [batch_size, -1, num_classes]))
+            fgclasses.append(tf.reshape(gclasses[i], [batch_size, -1]))
+            fgscores.append(tf.reshape(gscores[i], [batch_size, -1]))
+            flocalisations.append(tf.reshape(localisations[i], [batch_size, -1, 4]))
+            fglocalisations.append(tf.reshape(glocalisations[i], [batch_size, -1, 4]))
+        # And concat the crap!
+        logits = tf.reshape(tf.concat(flogits, axis=1), [-1, num_classes])
+        gclasses = tf.reshape(tf.concat(fgclasses, axis=1), [-1])
+        gscores = tf.reshape(tf.concat(fgscores, axis=1), [-1])
+        localisations = tf.reshape(tf.concat(flocalisations, axis=1), [-1, 4])
+        glocalisations = tf.reshape(tf.concat(fglocalisations, axis=1), [-1, 4])
+        dtype = logits.dtype
+
+        # Compute positive matching mask... 正样本
+        pmask = gscores > match_threshold
+        fpmask = tf.cast(pmask, dtype)
+        n_positives = tf.reduce_sum(fpmask)
+
+        # Hard negative mining...
+        no_classes = tf.cast(pmask, tf.int32)
+        predictions = slim.softmax(logits)
+        nmask = tf.logical_and(tf.logical_not(pmask), gscores > -0.5)  # 这里存疑，为什么是-0.5？，论文中说的是0.5
+        fnmask = tf.cast(nmask, dtype)
+        nvalues = tf.where(nmask, predictions[:, 0], 1. - fnmask)
+        if negative_mining == 'global':
+            nvalues_flat = tf.reshape(nvalues, [-1])
+            # Number of negative entries to select.
+            max_neg_entries = tf.cast(tf.reduce_sum(fnmask), tf.int32)
+            n_neg = tf.cast(negative_ratio * n_positives, tf.int32) + batch_size
+            n_neg = tf.minimum(n_neg, max_neg_entries)
+
+            val, idxes = tf.nn.top_k(-nvalues_flat, k=n_neg)
+            max_hard_pred = -val[-1]
+            # Final negative mask.
+            nmask = tf.logical_and(nmask, nvalues < max_hard_pred)
+        else:
+            # 每张图片：negative_ratio倍正样本数加1个，同样不超过负样本数
+            n_positives_image = tf.reduce_sum(tf.reshape(fpmask, [batch_size, -1]), axis=1)
+            max_neg_entries_image = tf.reduce_sum(tf.cast(tf.reshape(nmask, [batch_size, -1]), tf.int32), axis=1)
+            n_neg = tf.minimum(tf.cast(negative_ratio * n_positives_image, tf.int32) + 1, max_neg_entries_image)
+            hard_nmask = ssd_hard_negatives_per_image(tf.reshape(nvalues, [batch_size, -1]), n_neg)
+            nmask = tf.logical_and(nmask, tf.reshape(hard_nmask, [-1]))
+        fnmask = tf.cast(nmask, dtype)
+
+        # Add cross-entropy loss.
+        with tf.name_scope('cross_entropy_pos'):
+            loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits, labels=gclasses)
+            loss = tf.div(tf.reduce_sum(loss * fpmask), tf.cast(batch_size, dtype), name='value')
+            tf.losses.add_loss(loss)
+
+        with tf.name_scope('cross_entropy_neg'):
+            # 从不是正样本的框里面选择， 让他们预测是背景的概率
+            loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits, labels=no_classes)
+            # 预测背景的置信度越小，误差越大，  误差变小说的是，是背景要预测成背景
+            loss = tf.div(tf.reduce_sum(loss * fnmask), tf.cast(batch_size, dtype), name='value')
+            tf.losses.add_loss(loss)
+
+
+        # Add localization loss: smooth L1, L2, ...
+        with tf.name_scope('localization'):
+            # Weights Tensor: positive mask + random negative.
+            weights = tf.expand_dims(alpha * fpmask, axis=-1)
+            loss = custom_layers.abs_smooth(localisations - glocalisations)
+            loss = tf.div(tf.reduce_sum(loss * weights), tf.cast(batch_size, dtype), name='value')
+            tf.losses.add_loss(loss)
+        pass
+
+    pass
+
+
+def ssd_hard_negatives_per_image(nvalues, n_neg):
+    """Hard negatives of every image: its negatives with the lowest background probability.
+
+    The threshold of every image is its n_neg-th smallest value, found by a partial selection
+    (`tf.nn.nth_element`) instead of sorting the negatives of the whole batch with `tf.nn.top_k`.
+    Like the global mining, only the values strictly lower than the threshold are selected,
+    so ties with the threshold do not change the number of negatives.
+
+    Arguments:
+      nvalues: Background probabilities of the negatives, 1 for the other anchors,
+        [batch_size, num_anchors];
+      n_neg: int32 Tensor [batch_size], the rank of the threshold of every image.
+
+    Return:
+      The mask of the hard negatives, [batch_size, num_anchors].
+    """
+    with tf.name_scope('hard_negatives_per_image'):
+        n_neg = tf.minimum(n_neg, tf.shape(nvalues)[1])
+
+        def kth_value(args):
+            values, k = args
+            # 没有负样本时阈值比所有值都小
+            return tf.cond(k > 0, lambda: tf.nn.nth_element(values, tf.maximum(k - 1, 0)),
+                           lambda: tf.constant(-1., values.dtype))
+
+        thresholds = tf.map_fn(kth_value, (nvalues, n_neg), dtype=nvalues.dtype)
+        return nvalues < tf.expand_dims(thresholds, axis=-1)
+
+
+def ssd_losses_per_layer(logits, localisations, gclasses, glocalisations, gscores, match_threshold=0.5,
+                         negative_ratio=3., alpha=1., label_smoothing=0., teacher=None, negative_mining='global',
+                         scope=None):
+    """Loss functions of SSD, with the hard negatives mined in every layer separately,
+    over the batch or in every image.
+
+    This function defines the different loss components of the SSD, and
+    adds them to the TF loss collection.
+
+    Arguments:
+      logits: (list of) predictions logits Tensors;
+      localisations: (list of) localisations Tensors;
+      gclasses: (list of) groundtruth labels Tensors;
+      glocalisations: (list of) groundtruth localisations Tensors;
+      gscores: (list of) groundtruth score Tensors;
+      teacher: None, or the keyword arguments of `ssd_distillation_losses`;
+      negative_mining: 'global': the hardest negatives of the layer in the whole batch;
+        'per_image': the hardest negatives of the layer in every image, see
+        `ssd_hard_negatives_per_image`;
+    """
+    if negative_mining not in ('global', 'per_image'):
+        raise ValueError('Unknown negative mining: %s' % negative_mining)
+    with tf.name_scope(scope, 'ssd_losses'):
+        if teacher is not None:
+            ssd_distillation_losses(logits, localisations, **teacher)
+        l_cross_pos = []
+        l_cross_neg = []
+        l_loc = []
+        for i in range(len(logits)):
+            dtype = logits[i].dtype
+            with tf.name_scope('block_%i' % i):
+                # Determine weights Tensor.
+                pmask = gscores[i] > match_threshold
+                fpmask = tf.cast(pmask, dtype)
+                n_positives = tf.reduce_sum(fpmask)
+
+                # Negative mask.
+                no_classes = tf.cast(pmask, tf.int32)
+                predictions = slim.softmax(logits[i])
+                nmask = tf.logical_and(tf.logical_not(pmask), gscores[i] > -0.5)
+                fnmask = tf.cast(nmask, dtype)
+                nvalues = tf.where(nmask, predictions[:, :, :, :, 0], 1. - fnmask)
+                nvalues_flat = tf.reshape(nvalues, [-1])
+                if negative_mining == 'global':
+                    # Number of negative entries to select.
+                    n_neg = tf.cast(negative_ratio * n_positives, tf.int32)
+                    n_neg = tf.maximum(n_neg, tf.size(nvalues_flat) // 8)
+                    n_neg = tf.maximum(n_neg, tf.shape(nvalues)[0] * 4)
+                    max_neg_entries = 1 + tf.cast(tf.reduce_sum(fnmask), tf.int32)
+                    n_neg = tf.minimum(n_neg, max_neg_entries)
+
+                    val, idxes = tf.nn.top_k(-nvalues_flat, k=n_neg)
+                    minval = val[-1]
+                    # Final negative mask.
+                    nmask = tf.logical_and(nmask, -nvalues > minval)
+                else:
+                    # 每张图片的个数和整个批次的规则相同：至少该层默认框的1/8和4个
+                    nvalues_image = tf.reshape(nvalues, [tf.shape(nvalues)[0], -1])
+                    n_positives_image = tf.reduce_sum(tf.reshape(fpmask, tf.shape(nvalues_image)), axis=1)
+                    n_neg = tf.cast(negative_ratio * n_positives_image, tf.int32)
+                    n_neg = tf.maximum(n_neg, tf.maximum(tf.shape(nvalues_image)[1] // 8, 4))
+                    max_neg_entries = 1 + tf.cast(tf.reduce_sum(tf.reshape(fnmask, tf.shape(nvalues_image)), axis=1),
+                                                  tf.int32)
+                    n_neg = tf.minimum(n_neg, max_neg_entries)
+                    hard_nmask = ssd_hard_negatives_per_image(nvalues_image, n_neg)
+                    nmask = tf.logical_and(nmask, tf.reshape(hard_nmask, tf.shape(nvalues)))
+                fnmask = tf.cast(nmask, dtype)
+
+                # Add cross-entropy loss.
+                with tf.name_scope('cross_entropy_pos'):
+                    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits[i], labels=gclasses[i])
+                    loss = tf.losses.compute_weighted_loss(loss, fpmask)
+                    l_cross_pos.append(loss)
+
+                with tf.name_scope('cross_entropy_neg'):
+                    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits[i], labels=no_classes)
+                    loss = tf.losses.compute_weighted_loss(loss, fnmask)
+                    l_cross_neg.append(loss)
+
+                # Add localization loss: smooth L1, L2, ...
+                with tf.name_scope('localization'):
+                    # Weights Tensor: positive mask + random negative.
+                    weights = tf.expand_dims(alpha * fpmask, axis=-1)
+                    loss = custom_layers.abs_smooth(localisations[i] - glocalisations[i])
+                    loss = tf.losses.compute_weighted_loss(loss, weights)
+                    l_loc.append(loss)
+
+            pass
+
+        # Additional total losses...
+        with tf.name_scope('total'):
+            total_cross_pos = tf.add_n(l_cross_pos, 'cross_entropy_pos')
+            total_cross_neg = tf.add_n(l_cross_neg, 'cross_entropy_neg')
+            total_cross = tf.add(total_cross_pos, total_cross_neg, 'cross_entropy')
+            total_loc = tf.add_n(l_loc, 'localization')
+
+            # Add to EXTRA LOSSES TF.collection
+            tf.add_to_collection('EXTRA_LOSSES', total_cross_pos)
+            tf.add_to_collection('EXTRA_LOSSES', total_cross_neg)
+            tf.add_to_collection('EXTRA_LOSSES', total_cross)
+            tf.add_to_collection('EXTRA_LOSSES', total_loc)
+
+        pass
+
+    pass
+
+
+def ssd_distillation_losses(logits, localisations, tlogits, tlocalisations, tscores, match_threshold=0.5,
+                            temperature=1., beta=1., alpha=1., scope=None):
+    """Distillation losses of SSD, on the student anchors matched with a box of the teacher.
+
+    The boxes detected by the teacher are matched to the student anchors like the
+    groundtruth (`ssd_common.tf_ssd_bboxes_encode`), so the teacher and the student
+    can have different input sizes and anchors. The losses are added to the TF
+    loss collection.
+
+    Arguments:
+      logits: (list of) predictions logits Tensors;
+      localisations: (list of) localisations Tensors;
+      tlogits: (list of) teacher logits Tensors of the matched teacher boxes;
+      tlocalisations: (list of) matched teacher boxes, encoded on the student anchors;
+      tscores: (list of) jaccard of the student anchors with the matched teacher boxes;
+      temperature: Softmax temperature of the KL loss, which is scaled by temperature ** 2;
+      beta: Weight of the KL loss;
+      alpha: Weight of the localization loss, also weighted by the teacher objectness;
+    """
+    with tf.name_scope(scope, 'ssd_distillation_losses'):
+        lshape = tfe.get_shape(logits[0], 5)
+        num_classes = lshape[-1]
+        batch_size = lshape[0]
+
+        # Flatten out all vectors!
+        flogits = []
+        flocalisations = []
+        ftlogits = []
+        ftlocalisations = []
+        ftscores = []
+        for i in range(len(logits)):
+            flogits.append(tf.reshape(logits[i], [-1, num_classes]))
+            flocalisations.append(tf.reshape(localisations[i], [-1, 4]))
+            ftlogits.append(tf.reshape(tlogits[i], [-1, num_classes]))
+            ftlocalisations.append(tf.reshape(tlocalisations[i], [-1, 4]))
+            ftscores.append(tf.reshape(tscores[i], [-1]))
+        logits = tf.concat(flogits, axis=0)
+        localisations = tf.concat(flocalisations, axis=0)
+        # 老师的输出是常量
+        tlogits = tf.stop_gradient(tf.concat(ftlogits, axis=0))
+        tlocalisations = tf.stop_gradient(tf.concat(ftlocalisations, axis=0))
+        tscores = tf.concat(ftscores, axis=0)
+        dtype = logits.dtype
+
+        # 和老师的框匹配的默认框
+        tmask = tf.cast(tscores > match_threshold, dtype)
+
+        with tf.name_scope('kl'):
+            tlog_probs = tf.nn.log_softmax(tlogits / temperature)
+            log_probs = tf.nn.log_softmax(logits / temperature)
+            loss = tf.reduce_sum(tf.exp(tlog_probs) * (tlog_probs - log_probs), axis=-1)
+            loss = tf.div(tf.reduce_sum(loss * tmask) * beta * temperature ** 2, tf.cast(batch_size, dtype),
+                          name='value')
+            tf.losses.add_loss(loss)
+
+        with tf.name_scope('localization'):
+            # 老师越确定是物体（不是背景），权重越大
+            tobjectness = 1. - tf.nn.softmax(tlogits)[:, 0]
+            weights = tf.expand_dims(alpha * tmask * tobjectness, axis=-1)
+            loss = custom_layers.abs_smooth(localisations - tlocalisations)
+            loss = tf.div(tf.reduce_sum(loss * weights), tf.cast(batch_size, dtype), name='value')
+            tf.losses.add_loss(loss)
+        pass
+
+    pass
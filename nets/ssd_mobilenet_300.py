@@ -0,0 +1,205 @@
+"""
+Definition of a 300 SSD network with a depthwise-separable backbone.
+
+The VGG-16 trunk and the dilated 1024 channels conv6 of `ssd_vgg_300` cost about
+31G multiply-adds per 300x300 image, which is too slow on CPU only inference nodes.
+This variant replaces:
+  * the trunk by a MobileNet-v1 like stack of depthwise 3x3 + pointwise 1x1 convolutions,
+    with batch normalization and ReLU6;
+  * the extra blocks by 1x1 reductions followed by depthwise-separable 3x3 convolutions;
+  * the 3x3 multibox convolutions by a depthwise 3x3 followed by the 1x1 predictions.
+
+It costs about 1.2G multiply-adds. The feature maps have the same shapes and strides
+as SSD VGG 300 (38, 19, 10, 5, 3, 1), so the anchors, the encoding / decoding and the
+losses are the ones of `ssd_meta_arch.SSDNet` with the SSD VGG 300 parameters, and the
+runners work unchanged:
+
+    RunnerTrain(net_model=ssd_mobilenet_300, net_model_scope="ssd_300_mobilenet", run_type=1, ...)
+
+Batch normalization is in training mode when `is_training` (see `ssd_meta_arch.ssd_net`),
+its moving statistics are updated through `tf.GraphKeys.UPDATE_OPS`.
+
+@@ssd_mobilenet_300
+"""
+
+import functools
+
+import tensorflow as tf
+
+from nets import custom_layers
+from nets import ssd_meta_arch
+from nets import ssd_vgg_300
+
+import tensorflow.contrib.slim as slim
+
+
+# =========================================================================== #
+# SSD class definition.
+# =========================================================================== #
+class SSDNet(ssd_meta_arch.SSDNet):
+    """Implementation of the SSD 300 network with a depthwise-separable backbone.
+
+    The default features layers with 300x300 image input are:
+      block5 ==> 38 x 38
+      block11 ==> 19 x 19
+      block13 ==> 10 x 10
+      block14 ==> 5 x 5
+      block15 ==> 3 x 3
+      block16 ==> 1 x 1
+    The default image size used to train this network is 300x300.
+    """
+    default_params = ssd_vgg_300.SSDNet.default_params._replace(
+        feat_layers=['block5', 'block11', 'block13', 'block14', 'block15', 'block16'],
+        # 有批归一化，不需要像VGG的conv4那样做L2归一化
+        normalizations=[-1, -1, -1, -1, -1, -1])
+    default_scope = 'ssd_300_mobilenet'
+    anchor_first_ratio = 0.07
+    # 预测层的深度可分离卷积各自独立，没有融合的版本
+    multibox_layer_fused = None
+
+    def __init__(self, params=None, depth_multiplier=1.0):
+        """
+        Init the SSD net with some parameters. Use the default ones if none provided.
+
+        Args:
+          depth_multiplier: Multiplier of the number of channels of the backbone and of the extra blocks.
+        """
+        super(SSDNet, self).__init__(params)
+        self.depth_multiplier = depth_multiplier
+        pass
+
+    # ======================================================================= #
+    def backbone(self, inputs, is_training=True, dropout_keep_prob=0.5):
+        """There is no dropout, `dropout_keep_prob` is only kept for the interface."""
+        return ssd_mobilenet_backbone(inputs, depth_multiplier=self.depth_multiplier)
+
+    @staticmethod
+    def multibox_layer(inputs, num_classes, sizes, ratios=list([1]), normalization=-1):
+        return ssd_multibox_layer(inputs, num_classes, sizes, ratios, normalization)
+
+    def arg_scope(self, weight_decay=0.00004, data_format='NHWC'):
+        """Network arg_scope.
+        """
+        return ssd_arg_scope(weight_decay, data_format=data_format)
+
+    pass
+
+
+# =========================================================================== #
+# Functional definition of the depthwise-separable SSD 300.
+# =========================================================================== #
+# (名字, 输出通道, 步长)：MobileNet-v1的13个深度可分离卷积
+_BACKBONE_BLOCKS = [('block1', 64, 1), ('block2', 128, 2), ('block3', 128, 1), ('block4', 256, 2),
+                    ('block5', 256, 1), ('block6', 512, 2), ('block7', 512, 1), ('block8', 512, 1),
+                    ('block9', 512, 1), ('block10', 512, 1), ('block11', 512, 1), ('block12', 1024, 2),
+                    ('block13', 1024, 1)]
+# (名字, 1x1降维通道, 输出通道, padding)：额外的特征层，SAME时3x3步长为2，VALID时步长为1(3*3 ==> 1*1)
+_EXTRA_BLOCKS = [('block14', 256, 512, 'SAME'), ('block15', 128, 256, 'SAME'), ('block16', 128, 256, 'VALID')]
+
+
+def separable_conv2d(inputs, num_outputs, stride=1, padding='SAME', scope=None):
+    """Depthwise 3x3 convolution followed by a pointwise 1x1 convolution, both normalized.
+    """
+    with tf.variable_scope(scope, 'separable_conv2d', [inputs]):
+        net = slim.separable_conv2d(inputs, None, [3, 3], depth_multiplier=1, stride=stride, padding=padding,
+                                    scope='depthwise')
+        net = slim.conv2d(net, num_outputs, [1, 1], scope='pointwise')
+        return net
+    pass
+
+
+def ssd_multibox_layer(inputs, num_classes, sizes, ratios=list([1]), normalization=-1):
+    """Construct a depthwise-separable multibox layer, return a class and localization predictions.
+
+    Same outputs as `ssd_meta_arch.ssd_multibox_layer`, the 3x3 convolutions being depthwise.
+    """
+    net = inputs
+    if normalization > 0:
+        net = custom_layers.l2_normalization(net, scaling=True)
+    num_anchors = len(sizes) + len(ratios)
+
+    # Location.
+    num_loc_pred = num_anchors * 4
+    loc_pred = slim.separable_conv2d(net, None, [3, 3], depth_multiplier=1, scope='conv_loc_depthwise')
+    loc_pred = slim.conv2d(loc_pred, num_loc_pred, [1, 1], activation_fn=None, normalizer_fn=None, scope='conv_loc')
+    loc_pred = custom_layers.channel_to_last(loc_pred)
+    loc_pred = tf.reshape(loc_pred, ssd_meta_arch.tensor_shape(loc_pred, 4)[:-1]+[num_anchors, 4])
+
+    # Class prediction.
+    num_cls_pred = num_anchors * num_classes
+    cls_pred = slim.separable_conv2d(net, None, [3, 3], depth_multiplier=1, scope='conv_cls_depthwise')
+    cls_pred = slim.conv2d(cls_pred, num_cls_pred, [1, 1], activation_fn=None, normalizer_fn=None, scope='conv_cls')
+    cls_pred = custom_layers.channel_to_last(cls_pred)
+    cls_pred = tf.reshape(cls_pred, ssd_meta_arch.tensor_shape(cls_pred, 4)[:-1]+[num_anchors, num_classes])
+    return cls_pred, loc_pred
+
+
+def ssd_mobilenet_backbone(inputs, depth_multiplier=1.0, **kwargs):
+    """Depthwise-separable backbone and extra blocks.
+
+    Args:
+      depth_multiplier: Multiplier of the number of channels of the backbone and of the extra blocks.
+
+    Returns:
+      The end_points dict.
+    """
+    def depth(d):
+        return max(int(d * depth_multiplier), 8)
+
+    end_points = {}
+    # 深度可分离的主干网络
+    net = slim.conv2d(inputs, depth(32), [3, 3], stride=2, scope='conv0')  # 150*150*32
+    end_points['block0'] = net
+    for end_point, num_outputs, stride in _BACKBONE_BLOCKS:
+        net = separable_conv2d(net, depth(num_outputs), stride=stride, scope=end_point)
+        end_points[end_point] = net  # block5: 38*38, block11: 19*19, block13: 10*10
+
+    # Extra blocks: 1x1 and depthwise-separable 3x3 convolutions stride 2 (VALID for the last).
+    for end_point, num_reduced, num_outputs, padding in _EXTRA_BLOCKS:
+        with tf.variable_scope(end_point):
+            net = slim.conv2d(net, depth(num_reduced), [1, 1], scope='conv1x1')
+            net = separable_conv2d(net, depth(num_outputs), stride=2 if padding == 'SAME' else 1,
+                                   padding=padding, scope='conv3x3')
+        end_points[end_point] = net  # block14: 5*5, block15: 3*3, block16: 1*1
+    return end_points
+
+
+def ssd_net(inputs, num_classes=SSDNet.default_params.num_classes, feat_layers=SSDNet.default_params.feat_layers,
+            anchor_sizes=SSDNet.default_params.anchor_sizes, anchor_ratios=SSDNet.default_params.anchor_ratios,
+            normalizations=SSDNet.default_params.normalizations, is_training=True, dropout_keep_prob=0.5,
+            prediction_fn=slim.softmax, reuse=None, scope='ssd_300_mobilenet', depth_multiplier=1.0):
+    """
+    SSD net definition.
+    """
+    backbone = functools.partial(ssd_mobilenet_backbone, depth_multiplier=depth_multiplier)
+    return ssd_meta_arch.ssd_net(inputs, backbone, ssd_multibox_layer, num_classes=num_classes,
+                                 feat_layers=feat_layers, anchor_sizes=anchor_sizes, anchor_ratios=anchor_ratios,
+                                 normalizations=normalizations, is_training=is_training,
+                                 dropout_keep_prob=dropout_keep_prob, prediction_fn=prediction_fn, reuse=reuse,
+                                 scope=scope, default_scope='ssd_300_mobilenet')
+
+ssd_net.default_image_size = 300
+
+
+def ssd_arg_scope(weight_decay=0.00004, data_format='NHWC'):
+    """Defines the depthwise-separable SSD arg scope.
+
+    Args:
+      weight_decay: The l2 regularization coefficient of the 1x1 and full convolutions,
+        the depthwise filters are not regularized.
+
+    Returns:
+      An arg_scope.
+    """
+    with slim.arg_scope([slim.conv2d, slim.separable_conv2d], activation_fn=tf.nn.relu6,
+                        normalizer_fn=slim.batch_norm,
+                        weights_initializer=tf.contrib.layers.xavier_initializer(),
+                        biases_initializer=tf.zeros_initializer(), padding='SAME', data_format=data_format):
+        with slim.arg_scope([slim.conv2d], weights_regularizer=slim.l2_regularizer(weight_decay)):
+            with slim.arg_scope([slim.separable_conv2d], weights_regularizer=None):
+                with slim.arg_scope([slim.batch_norm], decay=0.9997, epsilon=0.001, scale=True, fused=True,
+                                    data_format=data_format):
+                    with slim.arg_scope([custom_layers.pad2d, custom_layers.l2_normalization,
+                                         custom_layers.channel_to_last], data_format=data_format) as sc:
+                        return sc
+    pass
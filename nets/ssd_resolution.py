@@ -0,0 +1,118 @@
+"""
+Inference of an SSD network on images of any size.
+
+The convolutions of an SSD network do not depend on the input size, only the
+anchors do. Instead of squashing every image to the training size, e.g. a 16:9
+frame to 300x300, the image is resized to a shape with about its aspect ratio:
+  * `ResolutionBuckets`: the policy which maps an image size to one of a few input
+    shapes (same short side, a few aspect ratios), so that a stream of images of
+    mixed sizes only runs the network at a few shapes;
+  * `AnchorCache`: the parameters and anchors of the network at every input shape,
+    computed once, the feature shapes being those of the predictions.
+
+    buckets = ssd_resolution.ResolutionBuckets(short_side=300)
+    anchor_cache = ssd_resolution.AnchorCache(ssd_net)
+    net_shape = buckets.bucket(image.shape)
+    ... run the network with the image resized to net_shape ...
+    anchors = anchor_cache.anchors(net_shape, predictions)
+
+@@ssd_resolution
+"""
+
+import math
+from collections import OrderedDict
+
+from nets import ssd_meta_arch
+
+
+class ResolutionBuckets(object):
+    """Maps the size of an image to an input shape (height, width) of the network.
+
+    Every bucket has the same short side and one of `aspect_ratios` (width / height),
+    the long side being rounded to a multiple of `multiple`. An image goes to the
+    bucket with the closest aspect ratio.
+    """
+
+    def __init__(self, short_side=300, aspect_ratios=(1., 4. / 3, 16. / 9, 3. / 4, 9. / 16), multiple=8):
+        """
+        Args:
+          short_side: Short side of all the buckets, e.g. the training size.
+          aspect_ratios: Aspect ratios (width / height) of the buckets.
+          multiple: The long side is rounded to a multiple of it.
+        """
+        self.short_side = short_side
+        self.multiple = multiple
+        self.shapes = []
+        for ratio in aspect_ratios:
+            long_side = max(short_side, int(round(short_side * max(ratio, 1. / ratio) / multiple)) * multiple)
+            shape = (short_side, long_side) if ratio >= 1 else (long_side, short_side)
+            if shape not in self.shapes:
+                self.shapes.append(shape)
+            pass
+        self.counts = OrderedDict((shape, 0) for shape in self.shapes)
+        pass
+
+    def bucket(self, image_shape):
+        """Input shape (height, width) for an image of shape (height, width, ...)."""
+        aspect = math.log(float(image_shape[1]) / image_shape[0])
+        shape = min(self.shapes, key=lambda s: abs(math.log(float(s[1]) / s[0]) - aspect))
+        self.counts[shape] += 1
+        return shape
+
+    pass
+
+
+class AnchorCache(object):
+    """Parameters and anchors of an SSD network by input shape, computed once per shape.
+
+    At the default input shape of the network, its own parameters are used, which
+    keeps the anchors of the trained model (e.g. the Caffe steps 8, 16, ..., 300).
+    """
+
+    def __init__(self, ssd_net, max_shapes=16):
+        """
+        Args:
+          ssd_net: The SSDNet the anchors are for.
+          max_shapes: Number of shapes kept, the least recently used one is dropped.
+        """
+        self.ssd_net = ssd_net
+        self.max_shapes = max_shapes
+        self.default_shape = tuple(ssd_net.params.img_shape)
+        self.cache = OrderedDict()
+        pass
+
+    def params(self, img_shape, predictions=None):
+        """Network parameters at an input shape.
+
+        Args:
+          img_shape: Input shape (height, width).
+          predictions: Predictions of the network at this shape (Tensors with a static
+            shape or numpy arrays). Without them, the feature shapes are inferred by
+            building the network in a scratch graph.
+        """
+        return self._get(img_shape, predictions)[0]
+
+    def anchors(self, img_shape, predictions=None):
+        """Anchors of every feature layer at an input shape, see `params`."""
+        return self._get(img_shape, predictions)[1]
+
+    def _get(self, img_shape, predictions):
+        key = (int(img_shape[0]), int(img_shape[1]))
+        if key in self.cache:
+            self.cache[key] = self.cache.pop(key)
+            return self.cache[key]
+
+        if key == self.default_shape:
+            params = self.ssd_net.params
+        else:
+            feat_shapes = None if predictions is None else ssd_meta_arch.ssd_feat_shapes_from_net(predictions)
+            params = self.ssd_net.params_for_shape(key, feat_shapes=feat_shapes)
+        anchors = ssd_meta_arch.ssd_anchors_all_layers(key, params.feat_shapes, params.anchor_sizes,
+                                                       params.anchor_ratios, params.anchor_steps,
+                                                       params.anchor_offset)
+        self.cache[key] = (params, anchors)
+        while len(self.cache) > self.max_shapes:
+            self.cache.popitem(last=False)
+        return self.cache[key]
+
+    pass
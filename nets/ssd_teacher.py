@@ -0,0 +1,212 @@
+"""
+Teacher of the SSD distillation (`ssd_meta_arch.ssd_distillation_losses`).
+
+A frozen SSD network, e.g. SSD 512, looks at every training image before the data
+augmentation, at its own input size, and gives the `top_k` boxes it detects with
+their logits. The boxes go through the data augmentation with the groundtruth, then
+are matched to the anchors of the student like the groundtruth, so the teacher and
+the student can have different input sizes and anchors:
+
+  * `SSDTeacher`: the teacher network, in the variable scope `teacher`, not trainable;
+  * `match_to_anchors`: the targets of the distillation losses on the student anchors;
+  * `build_teacher_cache` / `TeacherCache`: the outputs of the teacher for all the images
+    of an image cache (`datasets/image_cache.py`), computed once instead of every epoch.
+
+    <cache_dir>/<split_name>_teacher_bboxes.npy   float32 [num_images, top_k, 4]
+    <cache_dir>/<split_name>_teacher_logits.npy   float16 [num_images, top_k, num_classes]
+    <cache_dir>/<split_name>_teacher.json         the teacher the cache was built with
+
+@@ssd_teacher
+"""
+import os
+import json
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+from datasets import image_cache
+from nets import ssd_common
+from preprocessing import ssd_vgg_preprocessing
+
+
+def _frozen_getter(getter, *args, **kwargs):
+    # 不训练，也不加入学生arg_scope的权重正则（REGULARIZATION_LOSSES）
+    kwargs['trainable'] = False
+    kwargs['regularizer'] = None
+    return getter(*args, **kwargs)
+
+
+class SSDTeacher(object):
+    """A frozen SSD network which gives the boxes it detects in one image."""
+
+    def __init__(self, net_model, ckpt_path, num_classes=21, top_k=200, scope='teacher'):
+        """
+        Args:
+          net_model: The module of the teacher network, e.g. `ssd_vgg_512`.
+          ckpt_path: The checkpoint (or its directory) of the teacher.
+          top_k: Number of boxes given for every image, the most confident ones.
+          scope: Variable scope of the teacher, so that it can have the same network as the student.
+        """
+        self.ssd_net = net_model.SSDNet(net_model.SSDNet.default_params._replace(num_classes=num_classes))
+        self.img_shape = self.ssd_net.params.img_shape
+        self.anchors = self.ssd_net.anchors(self.img_shape)
+        self.ckpt_path = tf.train.latest_checkpoint(ckpt_path) if tf.gfile.IsDirectory(ckpt_path) else ckpt_path
+        self.num_classes = num_classes
+        self.top_k = top_k
+        self.scope = scope
+        pass
+
+    def detections(self, image):
+        """Boxes detected by the teacher in one image.
+
+        Args:
+          image: uint8 Tensor [height, width, 3], before the data augmentation.
+
+        Returns:
+          bboxes: float32 Tensor [top_k, 4] of relative [ymin, xmin, ymax, xmax];
+          logits: float32 Tensor [top_k, num_classes].
+        """
+        with tf.variable_scope(self.scope, custom_getter=_frozen_getter):
+            image_pre, _, _, _ = ssd_vgg_preprocessing.preprocess_for_eval(
+                image, None, None, self.img_shape, 'NHWC', resize=ssd_vgg_preprocessing.Resize.WARP_RESIZE)
+            with slim.arg_scope(self.ssd_net.arg_scope(data_format='NHWC')):
+                _, localisations, logits, _ = self.ssd_net.net(tf.expand_dims(image_pre, 0), is_training=False,
+                                                               update_feat_shapes=False)
+            bboxes = self.ssd_net.bboxes_decode(localisations, self.anchors)
+
+            bboxes = tf.concat([tf.reshape(b, [-1, 4]) for b in bboxes], axis=0)
+            logits = tf.concat([tf.reshape(l, [-1, self.num_classes]) for l in logits], axis=0)
+            # 最可能是物体的top_k个框
+            scores = tf.reduce_max(tf.nn.softmax(logits)[:, 1:], axis=-1)
+            _, indexes = tf.nn.top_k(scores, k=self.top_k)
+            bboxes = tf.clip_by_value(tf.gather(bboxes, indexes), 0., 1.)
+            logits = tf.gather(logits, indexes)
+        return tf.stop_gradient(bboxes), tf.stop_gradient(logits)
+
+    def variables(self):
+        return tf.global_variables(self.scope + '/')
+
+    def restore(self, sess):
+        """Restores the teacher from its checkpoint, whose variables are not in the scope `teacher`."""
+        var_list = {var.op.name[len(self.scope) + 1:]: var for var in self.variables()}
+        tf.train.Saver(var_list=var_list).restore(sess, self.ckpt_path)
+        pass
+
+    pass
+
+
+def match_to_anchors(tindexes, tbboxes, tlogits, anchors, prior_scaling=list([0.1, 0.1, 0.2, 0.2])):
+    """Matches the boxes of the teacher to the student anchors, like the groundtruth.
+
+    Args:
+      tindexes: int64 Tensor [N], the indexes of the teacher boxes kept by the data augmentation;
+      tbboxes: float32 Tensor [N, 4] of these boxes;
+      tlogits: float32 Tensor [top_k, num_classes], the logits of all the teacher boxes;
+      anchors: Anchors of the student.
+
+    Returns:
+      (tlogits, tlocalisations, tscores): Lists of target Tensors, the arguments of
+        `ssd_meta_arch.ssd_distillation_losses`. The anchors matched with no box have
+        a jaccard of 0.
+    """
+    top_k = tlogits.get_shape().as_list()[0]
+    # 编号加1作为类别编码，0表示没有匹配的框
+    tlabels, tlocalisations, tscores = ssd_common.tf_ssd_bboxes_encode(
+        tindexes + 1, tbboxes, anchors, top_k + 1, None, prior_scaling=prior_scaling, scope='teacher_bboxes_encode')
+    tlogits = tf.concat([tf.zeros_like(tlogits[:1]), tlogits], axis=0)
+    return [tf.gather(tlogits, tlabel) for tlabel in tlabels], tlocalisations, tscores
+
+
+def _get_teacher_cache_filenames(cache_dir, split_name):
+    return (os.path.join(cache_dir, split_name + '_teacher_bboxes.npy'),
+            os.path.join(cache_dir, split_name + '_teacher_logits.npy'))
+
+
+def _get_teacher_info_filename(cache_dir, split_name):
+    return os.path.join(cache_dir, split_name + '_teacher.json')
+
+
+def _get_teacher_info(teacher, num_images):
+    return {'ckpt_path': teacher.ckpt_path, 'net': type(teacher.ssd_net).__module__, 'top_k': teacher.top_k,
+            'num_classes': teacher.num_classes, 'num_images': num_images}
+
+
+def has_teacher_cache(cache_dir, split_name, teacher=None):
+    """Specifies whether the teacher cache of a split has been built.
+
+    Args:
+      teacher: If not None, the cache must also have been built with this teacher (same
+        checkpoint, network, top_k and num_classes) for all the images of the image cache.
+    """
+    filenames = _get_teacher_cache_filenames(cache_dir, split_name) + (_get_teacher_info_filename(cache_dir,
+                                                                                                   split_name),)
+    if not all(tf.gfile.Exists(filename) for filename in filenames):
+        return False
+    if teacher is None:
+        return True
+    with tf.gfile.GFile(filenames[-1], 'r') as f:
+        info = json.load(f)
+    return info == _get_teacher_info(teacher, len(image_cache.ImageCache(cache_dir, split_name)))
+
+
+def build_teacher_cache(teacher, cache_dir, split_name):
+    """Runs the teacher on all the images of an image cache and stores its outputs next to it.
+
+    Returns:
+      The number of images.
+    """
+    images = image_cache.ImageCache(cache_dir, split_name)
+    bboxes_filename, logits_filename = _get_teacher_cache_filenames(cache_dir, split_name)
+    info_filename = _get_teacher_info_filename(cache_dir, split_name)
+    if tf.gfile.Exists(info_filename):
+        tf.gfile.Remove(info_filename)
+    with tf.Graph().as_default():
+        image = tf.placeholder(tf.uint8, [None, None, 3])
+        bboxes, logits = teacher.detections(image)
+        with tf.Session(config=tf.ConfigProto(gpu_options=tf.GPUOptions(allow_growth=True))) as sess:
+            teacher.restore(sess)
+            all_bboxes = np.lib.format.open_memmap(bboxes_filename + '.tmp', mode='w+', dtype=np.float32,
+                                                   shape=(len(images), teacher.top_k, 4))
+            all_logits = np.lib.format.open_memmap(logits_filename + '.tmp', mode='w+', dtype=np.float16,
+                                                   shape=(len(images), teacher.top_k, teacher.num_classes))
+            for index in range(len(images)):
+                all_bboxes[index], all_logits[index] = sess.run([bboxes, logits], {image: images.get(index)[0]})
+                pass
+            all_bboxes.flush()
+            all_logits.flush()
+            del all_bboxes, all_logits
+            pass
+        pass
+    # 最后才改名，这样中断的构建不会被当成完整的缓存
+    for filename in [bboxes_filename, logits_filename]:
+        tf.gfile.Rename(filename + '.tmp', filename, overwrite=True)
+    # 记录老师，参数变了时重新构建
+    with tf.gfile.GFile(_get_teacher_info_filename(cache_dir, split_name), 'w') as f:
+        json.dump(_get_teacher_info(teacher, len(images)), f, indent=1, sort_keys=True)
+    return len(images)
+
+
+class TeacherCache(object):
+    """Read access to a teacher cache built by `build_teacher_cache`."""
+
+    def __init__(self, cache_dir, split_name):
+        bboxes_filename, logits_filename = _get_teacher_cache_filenames(cache_dir, split_name)
+        self.bboxes = np.load(bboxes_filename, mmap_mode='r')
+        self.logits = np.load(logits_filename, mmap_mode='r')
+        pass
+
+    def get_tensors(self, index):
+        """Tensors of the teacher outputs of one image, like `SSDTeacher.detections`.
+
+        Args:
+          index: int Tensor, the index of the image in the image cache.
+        """
+        def _get(i):
+            return np.asarray(self.bboxes[i]), np.asarray(self.logits[i], dtype=np.float32)
+
+        bboxes, logits = tf.py_func(_get, [index], [tf.float32, tf.float32], stateful=False)
+        bboxes.set_shape(self.bboxes.shape[1:])
+        logits.set_shape(self.logits.shape[1:])
+        return bboxes, logits
+
+    pass
@@ -28,38 +28,21 @@ Usage:
         outputs, end_points = ssd_vgg.ssd_vgg(inputs)
 @@ssd_vgg
 """
-import math
-from collections import namedtuple
+import functools
 
-import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 
-import tf_extend as tfe
 from nets import custom_layers
-from nets import ssd_common
+from nets import ssd_meta_arch
 from nets import ssd_vgg_300
+from nets.ssd_meta_arch import SSDParams, ssd_multibox_layer
 
 
 # =========================================================================== #
 # SSD class definition.
 # =========================================================================== #
-SSDParams = namedtuple('SSDParameters', ['img_shape',
-                                         'num_classes',
-                                         'no_annotation_label',
-                                         'feat_layers',
-                                         'feat_shapes',
-                                         'anchor_size_bounds',
-                                         'anchor_sizes',
-                                         'anchor_ratios',
-                                         'anchor_steps',
-                                         'anchor_offset',
-                                         'normalizations',
-                                         'prior_scaling'
-                                         ])
-
-
-class SSDNet(object):
+class SSDNet(ssd_meta_arch.SSDNet):
     """Implementation of the SSD VGG-based 512 network.
 
     The default features layers with 512x512 image input are:
@@ -87,36 +70,27 @@ class SSDNet(object):
         anchor_offset=0.5,
         normalizations=[20, -1, -1, -1, -1, -1, -1],
         prior_scaling=[0.1, 0.1, 0.2, 0.2])
+    default_scope = 'ssd_512_vgg'
+    anchor_first_ratio = 0.04
 
-    def __init__(self, params=None):
-        """Init the SSD net with some parameters. Use the default ones
-        if none provided.
+    def __init__(self, params=None, fused_heads=False, depths=None):
         """
-        if isinstance(params, SSDParams):
-            self.params = params
-        else:
-            self.params = SSDNet.default_params
+        Init the SSD net with some parameters. Use the default ones if none provided.
+
+        Args:
+          depths: A dict of convolution scope to its number of channels, see `ssd_vgg_300.SSDNet`.
+        """
+        super(SSDNet, self).__init__(params, fused_heads=fused_heads)
+        self.depths = depths
         pass
 
-    # ======================================================================= #
-    def net(self, inputs, is_training=True, update_feat_shapes=True, dropout_keep_prob=0.5,
-            prediction_fn=slim.softmax, reuse=None, scope='ssd_512_vgg'):
-        r = ssd_net(inputs,
-                    num_classes=self.params.num_classes,
-                    feat_layers=self.params.feat_layers,
-                    anchor_sizes=self.params.anchor_sizes,
-                    anchor_ratios=self.params.anchor_ratios,
-                    normalizations=self.params.normalizations,
-                    is_training=is_training,
-                    dropout_keep_prob=dropout_keep_prob,
-                    prediction_fn=prediction_fn,
-                    reuse=reuse,
-                    scope=scope)
-        # Update feature shapes (try at least!)
-        if update_feat_shapes:
-            shapes = ssd_feat_shapes_from_net(r[0], self.params.feat_shapes)
-            self.params = self.params._replace(feat_shapes=shapes)
-        return r
+    def backbone(self, inputs, is_training=True, dropout_keep_prob=0.5):
+        return ssd_vgg_300.ssd_vgg_backbone(inputs, EXTRA_BLOCKS, is_training=is_training,
+                                            dropout_keep_prob=dropout_keep_prob, dropout=False, depths=self.depths)
+
+    @staticmethod
+    def loss_fn(*args, **kwargs):
+        return ssd_losses(*args, **kwargs)
 
     @staticmethod
     def arg_scope(weight_decay=0.0005, data_format='NHWC'):
@@ -128,267 +102,38 @@ class SSDNet(object):
         """ Caffe arg_scope used for weights importing. """
         return ssd_arg_scope_caffe(caffe_scope)
 
-    # ======================================================================= #
-    def anchors(self, img_shape, dtype=np.float32):
-        """Compute the default anchor boxes, given an image shape.
-        """
-        return ssd_anchors_all_layers(
-            img_shape, self.params.feat_shapes, self.params.anchor_sizes, self.params.anchor_ratios,
-            self.params.anchor_steps, self.params.anchor_offset, dtype)
-
-    def bboxes_encode(self, labels, bboxes, anchors, scope=None):
-        """Encode labels and bounding boxes.
-        """
-        return ssd_common.tf_ssd_bboxes_encode(
-            labels, bboxes, anchors, self.params.num_classes, self.params.no_annotation_label,
-            ignore_threshold=0.5, prior_scaling=self.params.prior_scaling, scope=scope)
-
-    def bboxes_decode(self, feat_localizations, anchors, scope='ssd_bboxes_decode'):
-        """Encode labels and bounding boxes.
-        """
-        return ssd_common.tf_ssd_bboxes_decode(
-            feat_localizations, anchors, prior_scaling=self.params.prior_scaling, scope=scope)
-
-    def detected_bboxes(self, predictions, localisations, select_threshold=None, nms_threshold=0.5,
-                        clipping_bbox=None, top_k=400, keep_top_k=200):
-        """Get the detected bounding boxes from the SSD network output.
-        """
-        # Select top_k bboxes from predictions, and clip
-        rscores, rbboxes = ssd_common.tf_ssd_bboxes_select(
-            predictions, localisations, select_threshold=select_threshold, num_classes=self.params.num_classes)
-        rscores, rbboxes = tfe.bboxes_sort(rscores, rbboxes, top_k=top_k)
-        # Apply NMS algorithm.
-        rscores, rbboxes = tfe.bboxes_nms_batch(rscores, rbboxes, nms_threshold=nms_threshold, keep_top_k=keep_top_k)
-        return rscores, rbboxes
-
-    def losses(self, logits, localisations, gclasses, glocalisations, gscores, match_threshold=0.5,
-               negative_ratio=3., alpha=1., label_smoothing=0., scope='ssd_losses'):
-        """Define the SSD network losses.
-        """
-        return ssd_losses(logits, localisations, gclasses, glocalisations, gscores, match_threshold=match_threshold,
-                          negative_ratio=negative_ratio, alpha=alpha, label_smoothing=label_smoothing, scope=scope)
-
     pass
 
 
 # =========================================================================== #
-# SSD tools...
+# Functional definition of VGG-based SSD 512.
 # =========================================================================== #
-def layer_shape(layer):
-    """Returns the dimensions of a 4D layer tensor.
-    Args:
-      layer: A 4-D Tensor of shape `[height, width, channels]`.
-    Returns:
-      Dimensions that are statically known are python integers,
-        otherwise they are integer scalar tensors.
-    """
-    if layer.get_shape().is_fully_defined():
-        return layer.get_shape().as_list()
-    else:
-        static_shape = layer.get_shape().with_rank(4).as_list()
-        dynamic_shape = tf.unstack(tf.shape(layer), 3)
-        return [s if s is not None else d for s, d in zip(static_shape, dynamic_shape)]
-
-    pass
-
-
-def ssd_size_bounds_to_values(size_bounds, n_feat_layers, img_shape=(512, 512)):
-    """Compute the reference sizes of the anchor boxes from relative bounds.
-    The absolute values are measured in pixels, based on the network
-    default size (512 pixels).
-
-    This function follows the computation performed in the original
-    implementation of SSD in Caffe.
-
-    Return:
-      list of list containing the absolute sizes at each scale. For each scale,
-      the ratios only apply to the first value.
-    """
-    assert img_shape[0] == img_shape[1]
-
-    img_size = img_shape[0]
-    min_ratio = int(size_bounds[0] * 100)
-    max_ratio = int(size_bounds[1] * 100)
-    step = int(math.floor((max_ratio - min_ratio) / (n_feat_layers - 2)))
-    # Start with the following smallest sizes.
-    sizes = [[img_size * 0.04, img_size * 0.1]]
-    for ratio in range(min_ratio, max_ratio + 1, step):
-        sizes.append((img_size * ratio / 100., img_size * (ratio + step) / 100.))
-    return sizes
-
-
-def ssd_feat_shapes_from_net(predictions, default_shapes=None):
-    """Try to obtain the feature shapes from the prediction layers.
-
-    Return:
-      list of feature shapes. Default values if predictions shape not fully
-      determined.
-    """
-    feat_shapes = []
-    for l in predictions:
-        shape = l.get_shape().as_list()[1:4]
-        if None in shape:
-            return default_shapes
-        else:
-            feat_shapes.append(shape)
-    return feat_shapes
-
-
-def ssd_anchor_one_layer(img_shape, feat_shape, sizes, ratios, step, offset=0.5, dtype=np.float32):
-    """Computer SSD default anchor boxes for one feature layer.
-
-    Determine the relative position grid of the centers, and the relative
-    width and height.
+# (名字, 1x1降维通道, 输出通道, 卷积核, 步长, 补零)：block12的4x4卷积对应Caffe的pad=1
+EXTRA_BLOCKS = [('block8', 256, 512, 3, 2, 1), ('block9', 128, 256, 3, 2, 1), ('block10', 128, 256, 3, 2, 1),
+                ('block11', 128, 256, 3, 2, 1), ('block12', 128, 256, 4, 1, 1)]
 
-    Arguments:
-      feat_shape: Feature shape, used for computing relative position grids;
-      size: Absolute reference sizes;
-      ratios: Ratios to use on these features;
-      img_shape: Image shape, used for computing height, width relatively to the
-        former;
-      offset: Grid offset.
+# 每一层单独挖掘难负样本
+ssd_losses = ssd_meta_arch.ssd_losses_per_layer
 
-    Return:
-      y, x, h, w: Relative x and y grids, and height and width.
-    """
-    # Compute the position grid: simple way.
-    # y, x = np.mgrid[0:feat_shape[0], 0:feat_shape[1]]
-    # y = (y.astype(dtype) + offset) / feat_shape[0]
-    # x = (x.astype(dtype) + offset) / feat_shape[1]
-    # Weird SSD-Caffe computation using steps values...
-    y, x = np.mgrid[0:feat_shape[0], 0:feat_shape[1]]
-    y = (y.astype(dtype) + offset) * step / img_shape[0]
-    x = (x.astype(dtype) + offset) * step / img_shape[1]
-
-    # Expand dims to support easy broadcasting.
-    y = np.expand_dims(y, axis=-1)
-    x = np.expand_dims(x, axis=-1)
-
-    # Compute relative height and width.
-    # Tries to follow the original implementation of SSD for the order.
-    num_anchors = len(sizes) + len(ratios)
-    h = np.zeros((num_anchors, ), dtype=dtype)
-    w = np.zeros((num_anchors, ), dtype=dtype)
-    # Add first anchor boxes with ratio=1.
-    h[0] = sizes[0] / img_shape[0]
-    w[0] = sizes[0] / img_shape[1]
-    di = 1
-    if len(sizes) > 1:
-        h[1] = math.sqrt(sizes[0] * sizes[1]) / img_shape[0]
-        w[1] = math.sqrt(sizes[0] * sizes[1]) / img_shape[1]
-        di += 1
-    for i, r in enumerate(ratios):
-        h[i+di] = sizes[0] / img_shape[0] / math.sqrt(r)
-        w[i+di] = sizes[0] / img_shape[1] * math.sqrt(r)
-    return y, x, h, w
 
-
-def ssd_anchors_all_layers(img_shape, layers_shape, anchor_sizes, anchor_ratios,
-                           anchor_steps, offset=0.5, dtype=np.float32):
-    """Compute anchor boxes for all feature layers.
-    """
-    layers_anchors = []
-    for i, s in enumerate(layers_shape):
-        anchor_bboxes = ssd_anchor_one_layer(img_shape, s, anchor_sizes[i], anchor_ratios[i],
-                                             anchor_steps[i], offset=offset, dtype=dtype)
-        layers_anchors.append(anchor_bboxes)
-    return layers_anchors
-
-
-# =========================================================================== #
-# Functional definition of VGG-based SSD 512.
-# =========================================================================== #
 def ssd_net(inputs,
             num_classes=SSDNet.default_params.num_classes,
             feat_layers=SSDNet.default_params.feat_layers,
             anchor_sizes=SSDNet.default_params.anchor_sizes,
             anchor_ratios=SSDNet.default_params.anchor_ratios,
             normalizations=SSDNet.default_params.normalizations,
-            is_training=True, dropout_keep_prob=0.5, prediction_fn=slim.softmax, reuse=None, scope='ssd_512_vgg'):
+            is_training=True, dropout_keep_prob=0.5, prediction_fn=slim.softmax, reuse=None, scope='ssd_512_vgg',
+            fused_heads=False, depths=None):
     """SSD net definition.
     """
-    # End_points collect relevant activations for external use.
-    end_points = {}
-    with tf.variable_scope(scope, 'ssd_512_vgg', [inputs], reuse=reuse):
-        # Original VGG-16 blocks.
-        net = slim.repeat(inputs, 2, slim.conv2d, 64, [3, 3], scope='conv1')
-        end_points['block1'] = net
-        net = slim.max_pool2d(net, [2, 2], scope='pool1')
-        # Block 2.
-        net = slim.repeat(net, 2, slim.conv2d, 128, [3, 3], scope='conv2')
-        end_points['block2'] = net
-        net = slim.max_pool2d(net, [2, 2], scope='pool2')
-        # Block 3.
-        net = slim.repeat(net, 3, slim.conv2d, 256, [3, 3], scope='conv3')
-        end_points['block3'] = net
-        net = slim.max_pool2d(net, [2, 2], scope='pool3')
-        # Block 4.
-        net = slim.repeat(net, 3, slim.conv2d, 512, [3, 3], scope='conv4')
-        end_points['block4'] = net
-        net = slim.max_pool2d(net, [2, 2], scope='pool4')
-        # Block 5.
-        net = slim.repeat(net, 3, slim.conv2d, 512, [3, 3], scope='conv5')
-        end_points['block5'] = net
-        net = slim.max_pool2d(net, [3, 3], 1, scope='pool5')
-
-        # Additional SSD blocks.
-        # Block 6: let's dilate the hell out of it!
-        net = slim.conv2d(net, 1024, [3, 3], rate=6, scope='conv6')
-        end_points['block6'] = net
-        # Block 7: 1x1 conv. Because the fuck.
-        net = slim.conv2d(net, 1024, [1, 1], scope='conv7')
-        end_points['block7'] = net
-
-        # Block 8/9/10/11: 1x1 and 3x3 convolutions stride 2 (except lasts).
-        end_point = 'block8'
-        with tf.variable_scope(end_point):
-            net = slim.conv2d(net, 256, [1, 1], scope='conv1x1')
-            net = custom_layers.pad2d(net, pad=(1, 1))
-            net = slim.conv2d(net, 512, [3, 3], stride=2, scope='conv3x3', padding='VALID')
-        end_points[end_point] = net
-        end_point = 'block9'
-        with tf.variable_scope(end_point):
-            net = slim.conv2d(net, 128, [1, 1], scope='conv1x1')
-            net = custom_layers.pad2d(net, pad=(1, 1))
-            net = slim.conv2d(net, 256, [3, 3], stride=2, scope='conv3x3', padding='VALID')
-        end_points[end_point] = net
-        end_point = 'block10'
-        with tf.variable_scope(end_point):
-            net = slim.conv2d(net, 128, [1, 1], scope='conv1x1')
-            net = custom_layers.pad2d(net, pad=(1, 1))
-            net = slim.conv2d(net, 256, [3, 3], stride=2, scope='conv3x3', padding='VALID')
-        end_points[end_point] = net
-        end_point = 'block11'
-        with tf.variable_scope(end_point):
-            net = slim.conv2d(net, 128, [1, 1], scope='conv1x1')
-            net = custom_layers.pad2d(net, pad=(1, 1))
-            net = slim.conv2d(net, 256, [3, 3], stride=2, scope='conv3x3', padding='VALID')
-        end_points[end_point] = net
-        end_point = 'block12'
-        with tf.variable_scope(end_point):
-            net = slim.conv2d(net, 128, [1, 1], scope='conv1x1')
-            net = custom_layers.pad2d(net, pad=(1, 1))
-            net = slim.conv2d(net, 256, [4, 4], scope='conv4x4', padding='VALID')
-            # Fix padding to match Caffe version (pad=1).
-            # pad_shape = [(i-j) for i, j in zip(layer_shape(net), [0, 1, 1, 0])]
-            # net = tf.slice(net, [0, 0, 0, 0], pad_shape, name='caffe_pad')
-        end_points[end_point] = net
-
-        # Prediction and localisations layers.
-        predictions = []
-        logits = []
-        localisations = []
-        for i, layer in enumerate(feat_layers):
-            with tf.variable_scope(layer + '_box'):
-                p, l = ssd_vgg_300.ssd_multibox_layer(end_points[layer], num_classes, anchor_sizes[i],
-                                                      anchor_ratios[i], normalizations[i])
-            predictions.append(prediction_fn(p))
-            logits.append(p)
-            localisations.append(l)
-
-        return predictions, localisations, logits, end_points
-
-    pass
+    multibox_layer = ssd_meta_arch.ssd_multibox_layer_fused if fused_heads else ssd_multibox_layer
+    backbone = functools.partial(ssd_vgg_300.ssd_vgg_backbone, extra_blocks=EXTRA_BLOCKS, dropout=False,
+                                 depths=depths)
+    return ssd_meta_arch.ssd_net(inputs, backbone, multibox_layer, num_classes=num_classes,
+                                 feat_layers=feat_layers, anchor_sizes=anchor_sizes, anchor_ratios=anchor_ratios,
+                                 normalizations=normalizations, is_training=is_training,
+                                 dropout_keep_prob=dropout_keep_prob, prediction_fn=prediction_fn, reuse=reuse,
+                                 scope=scope, default_scope='ssd_512_vgg')
 
 ssd_net.default_image_size = 512
 
@@ -435,91 +180,3 @@ def ssd_arg_scope_caffe(caffe_scope):
                     return sc
 
     pass
-
-
-# =========================================================================== #
-# SSD loss function.
-# =========================================================================== #
-def ssd_losses(logits, localisations, gclasses, glocalisations, gscores, match_threshold=0.5,
-               negative_ratio=3., alpha=1., label_smoothing=0., scope=None):
-    """Loss functions for training the SSD 300 VGG network.
-
-    This function defines the different loss components of the SSD, and
-    adds them to the TF loss collection.
-
-    Arguments:
-      logits: (list of) predictions logits Tensors;
-      localisations: (list of) localisations Tensors;
-      gclasses: (list of) groundtruth labels Tensors;
-      glocalisations: (list of) groundtruth localisations Tensors;
-      gscores: (list of) groundtruth score Tensors;
-    """
-    with tf.name_scope(scope, 'ssd_losses'):
-        l_cross_pos = []
-        l_cross_neg = []
-        l_loc = []
-        for i in range(len(logits)):
-            dtype = logits[i].dtype
-            with tf.name_scope('block_%i' % i):
-                # Determine weights Tensor.
-                pmask = gscores[i] > match_threshold
-                fpmask = tf.cast(pmask, dtype)
-                n_positives = tf.reduce_sum(fpmask)
-
-                # Negative mask.
-                no_classes = tf.cast(pmask, tf.int32)
-                predictions = slim.softmax(logits[i])
-                nmask = tf.logical_and(tf.logical_not(pmask), gscores[i] > -0.5)
-                fnmask = tf.cast(nmask, dtype)
-                nvalues = tf.where(nmask, predictions[:, :, :, :, 0], 1. - fnmask)
-                nvalues_flat = tf.reshape(nvalues, [-1])
-                # Number of negative entries to select.
-                n_neg = tf.cast(negative_ratio * n_positives, tf.int32)
-                n_neg = tf.maximum(n_neg, tf.size(nvalues_flat) // 8)
-                n_neg = tf.maximum(n_neg, tf.shape(nvalues)[0] * 4)
-                max_neg_entries = 1 + tf.cast(tf.reduce_sum(fnmask), tf.int32)
-                n_neg = tf.minimum(n_neg, max_neg_entries)
-
-                val, idxes = tf.nn.top_k(-nvalues_flat, k=n_neg)
-                minval = val[-1]
-                # Final negative mask.
-                nmask = tf.logical_and(nmask, -nvalues > minval)
-                fnmask = tf.cast(nmask, dtype)
-
-                # Add cross-entropy loss.
-                with tf.name_scope('cross_entropy_pos'):
-                    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits[i], labels=gclasses[i])
-                    loss = tf.losses.compute_weighted_loss(loss, fpmask)
-                    l_cross_pos.append(loss)
-
-                with tf.name_scope('cross_entropy_neg'):
-                    loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits[i], labels=no_classes)
-                    loss = tf.losses.compute_weighted_loss(loss, fnmask)
-                    l_cross_neg.append(loss)
-
-                # Add localization loss: smooth L1, L2, ...
-                with tf.name_scope('localization'):
-                    # Weights Tensor: positive mask + random negative.
-                    weights = tf.expand_dims(alpha * fpmask, axis=-1)
-                    loss = custom_layers.abs_smooth(localisations[i] - glocalisations[i])
-                    loss = tf.losses.compute_weighted_loss(loss, weights)
-                    l_loc.append(loss)
-
-            pass
-
-        # Additional total losses...
-        with tf.name_scope('total'):
-            total_cross_pos = tf.add_n(l_cross_pos, 'cross_entropy_pos')
-            total_cross_neg = tf.add_n(l_cross_neg, 'cross_entropy_neg')
-            total_cross = tf.add(total_cross_pos, total_cross_neg, 'cross_entropy')
-            total_loc = tf.add_n(l_loc, 'localization')
-
-            # Add to EXTRA LOSSES TF.collection
-            tf.add_to_collection('EXTRA_LOSSES', total_cross_pos)
-            tf.add_to_collection('EXTRA_LOSSES', total_cross_neg)
-            tf.add_to_collection('EXTRA_LOSSES', total_cross)
-            tf.add_to_collection('EXTRA_LOSSES', total_loc)
-
-        pass
-
-    pass